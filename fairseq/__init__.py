@@ -36,6 +36,7 @@ import fairseq.models  # noqa
 import fairseq.modules  # noqa
 import fairseq.optim  # noqa
 import fairseq.optim.lr_scheduler  # noqa
+import fairseq.optim.noise_curriculum  # noqa
 import fairseq.pdb  # noqa
 import fairseq.scoring  # noqa
 import fairseq.tasks  # noqa
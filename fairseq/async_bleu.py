@@ -0,0 +1,142 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import queue
+
+import torch
+import torch.multiprocessing as mp
+
+from fairseq import tasks, utils
+from fairseq.logging import metrics
+
+
+def _bleu_worker(cfg, subsets, device, jobs, results):
+    """Decode the validation subsets with every snapshot received on *jobs*
+    and put ``(num_updates, epoch, {subset: {metric: score}})`` on
+    *results*."""
+    utils.import_user_module(cfg.common)
+    device = torch.device(device)
+    if device.type == "cuda":
+        torch.cuda.set_device(device)
+
+    task = tasks.setup_task(cfg.task)
+    for subset in subsets:
+        task.load_dataset(subset, combine=cfg.dataset.combine_valid_subsets, epoch=1)
+    model = task.build_model(cfg.model)
+    if cfg.common.fp16 and device.type == "cuda":
+        model.half()
+    model.to(device).eval()
+    max_positions = utils.resolve_max_positions(
+        task.max_positions(), model.max_positions()
+    )
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        num_updates, epoch, state_dict = job
+        model.load_state_dict(state_dict)
+        del state_dict
+
+        stats = {}
+        for subset in subsets:
+            itr = task.get_batch_iterator(
+                dataset=task.dataset(subset),
+                max_tokens=cfg.dataset.max_tokens_valid,
+                max_sentences=cfg.dataset.batch_size_valid,
+                max_positions=max_positions,
+                ignore_invalid_inputs=cfg.dataset.skip_invalid_size_inputs_valid_test,
+                required_batch_size_multiple=cfg.dataset.required_batch_size_multiple,
+                seed=cfg.common.seed,
+            ).next_epoch_itr(shuffle=False, set_dataset_epoch=False)
+            logging_outputs = []
+            with torch.no_grad():
+                for sample in itr:
+                    sample = utils.move_to_cuda(sample, device=device)
+                    logging_outputs.append(task.valid_bleu_step(sample, model))
+            with metrics.aggregate(new_root=True) as agg:
+                task.reduce_bleu_metrics(logging_outputs)
+            stats[subset] = dict(agg.get_smoothed_values())
+        results.put((num_updates, epoch, stats))
+
+
+class AsyncBleuValidator(object):
+    """Compute the validation BLEU (``--eval-bleu``) in a background process.
+
+    :func:`submit` snapshots the model weights into shared CPU memory and
+    returns immediately; the background process, which holds its own copy of
+    the task, the validation sets and the model on *device*, decodes the
+    validation subsets with the snapshot. Finished results are collected
+    with :func:`poll`, in submission order.
+
+    Args:
+        cfg (FairseqConfig): training config
+        subsets (List[str]): validation subsets
+        device (str): device of the background process, e.g. ``cpu`` or
+            ``cuda:1``
+        max_pending (int, optional): block :func:`submit` while this many
+            snapshots are still being decoded (default: 2)
+    """
+
+    def __init__(self, cfg, subsets, device="cpu", max_pending=2):
+        self.max_pending = max_pending
+        ctx = mp.get_context("spawn")
+        self.jobs = ctx.Queue()
+        self.results = ctx.Queue()
+        self.process = ctx.Process(
+            target=_bleu_worker,
+            args=(cfg, subsets, device, self.jobs, self.results),
+            daemon=True,
+        )
+        self.process.start()
+        self.num_pending = 0
+        self._ready = []
+
+    def submit(self, model, num_updates, epoch):
+        """Queue the current weights of *model* for decoding."""
+        while self.num_pending >= self.max_pending:
+            self._ready.append(self._get(block=True))
+        state_dict = {
+            k: v.detach().to("cpu", copy=True).share_memory_()
+            for k, v in model.state_dict().items()
+        }
+        self.jobs.put((num_updates, epoch, state_dict))
+        self.num_pending += 1
+
+    def _get(self, block):
+        while True:
+            try:
+                result = self.results.get(block=block, timeout=10 if block else None)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    raise RuntimeError(
+                        "the background BLEU process exited with code {}".format(
+                            self.process.exitcode
+                        )
+                    )
+                if not block:
+                    return None
+                continue
+            self.num_pending -= 1
+            return result
+
+    def poll(self, block=False):
+        """Return the finished ``(num_updates, epoch, stats)`` results, where
+        *stats* maps every validation subset to its BLEU metrics. With
+        *block*, wait for all pending snapshots."""
+        ready, self._ready = self._ready, []
+        while self.num_pending > 0:
+            result = self._get(block=block)
+            if result is None:
+                break
+            ready.append(result)
+        return ready
+
+    def close(self):
+        """Wait for the pending results and stop the background process."""
+        results = self.poll(block=True)
+        self.jobs.put(None)
+        self.process.join()
+        return results
@@ -0,0 +1,122 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Cost of collating one training batch of a
+:class:`~fairseq.data.LanguagePairDataset` over memory-mapped (``--dataset-impl
+mmap``) data: one tensor per sentence merged by
+:func:`~fairseq.data.language_pair_dataset.collate`, against the vectorized
+gather of :func:`~fairseq.data.LanguagePairDataset.collate_batch`, which is
+also checked to build the same batch.
+"""
+
+import argparse
+import os
+import tempfile
+
+import numpy as np
+import torch
+from torch.utils import benchmark
+
+from fairseq.data import Dictionary, LanguagePairDataset, indexed_dataset
+
+
+def make_dataset(path, lengths, vocab, rng):
+    builder = indexed_dataset.MMapIndexedDatasetBuilder(
+        indexed_dataset.data_file_path(path),
+        dtype=indexed_dataset.best_fitting_int_dtype(vocab),
+    )
+    for length in lengths:
+        tokens = rng.randint(4, vocab, length)
+        tokens[-1] = 2  # eos
+        builder.add_item(torch.from_numpy(tokens))
+    builder.finalize(indexed_dataset.index_file_path(path))
+    return indexed_dataset.MMapIndexedDataset(path)
+
+
+def make_dictionary(vocab):
+    d = Dictionary()
+    for i in range(vocab - d.nspecial):
+        d.add_symbol("w{}".format(i))
+    return d
+
+
+def collate(dataset, indices):
+    return dataset.collater(dataset.__getitems__(indices))
+
+
+def assert_equal_batches(expected, actual):
+    # sentences of equal source length may come in any order
+    expected_order, actual_order = expected["id"].argsort(), actual["id"].argsort()
+    assert torch.equal(expected["id"][expected_order], actual["id"][actual_order])
+    assert expected["ntokens"] == actual["ntokens"]
+    expected_items = [("target", expected["target"])]
+    expected_items += list(expected["net_input"].items())
+    actual_items = dict(actual["net_input"], target=actual["target"])
+    for key, value in expected_items:
+        assert torch.equal(
+            value[expected_order], actual_items[key][actual_order]
+        ), key
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--num-sentences", type=int, default=20000)
+    parser.add_argument("--length-mu", type=float, default=3.0)
+    parser.add_argument("--length-sigma", type=float, default=0.6)
+    parser.add_argument("--max-len", type=int, default=250)
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[32, 128, 512])
+    parser.add_argument("--vocab", type=int, default=10000)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    d = make_dictionary(args.vocab)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        data = []
+        for split in ["src", "tgt"]:
+            lengths = rng.lognormal(
+                args.length_mu, args.length_sigma, args.num_sentences
+            )
+            lengths = np.clip(lengths.astype(np.int64), 2, args.max_len)
+            data.append(
+                make_dataset(os.path.join(tmpdir, split), lengths, len(d), rng)
+            )
+        src, tgt = data
+        dataset = LanguagePairDataset(src, src.sizes, d, tgt, tgt.sizes, d)
+        assert dataset.batch_read
+        # the per-sentence path of collater()
+        reference = LanguagePairDataset(src, src.sizes, d, tgt, tgt.sizes, d)
+        reference.batch_read = False
+
+        results = []
+        for bsz in args.batch_size:
+            indices = rng.choice(len(dataset), bsz, replace=False)
+            assert_equal_batches(collate(reference, indices), collate(dataset, indices))
+
+            globals_ = {
+                "collate": collate,
+                "reference": reference,
+                "dataset": dataset,
+                "indices": indices,
+            }
+            for description, stmt in [
+                ("per sentence", "collate(reference, indices)"),
+                ("vectorized", "collate(dataset, indices)"),
+            ]:
+                results.append(
+                    benchmark.Timer(
+                        stmt=stmt,
+                        globals=globals_,
+                        label="collate {} sentences".format(args.num_sentences),
+                        sub_label="bsz={}".format(bsz),
+                        description=description,
+                    ).blocked_autorange(min_run_time=0.5)
+                )
+
+    compare = benchmark.Compare(results)
+    compare.print()
+
+
+if __name__ == "__main__":
+    main()
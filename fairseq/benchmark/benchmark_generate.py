@@ -0,0 +1,145 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Beam search latency of a (randomly initialized) robust transformer against
+the output length, as run by ``fairseq-generate``.
+
+Every hypothesis is forced to the requested length (``--min-len`` =
+``--max-len-b``), so that the cost of the incremental decoder state, which
+grows with the number of decoded steps, can be read off the latency per
+output token. Every length runs in a fresh process; the results are written
+as JSON.
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import sys
+import time
+from argparse import Namespace
+
+import torch
+
+import fairseq
+from fairseq import options, tasks, utils
+from fairseq.dataclass.utils import convert_namespace_to_omegaconf
+
+ARCH = "transformer_iwslt_de_en_robust_all"
+SEED = 1
+
+
+def bench_generate(out_len, bsz, src_len, vocab, beam, device, repeat, arch):
+    input_args = [
+        "--task", "dummy_mt",
+        "--dict-size", str(vocab),
+        "--src-len", str(src_len),
+        "--tgt-len", str(out_len),
+        "--dataset-size", str(bsz),
+        "--batch-size", str(bsz),
+        "--arch", arch,
+        "--share-all-embeddings",
+        "--max-target-positions", str(max(1024, out_len + 2)),
+        "--seed", str(SEED),
+    ]  # fmt: skip
+    if device.type == "cpu":
+        input_args.append("--cpu")
+    parser = options.get_training_parser()
+    args = options.parse_args_and_arch(parser, input_args=input_args)
+    cfg = convert_namespace_to_omegaconf(args)
+    utils.set_torch_seed(SEED)
+
+    task = tasks.setup_task(cfg.task)
+    task.load_dataset("test")
+    model = task.build_model(cfg.model)
+    model.to(device).eval()
+    generator = task.build_generator(
+        [model], Namespace(beam=beam, max_len_a=0, max_len_b=out_len, min_len=out_len)
+    )
+    sample = task.dataset("test").collater(list(range(bsz)))
+    sample = utils.move_to_cuda(sample, device=device)
+
+    def step():
+        with torch.no_grad():
+            task.inference_step(generator, [model], sample)
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+
+    step()  # warmup
+    start = time.perf_counter()
+    for _ in range(repeat):
+        step()
+    seconds = (time.perf_counter() - start) / repeat
+    return {
+        "out_len": out_len,
+        "seconds": seconds,
+        "ms_per_output_token": 1000 * seconds / out_len,
+    }
+
+
+def _isolated(fn, *args):
+    """Run *fn* in a fresh process."""
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        return pool.apply(fn, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--out-len", type=int, nargs="+", default=[16, 32, 64, 128, 256]
+    )
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--src-len", type=int, default=32)
+    parser.add_argument("--vocab", type=int, default=8000)
+    parser.add_argument("--beam", type=int, default=5)
+    parser.add_argument("--arch", default=ARCH)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cuda", action="store_true")
+    parser.add_argument(
+        "--output", default=None, help="write the JSON report here (default: stdout)"
+    )
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if args.cuda else "cpu")
+    results = []
+    for out_len in args.out_len:
+        result = _isolated(
+            bench_generate,
+            out_len,
+            args.batch_size,
+            args.src_len,
+            args.vocab,
+            args.beam,
+            device,
+            args.repeat,
+            args.arch,
+        )
+        print(json.dumps(result), file=sys.stderr)
+        results.append(result)
+
+    report = {
+        "fairseq": fairseq.__version__,
+        "torch": torch.__version__,
+        "python": platform.python_version(),
+        "device": torch.cuda.get_device_name() if args.cuda else platform.processor(),
+        "num_threads": torch.get_num_threads(),
+        "batch_size": args.batch_size,
+        "src_len": args.src_len,
+        "beam": args.beam,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
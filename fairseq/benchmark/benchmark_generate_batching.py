@@ -0,0 +1,203 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Beam search throughput of a (randomly initialized) robust transformer on
+a test set, batched by source tokens (``--max-tokens``) or by decoding cost
+(``--gen-batch-budget``), as done by ``fairseq-generate``.
+
+The source lengths are read from a text file (e.g. the BPE'd IWSLT14 de-en
+test set, one sentence per line) or drawn from a log-normal distribution of
+a similar size and shape. A random model rarely produces EOS, so every batch
+runs to its maximum output length: the worst case that the decoding-cost
+budget is meant to bound. Every setting runs in a fresh process; the results
+are written as JSON.
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import sys
+import time
+from argparse import Namespace
+
+import numpy as np
+import torch
+
+import fairseq
+from fairseq import options, tasks, utils
+from fairseq.data import GenerationCostDataset, LanguagePairDataset
+from fairseq.dataclass.utils import convert_namespace_to_omegaconf
+
+ARCH = "transformer_iwslt_de_en_robust_all"
+SEED = 1
+
+
+def source_lengths(args):
+    if args.lengths is not None:
+        with open(args.lengths, encoding="utf-8") as f:
+            # +1 for EOS
+            return np.array([len(line.split()) + 1 for line in f], dtype=np.int64)
+    rng = np.random.RandomState(SEED)
+    lengths = rng.lognormal(args.length_mu, args.length_sigma, args.num_sentences)
+    return np.clip(lengths.astype(np.int64), 2, args.max_src_len)
+
+
+def bench_batching(lengths, max_tokens, budget, args, device):
+    max_out_len = int(lengths.max() * args.max_len_a + args.max_len_b)
+    input_args = [
+        "--task", "dummy_mt",
+        "--dict-size", str(args.vocab),
+        "--src-len", str(lengths.max()),
+        "--tgt-len", str(max_out_len),
+        "--arch", args.arch,
+        "--share-all-embeddings",
+        "--max-target-positions", str(max(1024, max_out_len + 2)),
+        "--seed", str(SEED),
+    ]  # fmt: skip
+    if device.type == "cpu":
+        input_args.append("--cpu")
+    parser = options.get_training_parser()
+    model_args = options.parse_args_and_arch(parser, input_args=input_args)
+    cfg = convert_namespace_to_omegaconf(model_args)
+    utils.set_torch_seed(SEED)
+
+    task = tasks.setup_task(cfg.task)
+    model = task.build_model(cfg.model)
+    model.to(device).eval()
+    generator = task.build_generator(
+        [model],
+        Namespace(beam=args.beam, max_len_a=args.max_len_a, max_len_b=args.max_len_b),
+    )
+
+    src_dict = task.source_dictionary
+    rng = np.random.RandomState(SEED)
+    src_tokens = [
+        torch.from_numpy(
+            rng.randint(src_dict.nspecial, len(src_dict), length - 1)
+        ).long()
+        for length in lengths
+    ]
+    src_tokens = [torch.cat([t, t.new([src_dict.eos()])]) for t in src_tokens]
+    dataset = LanguagePairDataset(src_tokens, lengths, src_dict)
+    if budget is not None:
+        dataset = GenerationCostDataset(
+            dataset,
+            beam_size=args.beam,
+            max_len_a=args.max_len_a,
+            max_len_b=args.max_len_b,
+            max_len=model.max_decoder_positions() - 1,
+        )
+        max_tokens = budget
+    itr = task.get_batch_iterator(
+        dataset=dataset,
+        max_tokens=max_tokens,
+        max_positions=utils.resolve_max_positions(
+            task.max_positions(), model.max_positions()
+        ),
+        seed=SEED,
+    ).next_epoch_itr(shuffle=False)
+
+    num_batches, decoding_cost, peak_cost = 0, 0, 0
+    start = time.perf_counter()
+    for sample in itr:
+        sample = utils.move_to_cuda(sample, device=device)
+        with torch.no_grad():
+            task.inference_step(generator, [model], sample)
+        bsz = sample["net_input"]["src_tokens"].size(0)
+        src_len = int(sample["net_input"]["src_lengths"].max())
+        cost = bsz * args.beam * int(src_len * args.max_len_a + args.max_len_b)
+        num_batches += 1
+        decoding_cost += cost
+        peak_cost = max(peak_cost, cost)
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    seconds = time.perf_counter() - start
+    return {
+        "max_tokens": max_tokens if budget is None else None,
+        "gen_batch_budget": budget,
+        "seconds": seconds,
+        "sentences_per_second": len(lengths) / seconds,
+        "num_batches": num_batches,
+        # beam * maximum output length * batch size, summed over the batches
+        "decoding_cost": decoding_cost,
+        "peak_batch_cost": peak_cost,
+        "peak_memory_mb": (
+            torch.cuda.max_memory_allocated() / 2**20 if device.type == "cuda" else None
+        ),
+    }
+
+
+def _isolated(fn, *args):
+    """Run *fn* in a fresh process."""
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        return pool.apply(fn, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--lengths",
+        default=None,
+        help="text file whose whitespace-separated line lengths are the source "
+        "lengths (default: log-normal lengths)",
+    )
+    # IWSLT14 de-en test set size
+    parser.add_argument("--num-sentences", type=int, default=6750)
+    parser.add_argument("--length-mu", type=float, default=3.0)
+    parser.add_argument("--length-sigma", type=float, default=0.6)
+    parser.add_argument("--max-src-len", type=int, default=250)
+    parser.add_argument("--max-tokens", type=int, nargs="+", default=[4096])
+    parser.add_argument(
+        "--gen-batch-budget", type=int, nargs="+", default=[50000, 100000, 200000]
+    )
+    parser.add_argument("--beam", type=int, default=5)
+    parser.add_argument("--max-len-a", type=float, default=1.2)
+    parser.add_argument("--max-len-b", type=int, default=10)
+    parser.add_argument("--vocab", type=int, default=8000)
+    parser.add_argument("--arch", default=ARCH)
+    parser.add_argument("--cuda", action="store_true")
+    parser.add_argument(
+        "--output", default=None, help="write the JSON report here (default: stdout)"
+    )
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if args.cuda else "cpu")
+    lengths = source_lengths(args)
+    settings = [(max_tokens, None) for max_tokens in args.max_tokens] + [
+        (None, budget) for budget in args.gen_batch_budget
+    ]
+    results = []
+    for max_tokens, budget in settings:
+        result = _isolated(bench_batching, lengths, max_tokens, budget, args, device)
+        print(json.dumps(result), file=sys.stderr)
+        results.append(result)
+
+    report = {
+        "fairseq": fairseq.__version__,
+        "torch": torch.__version__,
+        "python": platform.python_version(),
+        "device": torch.cuda.get_device_name() if args.cuda else platform.processor(),
+        "num_threads": torch.get_num_threads(),
+        "num_sentences": len(lengths),
+        "mean_src_len": float(lengths.mean()),
+        "max_src_len": int(lengths.max()),
+        "beam": args.beam,
+        "max_len_a": args.max_len_a,
+        "max_len_b": args.max_len_b,
+        "results": results,
+    }
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
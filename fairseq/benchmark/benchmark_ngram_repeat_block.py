@@ -0,0 +1,111 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Cost of one beam search step of ``--no-repeat-ngram-size`` blocking
+without the CUDA extension: the tensor implementation of
+:class:`~fairseq.ngram_repeat_block.NGramRepeatBlock` against the
+per-hypothesis Python loop it replaces, which is also checked to ban the
+same tokens.
+"""
+
+import argparse
+import math
+from typing import List
+
+import torch
+from torch.utils import benchmark
+
+from fairseq.ngram_repeat_block import NGramRepeatBlock
+
+
+def no_repeat_ngram_loop(tokens, lprobs, bsz: int, beam_size: int, step: int, n: int):
+    """The former Python implementation, on the first step + 1 tokens."""
+    banned_tokens = [
+        torch.jit.annotate(List[int], []) for bbsz_idx in range(bsz * beam_size)
+    ]
+    if step + 2 - n >= 0:
+        cpu_tokens: List[List[int]] = tokens[:, : step + 1].cpu().tolist()
+        check_start_pos = step + 2 - n
+        for bbsz_idx in range(bsz * beam_size):
+            ngram_to_check = cpu_tokens[bbsz_idx][-(n - 1) :]
+            for i in range(check_start_pos):
+                if ngram_to_check == cpu_tokens[bbsz_idx][i : i + n - 1]:
+                    banned_tokens[bbsz_idx].append(cpu_tokens[bbsz_idx][i + n - 1])
+    for bbsz_idx in range(bsz * beam_size):
+        lprobs[bbsz_idx][
+            torch.tensor(banned_tokens[bbsz_idx], dtype=torch.int64)
+        ] = torch.tensor(-math.inf).to(lprobs)
+    return lprobs
+
+
+def make_inputs(bsz, beam_size, step, vocab, device):
+    # a small vocabulary in the prefix, so that ngrams do repeat
+    tokens = torch.randint(4, 24, (bsz * beam_size, step + 1), device=device)
+    lprobs = torch.randn(bsz * beam_size, vocab, device=device).log_softmax(dim=-1)
+    return tokens, lprobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--no-repeat-ngram-size", type=int, default=3)
+    parser.add_argument("--beam", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[16, 64])
+    parser.add_argument("--step", type=int, nargs="+", default=[8, 32, 64, 128, 256])
+    parser.add_argument("--vocab", type=int, default=8000)
+    parser.add_argument("--cuda", action="store_true")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    device = torch.device("cuda" if args.cuda else "cpu")
+    n = args.no_repeat_ngram_size
+    blocker = NGramRepeatBlock(n, use_extension=False)
+
+    results = []
+    for bsz in args.batch_size:
+        for step in args.step:
+            tokens, lprobs = make_inputs(bsz, args.beam, step, args.vocab, device)
+            expected = no_repeat_ngram_loop(
+                tokens, lprobs.clone(), bsz, args.beam, step, n
+            )
+            actual = blocker(tokens, lprobs.clone(), bsz, args.beam, step)
+            assert torch.equal(expected, actual), "bans differ at step {}".format(step)
+
+            label = "no_repeat_ngram_size={} beam={}".format(n, args.beam)
+            sub_label = "bsz={} step={}".format(bsz, step)
+            globals_ = {
+                "loop": no_repeat_ngram_loop,
+                "blocker": blocker,
+                "tokens": tokens,
+                "lprobs": lprobs,
+                "bsz": bsz,
+                "beam": args.beam,
+                "step": step,
+                "n": n,
+            }
+            results.append(
+                benchmark.Timer(
+                    stmt="loop(tokens, lprobs.clone(), bsz, beam, step, n)",
+                    globals=globals_,
+                    label=label,
+                    sub_label=sub_label,
+                    description="python loop",
+                ).blocked_autorange(min_run_time=0.5)
+            )
+            results.append(
+                benchmark.Timer(
+                    stmt="blocker(tokens, lprobs.clone(), bsz, beam, step)",
+                    globals=globals_,
+                    label=label,
+                    sub_label=sub_label,
+                    description="tensor",
+                ).blocked_autorange(min_run_time=0.5)
+            )
+
+    compare = benchmark.Compare(results)
+    compare.print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Padding efficiency (real tokens / padded source and target positions) of
+the training batches of :func:`~fairseq.data.data_utils.batch_by_size` and of
+:func:`~fairseq.data.data_utils.batch_by_padding` with several
+``--max-padding-ratio``, as built by a
+:class:`~fairseq.data.LanguagePairDataset` for ``--max-tokens``.
+
+The lengths are read from a parallel text (e.g. the BPE'd IWSLT14 de-en
+training set, one sentence per line) or drawn from log-normal distributions
+of a similar size and shape, with target lengths correlated to the source
+lengths. The results, including the time spent batching (``seconds``, and
+``relative_seconds`` to :func:`~fairseq.data.data_utils.batch_by_size`), are
+written as JSON.
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from fairseq.data import data_utils
+
+SEED = 1
+
+
+def text_lengths(path):
+    with open(path, encoding="utf-8") as f:
+        # +1 for EOS
+        return np.array([len(line.split()) + 1 for line in f], dtype=np.int64)
+
+
+def pair_lengths(args):
+    if args.src is not None:
+        src, tgt = text_lengths(args.src), text_lengths(args.tgt)
+        assert len(src) == len(tgt), "the source and target differ in length"
+        return src, tgt
+    rng = np.random.RandomState(SEED)
+    src = rng.lognormal(args.length_mu, args.length_sigma, args.num_sentences)
+    # target / source length ratio
+    ratio = rng.lognormal(0.0, args.ratio_sigma, args.num_sentences)
+    tgt = src * ratio
+    src = np.clip(src.astype(np.int64), 2, args.max_len)
+    tgt = np.clip(tgt.astype(np.int64), 2, args.max_len)
+    return src, tgt
+
+
+def ordered_indices(src, tgt):
+    """As ordered by LanguagePairDataset: shuffled, then sorted by target and
+    source length."""
+    rng = np.random.RandomState(SEED)
+    indices = rng.permutation(len(src)).astype(np.int64)
+    indices = indices[np.argsort(tgt[indices], kind="mergesort")]
+    return indices[np.argsort(src[indices], kind="mergesort")]
+
+
+def bench(src, tgt, indices, max_padding_ratio, args):
+    start = time.perf_counter()
+    if max_padding_ratio is None:
+        batches = data_utils.batch_by_size(
+            indices,
+            num_tokens_fn=None,
+            num_tokens_vec=np.maximum(src, tgt)[indices],
+            max_tokens=args.max_tokens,
+            required_batch_size_multiple=args.required_batch_size_multiple,
+        )
+    else:
+        batches = data_utils.batch_by_padding(
+            indices,
+            src,
+            tgt,
+            max_tokens=args.max_tokens,
+            required_batch_size_multiple=args.required_batch_size_multiple,
+            max_padding_ratio=max_padding_ratio,
+        )
+    seconds = time.perf_counter() - start
+    assert np.array_equal(np.sort(np.concatenate(batches)), np.sort(indices))
+
+    num_real, num_padded = data_utils.padding_efficiency(batches, src, tgt)
+    bsz = np.array([len(batch) for batch in batches])
+    return {
+        "max_padding_ratio": max_padding_ratio,
+        "seconds": seconds,
+        "num_batches": len(batches),
+        "mean_bsz": float(bsz.mean()),
+        "min_bsz": int(bsz.min()),
+        "real_tokens": num_real,
+        "padded_positions": num_padded,
+        "padding_efficiency": num_real / num_padded,
+        # the source and target of the ISDST twin batch are both doubled
+        "twin_padding_positions": 2 * (num_padded - num_real),
+        "worst_batch_padding_efficiency": min(
+            np.divide(*data_utils.padding_efficiency([batch], src, tgt))
+            for batch in batches
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--src", default=None, help="source text file")
+    parser.add_argument("--tgt", default=None, help="target text file")
+    # IWSLT14 de-en training set size
+    parser.add_argument("--num-sentences", type=int, default=160239)
+    parser.add_argument("--length-mu", type=float, default=3.0)
+    parser.add_argument("--length-sigma", type=float, default=0.6)
+    parser.add_argument("--ratio-sigma", type=float, default=0.2)
+    parser.add_argument("--max-len", type=int, default=250)
+    parser.add_argument("--max-tokens", type=int, default=4096)
+    parser.add_argument("--required-batch-size-multiple", type=int, default=8)
+    parser.add_argument(
+        "--max-padding-ratio",
+        type=float,
+        nargs="+",
+        default=[1.0, 0.2, 0.1, 0.05],
+    )
+    parser.add_argument(
+        "--output", default=None, help="write the JSON report here (default: stdout)"
+    )
+    args = parser.parse_args()
+    assert (args.src is None) == (args.tgt is None), "set both --src and --tgt"
+
+    src, tgt = pair_lengths(args)
+    indices = ordered_indices(src, tgt)
+    results = [
+        bench(src, tgt, indices, ratio, args)
+        for ratio in [None] + args.max_padding_ratio
+    ]
+    for result in results:
+        result["relative_seconds"] = result["seconds"] / results[0]["seconds"]
+    report = {
+        "num_sentences": len(src),
+        "mean_src_len": float(src.mean()),
+        "mean_tgt_len": float(tgt.mean()),
+        "max_tokens": args.max_tokens,
+        "required_batch_size_multiple": args.required_batch_size_multiple,
+        "results": results,
+    }
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
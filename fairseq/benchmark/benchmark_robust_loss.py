@@ -0,0 +1,169 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Peak memory and time of the robust (ISDST) training loss: the reference
+label-smoothed NLL + KL path of ``cross_entropy_with_robust_all`` against the
+fused, chunked :func:`fused_robust_loss`.
+
+The peak memory of the forward pass and of the backward pass are reported
+separately. On GPU they are CUDA allocator peaks. On CPU every configuration
+runs in a fresh process, and they are the growth of its peak RSS during the
+forward pass and beyond that during the backward pass.
+"""
+
+import argparse
+import itertools
+import multiprocessing
+import resource
+import time
+
+import torch
+
+from fairseq import utils
+from fairseq.criterions.cross_entropy_with_robust_all import (
+    CrossEntropyWithRobustAll,
+    fused_robust_loss,
+    label_smoothed_nll_loss,
+)
+
+PAD = 1
+EPS = 0.1
+
+
+class _LogitsModel(object):
+    """Just enough of a model for the criterion's loss helpers."""
+
+    def get_normalized_probs(self, net_output, log_probs):
+        if log_probs:
+            return utils.log_softmax(net_output[0], dim=-1)
+        return utils.softmax(net_output[0], dim=-1)
+
+
+def _inputs(bsz, tgt_len, vocab, device):
+    torch.manual_seed(0)
+    logits = torch.randn(2 * bsz, tgt_len, vocab, device=device, requires_grad=True)
+    target = torch.randint(4, vocab, (bsz, tgt_len), device=device)
+    # right-padded targets of random lengths
+    lengths = torch.randint(tgt_len // 2, tgt_len + 1, (bsz, 1), device=device)
+    target.masked_fill_(torch.arange(tgt_len, device=device) >= lengths, PAD)
+    return logits, target
+
+
+def reference_loss(logits, target, only_nll="both", kl_direction="both"):
+    net_output = (logits, None)
+    lprobs = utils.log_softmax(logits, dim=-1).view(-1, logits.size(-1))
+    pad_mask = target.unsqueeze(-1).eq(PAD)
+    twin_target = torch.cat([target, target], dim=0).view(-1, 1)
+    half = lprobs.size(0) // 2
+    p, t = {
+        "both": (lprobs, twin_target),
+        "clean": (lprobs[half:], twin_target[half:]),
+        "noise": (lprobs[:half], twin_target[:half]),
+    }[only_nll]
+    loss, nll_loss = label_smoothed_nll_loss(p, t, EPS, ignore_index=PAD)
+    kl_loss = CrossEntropyWithRobustAll.compute_kl_loss(
+        None, _LogitsModel(), net_output, pad_mask, True, kl_direction
+    )
+    return loss + kl_loss, nll_loss, kl_loss
+
+
+def fused_loss(logits, target, only_nll="both", kl_direction="both", chunk_size=1024):
+    loss, nll_loss, kl_loss = fused_robust_loss(
+        logits, target, EPS, PAD, only_nll, kl_direction, chunk_size
+    )
+    return loss + kl_loss, nll_loss, kl_loss
+
+
+def _peak(device, base):
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        return torch.cuda.max_memory_allocated() - base
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - base
+
+
+def _measure(name, bsz, tgt_len, vocab, device, chunk_size):
+    logits, target = _inputs(bsz, tgt_len, vocab, device)
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated()
+    else:
+        base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    start = time.perf_counter()
+    if name == "reference":
+        loss, _, _ = reference_loss(logits, target)
+    else:
+        loss, _, _ = fused_loss(logits, target, chunk_size=chunk_size)
+    forward_peak = _peak(device, base)
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats()
+    else:
+        base += forward_peak
+    loss.backward()
+    backward_peak = _peak(device, base)
+    return {
+        "loss": loss.item(),
+        "seconds": time.perf_counter() - start,
+        "forward_peak_mb": forward_peak / 2 ** 20,
+        "backward_peak_mb": backward_peak / 2 ** 20,
+    }
+
+
+def measure(*args):
+    """Run :func:`_measure` in a fresh process so CPU peaks do not carry over."""
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        return pool.apply(_measure, args)
+
+
+def check_equivalence(device):
+    logits, target = _inputs(4, 9, 50, device)
+    for only_nll, kl_direction in itertools.product(["both", "clean", "noise"], repeat=2):
+        expected = reference_loss(logits, target, only_nll, kl_direction)
+        actual = fused_loss(logits, target, only_nll, kl_direction, chunk_size=7)
+        for e, a in zip(expected, actual):
+            assert torch.allclose(e, a, rtol=1e-4), (only_nll, kl_direction, e, a)
+        # the gradients of the chunks written by the backward pass
+        (expected_grad,) = torch.autograd.grad(expected[0], logits)
+        (actual_grad,) = torch.autograd.grad(actual[0], logits)
+        assert torch.allclose(expected_grad, actual_grad, atol=1e-6), (
+            only_nll,
+            kl_direction,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[64, 128])
+    parser.add_argument("--tgt-len", type=int, default=32)
+    parser.add_argument("--vocab", type=int, nargs="+", default=[10000, 32000])
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    parser.add_argument("--cpu", action="store_true")
+    args = parser.parse_args()
+
+    device = torch.device(
+        "cuda" if torch.cuda.is_available() and not args.cpu else "cpu"
+    )
+    check_equivalence(device)
+
+    print("| bsz | vocab | impl | forward peak MB | backward peak MB | seconds |")
+    for bsz, vocab in itertools.product(args.batch_size, args.vocab):
+        for name in ["reference", "fused"]:
+            result = measure(name, bsz, args.tgt_len, vocab, device, args.chunk_size)
+            print(
+                "| {} | {} | {} | {:.1f} | {:.1f} | {:.3f} |".format(
+                    bsz,
+                    vocab,
+                    name,
+                    result["forward_peak_mb"],
+                    result["backward_peak_mb"],
+                    result["seconds"],
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
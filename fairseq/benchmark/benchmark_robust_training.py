@@ -0,0 +1,413 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Throughput (tokens/s) and peak memory of the robust (ISDST) training hot
+paths, across batch sizes, sequence lengths and vocabulary sizes:
+
+  - ``noise``: source noising (:func:`replace_tokens`) for every noise type
+  - ``criterion``: the forward and the backward pass of
+    ``cross_entropy_with_robust_all`` (model included)
+  - ``train_step``: a full :class:`~fairseq.trainer.Trainer` step of a robust
+    transformer on the ``dummy_mt`` task
+
+Before the noise benchmark, :func:`check_equivalence` compares the batched
+:class:`~fairseq.data.robust_noising.TokenNoiser` and the noise curriculum
+with the per-sentence loop of the original ``replace_tokens``, over many
+seeds.
+
+Every measurement runs in a fresh process. Peak memory is the CUDA allocator
+peak, or the growth of the peak RSS during the timed iterations on CPU. The
+results are written as JSON, so that runs of different releases can be
+compared.
+"""
+
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import platform
+import random
+import resource
+import sys
+import time
+from argparse import Namespace
+
+import torch
+
+import fairseq
+from fairseq import options, tasks, utils
+from fairseq.data import Dictionary
+from fairseq.data.robust_noising import TokenNoiser
+from fairseq.dataclass.utils import convert_namespace_to_omegaconf
+from fairseq.models.transformer.transformer_encoder_robust_all import replace_tokens
+from fairseq.optim.noise_curriculum.power_noise_curriculum import PowerNoiseCurriculum
+from fairseq.trainer import Trainer
+
+ARCH = "transformer_iwslt_de_en_robust_all"
+NOISE_RATE = 0.1
+SEED = 1
+
+
+def _memory_base(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        return torch.cuda.memory_allocated()
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _peak_mb(device, base):
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        peak = torch.cuda.max_memory_allocated()
+    else:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return (peak - base) / 2 ** 20
+
+
+def _timeit(fn, device, repeat):
+    """Mean seconds of *fn* over *repeat* calls after one warmup call."""
+    fn()
+    base = _memory_base(device)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeat, _peak_mb(device, base)
+
+
+def _noise_args(noise_type):
+    return Namespace(
+        add_noise=True,
+        noise_type=noise_type,
+        noise_rate=NOISE_RATE,
+        noise_seed=SEED,
+        is_half_batch=True,
+        left_pad_source=True,
+    )
+
+
+def _twin_source(bsz, seq_len, vocab, device):
+    """A left-padded clean/noisy twin batch of random sentences."""
+    dictionary = Dictionary()
+    for i in range(vocab):
+        dictionary.add_symbol("word{}".format(i))
+    torch.manual_seed(SEED)
+    lengths = torch.randint(seq_len // 2, seq_len + 1, (bsz,))
+    tokens = torch.randint(dictionary.nspecial, len(dictionary), (bsz, seq_len))
+    tokens[:, -1] = dictionary.eos()
+    pad_mask = torch.arange(seq_len).flip(0) >= lengths.unsqueeze(1)
+    tokens.masked_fill_(pad_mask, dictionary.pad())
+    tokens = torch.cat([tokens, tokens], dim=0).to(device)
+    lengths = torch.cat([lengths, lengths], dim=0).to(device)
+    return dictionary, tokens, lengths
+
+
+def bench_noise(noise_type, bsz, seq_len, vocab, device, repeat):
+    dictionary, src_tokens, src_lengths = _twin_source(bsz, seq_len, vocab, device)
+    args = _noise_args(noise_type)
+
+    def step():
+        replace_tokens(
+            src_tokens,
+            src_lengths,
+            0.0,
+            dictionary,
+            training_state=True,
+            num_updates=0,
+            args=args,
+        )
+
+    seconds, peak_mb = _timeit(step, device, repeat)
+    return {"tokens": int(src_lengths.sum()), "seconds": seconds, "peak_mb": peak_mb}
+
+
+def legacy_noise(src_tokens, src_lengths, dictionary, noise_type, noise_rate):
+    """The per-sentence loop of the original ``replace_tokens`` at a constant
+    *noise_rate*, for left-padded sources and replace, remove, swap or hybrid
+    noise (its insert noise only supports one insertion per sentence)."""
+    pad = dictionary.pad()
+    src_tokens, src_lengths = src_tokens.clone(), src_lengths.clone()
+    for i, s in enumerate(src_tokens):
+        start_idx = int(s.ne(pad).nonzero()[0])
+        end_idx = len(s) - 1
+        n_sampled = math.ceil(noise_rate * (end_idx - start_idx))
+        op = noise_type
+        if noise_type == "hybrid":
+            rd = random.uniform(0, 1)
+            op = "replace" if rd < 1 / 3 else "remove" if rd < 2 / 3 else "swap"
+        if op == "replace":
+            idx_list1 = random.sample(range(start_idx, end_idx), n_sampled)
+            idx_list2 = random.sample(range(4, len(dictionary.symbols)), n_sampled)
+            s[idx_list1] = torch.LongTensor(idx_list2).to(s)
+        elif op == "remove":
+            idx_reserved = random.sample(
+                range(start_idx, end_idx), end_idx - n_sampled - start_idx
+            )
+            idx_reserved = sorted(idx_reserved) + [end_idx]
+            src_tokens[i] = torch.cat(
+                [s.new_full((n_sampled + start_idx,), pad), s[idx_reserved]]
+            )
+            src_lengths[i] -= n_sampled
+        elif op == "swap":
+            if start_idx >= end_idx - 1 or n_sampled > end_idx - 1 - start_idx:
+                continue
+            original = s.clone()
+            idx_swap1 = torch.LongTensor(
+                random.sample(range(start_idx, end_idx - 1), n_sampled)
+            ).to(s.device)
+            s[idx_swap1] = original[idx_swap1 + 1]
+            s[idx_swap1 + 1] = original[idx_swap1]
+    return src_tokens, src_lengths
+
+
+def _noise_stats(noise_fn, tokens, lengths, num_seeds):
+    """How often every position is changed (in the sentences that keep their
+    length) and the mean number of removed tokens of every sentence."""
+    changed = torch.zeros(tokens.size(), dtype=torch.double)
+    removed = torch.zeros(tokens.size(0), dtype=torch.double)
+    for seed in range(num_seeds):
+        random.seed(seed)
+        torch.manual_seed(seed)
+        noised, noised_lengths = noise_fn(tokens, lengths)
+        same_length = noised_lengths.eq(lengths).unsqueeze(1)
+        changed += (noised.ne(tokens) & same_length).double()
+        removed += (lengths - noised_lengths).double()
+    return changed / num_seeds, removed / num_seeds
+
+
+def check_equivalence(num_seeds=1000):
+    """Check that :class:`TokenNoiser` noises every sentence like the
+    original per-sentence loop (:func:`legacy_noise`): the same number of
+    noised positions per sentence and the same distribution of the changed
+    positions, over *num_seeds* seeds. Also check that the noise curriculum
+    keeps the original schedule of the upper bound of the rates."""
+    dictionary, tokens, lengths = _twin_source(8, 20, 1000, torch.device("cpu"))
+    tokens, lengths = tokens[:8], lengths[:8]
+    for noise_type, rate in itertools.product(
+        ["replace", "remove", "swap", "hybrid"], [NOISE_RATE, 0.3]
+    ):
+        noiser = TokenNoiser(dictionary, noise_type=noise_type, left_pad=True)
+        rates = torch.full((tokens.size(0),), rate, dtype=torch.double)
+        legacy_changed, legacy_removed = _noise_stats(
+            lambda t, l: legacy_noise(t, l, dictionary, noise_type, rate),
+            tokens,
+            lengths,
+            num_seeds,
+        )
+        changed, removed = _noise_stats(
+            lambda t, l: noiser.noise(t, l, rates), tokens, lengths, num_seeds
+        )
+        config = (noise_type, rate)
+        assert (changed - legacy_changed).abs().max() < 0.07, config
+        assert (
+            changed.sum(1) - legacy_changed.sum(1)
+        ).abs().max() < 0.1 * legacy_changed.sum(1).max() + 0.1, config
+        assert (removed - legacy_removed).abs().max() < 0.1 * rate * 20 + 0.05, config
+
+    def cl_noise_rate(num_updates, max_num_updates, R_max, R_min=0.0, p=2):
+        temp = (R_max ** p - R_min ** p) * (num_updates / max_num_updates) + (
+            R_min ** p
+        )
+        return min(temp ** (1 / p) if temp != 0 else 0, R_max)
+
+    curriculum_args = {"max_rate": 0.1, "min_rate": 0.0, "p": 2}
+    curriculum_args.update(cupdates=100, mupdates=2000)
+    curriculum = PowerNoiseCurriculum.from_model_args(
+        Namespace(curriculum_learning=True, curriculum_args=json.dumps(curriculum_args))
+    )
+    for num_updates in range(0, 2500, 7):
+        # the original bound is only set (and the batch noised) when
+        # num_updates is a multiple of cupdates
+        expected = 0.0
+        if num_updates % 100 == 0:
+            expected = cl_noise_rate(num_updates, 2000, 0.1)
+        assert math.isclose(
+            curriculum.get_max_rate(num_updates), expected, abs_tol=1e-9
+        ), num_updates
+
+
+def _setup(bsz, seq_len, vocab, device, arch):
+    input_args = [
+        "--task", "dummy_mt",
+        "--dict-size", str(vocab),
+        "--src-len", str(seq_len),
+        "--tgt-len", str(seq_len),
+        "--dataset-size", str(bsz),
+        "--batch-size", str(bsz),
+        "--arch", arch,
+        "--share-all-embeddings",
+        "--criterion", "cross_entropy_with_robust_all",
+        "--label-smoothing", "0.1",
+        "--reg-alpha", "1.5",
+        "--add-noise",
+        "--noise-type", "hybrid",
+        "--noise-rate", str(NOISE_RATE),
+        "--noise-seed", str(SEED),
+        "--is-half-batch",
+        "--optimizer", "adam",
+        "--lr", "0.0005",
+        "--seed", str(SEED),
+        "--num-workers", "0",
+    ]  # fmt: skip
+    if device.type == "cpu":
+        input_args.append("--cpu")
+    parser = options.get_training_parser()
+    args = options.parse_args_and_arch(parser, input_args=input_args)
+    cfg = convert_namespace_to_omegaconf(args)
+    utils.set_torch_seed(SEED)
+
+    task = tasks.setup_task(cfg.task)
+    task.load_dataset("train")
+    model = task.build_model(cfg.model)
+    criterion = task.build_criterion(cfg.criterion)
+    sample = task.dataset("train").collater([0])
+    return cfg, task, model, criterion, sample
+
+
+def bench_criterion(bsz, seq_len, vocab, device, repeat, arch):
+    _, _, model, criterion, sample = _setup(bsz, seq_len, vocab, device, arch)
+    model.to(device).train()
+    criterion.to(device)
+    model.set_num_updates(0)
+    sample = utils.move_to_cuda(sample) if device.type == "cuda" else sample
+
+    state = {}
+
+    def forward():
+        state["loss"] = criterion(model, sample)[0]
+
+    def backward():
+        # the forward pass is not timed
+        model.zero_grad()
+        forward()
+        start = time.perf_counter()
+        state["loss"].backward()
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        state["seconds"] += time.perf_counter() - start
+
+    fwd_seconds, fwd_peak_mb = _timeit(forward, device, repeat)
+    state["seconds"] = 0.0
+    _, bwd_peak_mb = _timeit(backward, device, repeat)
+    # accumulated over the warmup call as well
+    bwd_seconds = state["seconds"] / (repeat + 1)
+    tokens = sample["ntokens"]
+    return [
+        {"pass": "forward", "tokens": tokens, "seconds": fwd_seconds, "peak_mb": fwd_peak_mb},
+        {"pass": "backward", "tokens": tokens, "seconds": bwd_seconds, "peak_mb": bwd_peak_mb},
+    ]  # fmt: skip
+
+
+def bench_train_step(bsz, seq_len, vocab, device, repeat, arch):
+    cfg, task, model, criterion, sample = _setup(bsz, seq_len, vocab, device, arch)
+    trainer = Trainer(cfg, task, model, criterion)
+
+    def step():
+        trainer.train_step([sample])
+
+    seconds, peak_mb = _timeit(step, device, repeat)
+    return {"tokens": sample["ntokens"], "seconds": seconds, "peak_mb": peak_mb}
+
+
+def _isolated(fn, *args):
+    """Run *fn* in a fresh process so that memory peaks do not carry over."""
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        return pool.apply(fn, args)
+
+
+def _record(benchmark, config, result):
+    record = dict(benchmark=benchmark, **config)
+    record.update(result)
+    record["tokens_per_sec"] = result["tokens"] / result["seconds"]
+    return record
+
+
+def run(args):
+    device = torch.device("cuda" if args.cuda else "cpu")
+    results = []
+    for bsz, seq_len, vocab in itertools.product(
+        args.batch_size, args.seq_len, args.vocab
+    ):
+        config = {"bsz": bsz, "seq_len": seq_len, "vocab": vocab}
+        num_done = len(results)
+        if "noise" in args.benchmarks:
+            for noise_type in args.noise_types:
+                result = _isolated(
+                    bench_noise, noise_type, bsz, seq_len, vocab, device, args.repeat
+                )
+                results.append(
+                    _record("noise", dict(config, noise_type=noise_type), result)
+                )
+        if "criterion" in args.benchmarks:
+            for result in _isolated(
+                bench_criterion, bsz, seq_len, vocab, device, args.repeat, args.arch
+            ):
+                results.append(
+                    _record(
+                        "criterion", dict(config, **{"pass": result.pop("pass")}), result
+                    )
+                )
+        if "train_step" in args.benchmarks:
+            result = _isolated(
+                bench_train_step, bsz, seq_len, vocab, device, args.repeat, args.arch
+            )
+            results.append(_record("train_step", dict(config, arch=args.arch), result))
+        for record in results[num_done:]:
+            print(json.dumps(record), file=sys.stderr)
+
+    return {
+        "fairseq": fairseq.__version__,
+        "torch": torch.__version__,
+        "python": platform.python_version(),
+        "device": torch.cuda.get_device_name() if args.cuda else platform.processor(),
+        "num_threads": torch.get_num_threads(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--benchmarks",
+        nargs="+",
+        default=["noise", "criterion", "train_step"],
+        choices=["noise", "criterion", "train_step"],
+    )
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[32, 64])
+    parser.add_argument("--seq-len", type=int, nargs="+", default=[32, 64])
+    parser.add_argument("--vocab", type=int, nargs="+", default=[8000, 32000])
+    parser.add_argument(
+        "--noise-types",
+        nargs="+",
+        default=TokenNoiser.NOISE_TYPES,
+        choices=TokenNoiser.NOISE_TYPES,
+    )
+    parser.add_argument("--arch", default=ARCH)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--cuda", action="store_true")
+    parser.add_argument(
+        "--output", default=None, help="write the JSON report here (default: stdout)"
+    )
+    args = parser.parse_args()
+
+    if "noise" in args.benchmarks:
+        check_equivalence()
+    report = run(args)
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -60,7 +60,7 @@ class DummyMTTask(LegacyFairseqTask):
         tgt = torch.stack([self.dummy_tgt for _ in range(bsz)])
         self.datasets[split] = DummyDataset(
             {
-                "id": 1,
+                "id": torch.arange(bsz),
                 "net_input": {
                     "src_tokens": torch.stack([self.dummy_src for _ in range(bsz)]),
                     "src_lengths": torch.full(
@@ -14,7 +14,12 @@ from multiprocessing import Pool
 import torch
 
 from fairseq.data import Dictionary, indexed_dataset
-from fairseq.file_chunker_utils import Chunker, find_offsets
+from fairseq.file_chunker_utils import (
+    Chunker,
+    find_offsets,
+    find_shard_offsets,
+    input_fingerprint,
+)
 from fairseq.file_io import PathManager
 from fairseq.tokenizer import tokenize_line
 
@@ -80,6 +85,10 @@ def _worker_prefix(output_prefix: str, worker_id: int):
     return f"{output_prefix}.pt{worker_id}"
 
 
+def _shard_prefix(output_prefix: str, shard_id: int):
+    return f"{output_prefix}.shard{shard_id}"
+
+
 class FileBinarizer:
     """
     An file binarizer can take a file, tokenize it, and binarize each line to a tensor
@@ -97,6 +106,12 @@ class FileBinarizer:
     ) -> BinarizeSummary:
         final_summary = BinarizeSummary()
 
+        # the shards of an earlier sharded run would shadow the new dataset
+        manifest_path = indexed_dataset.shard_manifest_path(output_prefix)
+        if os.path.exists(manifest_path):
+            logger.warning(f"removing the stale shard manifest {manifest_path}")
+            os.remove(manifest_path)
+
         offsets = find_offsets(input_file, num_workers)
         # find_offsets returns a list of position [pos1, pos2, pos3, pos4] but we would want pairs:
         # [(pos1, pos2), (pos2, pos3), (pos3, pos4)] to process the chunks with start/end info
@@ -169,6 +184,129 @@ class FileBinarizer:
         final_ds.finalize(idx_file)
         return final_summary
 
+    @classmethod
+    def sharded_dataset(
+        cls,
+        input_file: str,
+        dataset_impl: str,
+        binarizer: Binarizer,
+        output_prefix: str,
+        shard_size: int,
+        vocab_size=None,
+        num_workers=1,
+        fingerprint: tp.Optional[str] = None,
+    ) -> BinarizeSummary:
+        """
+        binarizes input_file in shards of about shard_size bytes, each written
+        directly to its final .bin/.idx files (no merge), and described by the
+        manifest of output_prefix (see indexed_dataset.read_shard_manifest),
+        which is updated as shards are finished. If a previous run on the same
+        input (and fingerprint, e.g. of the vocabulary) was interrupted, only
+        the missing shards are binarized.
+        """
+        input_file = PathManager.get_local_path(input_file)
+        offsets = find_shard_offsets(input_file, shard_size)
+        manifest = {
+            "dataset_impl": dataset_impl,
+            "input": input_fingerprint(input_file),
+            "fingerprint": fingerprint,
+            "offsets": offsets,
+            "shards": [None] * (len(offsets) - 1),
+        }
+        previous = indexed_dataset.read_shard_manifest(output_prefix, complete=False)
+        if previous is not None and all(
+            previous[key] == manifest[key] for key in manifest if key != "shards"
+        ):
+            directory = os.path.dirname(output_prefix)
+            for shard_id, shard in enumerate(previous["shards"]):
+                if shard is not None and indexed_dataset.dataset_exists(
+                    os.path.join(directory, shard["prefix"]), dataset_impl
+                ):
+                    manifest["shards"][shard_id] = shard
+        todo = [i for i, shard in enumerate(manifest["shards"]) if shard is None]
+        if len(todo) < len(manifest["shards"]):
+            logger.info(
+                f"{input_file}: resuming, {len(manifest['shards']) - len(todo)} "
+                f"of {len(manifest['shards'])} shards already binarized"
+            )
+        indexed_dataset.write_shard_manifest(output_prefix, manifest)
+
+        jobs = [
+            (
+                binarizer,
+                input_file,
+                offsets[shard_id],
+                offsets[shard_id + 1],
+                _shard_prefix(output_prefix, shard_id),
+                dataset_impl,
+                vocab_size,
+                shard_id,
+            )
+            for shard_id in todo
+        ]
+        if num_workers > 1 and len(jobs) > 1:
+            pool = Pool(processes=min(num_workers, len(jobs)))
+            results = pool.imap_unordered(cls._binarize_shard, jobs)
+        else:
+            pool = None
+            results = map(cls._binarize_shard, jobs)
+        for shard_id, summ in results:
+            manifest["shards"][shard_id] = {
+                "prefix": os.path.basename(_shard_prefix(output_prefix, shard_id)),
+                "num_seq": summ.num_seq,
+                "num_tok": summ.num_tok,
+                "num_replaced": summ.num_replaced,
+            }
+            # the shard is only recorded once its files are complete
+            indexed_dataset.write_shard_manifest(output_prefix, manifest)
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+        final_summary = BinarizeSummary()
+        for shard in manifest["shards"]:
+            final_summary.merge(
+                BinarizeSummary(num_seq=shard["num_seq"], num_tok=shard["num_tok"])
+            )
+        if vocab_size is not None:
+            # the manifest only keeps the number of replaced words
+            num_replaced = sum(shard["num_replaced"] for shard in manifest["shards"])
+            final_summary.replaced = Counter({"<unk>": num_replaced})
+        return final_summary
+
+    @classmethod
+    def _binarize_shard(cls, job):
+        (
+            binarizer,
+            filename,
+            offset_start,
+            offset_end,
+            output_prefix,
+            dataset_impl,
+            vocab_size,
+            shard_id,
+        ) = job
+        # written under a temporary name, so that a shard is never half there
+        tmp_prefix = f"{output_prefix}.tmp{os.getpid()}"
+        summ = cls._binarize_chunk_and_finalize(
+            binarizer,
+            filename,
+            offset_start,
+            offset_end,
+            tmp_prefix,
+            dataset_impl,
+            vocab_size=vocab_size,
+        )
+        os.replace(
+            indexed_dataset.data_file_path(tmp_prefix),
+            indexed_dataset.data_file_path(output_prefix),
+        )
+        os.replace(
+            indexed_dataset.index_file_path(tmp_prefix),
+            indexed_dataset.index_file_path(output_prefix),
+        )
+        return shard_id, summ
+
     @staticmethod
     def _binarize_file_chunk(
         binarizer: Binarizer,
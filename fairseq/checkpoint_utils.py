@@ -32,7 +32,16 @@ from omegaconf import DictConfig, OmegaConf, open_dict
 logger = logging.getLogger(__name__)
 
 
-def save_checkpoint(cfg: CheckpointConfig, trainer, epoch_itr, val_loss):
+def save_checkpoint(
+    cfg: CheckpointConfig, trainer, epoch_itr, val_loss, pending_best=False
+):
+    """Save the checkpoints due at the current update.
+
+    With *pending_best*, the validation score of this update is not known
+    yet (see ``--eval-bleu-async``): the checkpoint is also kept as
+    ``checkpoint_pending_UPDATES.pt`` until :func:`update_best_checkpoint`
+    receives the score.
+    """
     from fairseq import meters
 
     # only one worker should attempt to create the required dir
@@ -43,6 +52,10 @@ def save_checkpoint(cfg: CheckpointConfig, trainer, epoch_itr, val_loss):
     if val_loss is not None:
         best_function = max if cfg.maximize_best_checkpoint_metric else min
         save_checkpoint.best = best_function(val_loss, prev_best)
+        if save_checkpoint.best == val_loss:
+            # e.g. keep the best weights in memory across training stages
+            for hook in getattr(save_checkpoint, "new_best_hooks", []):
+                hook(trainer, val_loss)
 
     if cfg.no_save:
         return
@@ -103,6 +116,7 @@ def save_checkpoint(cfg: CheckpointConfig, trainer, epoch_itr, val_loss):
     checkpoint_conds[
         "checkpoint_last{}.pt".format(suffix)
     ] = not cfg.no_last_checkpoints
+    checkpoint_conds[_pending_checkpoint_name(updates, suffix)] = pending_best
 
     extra_state = {"train_iterator": epoch_itr.state_dict(), "val_loss": val_loss}
     if hasattr(save_checkpoint, "best"):
@@ -185,6 +199,49 @@ def save_checkpoint(cfg: CheckpointConfig, trainer, epoch_itr, val_loss):
                 PathManager.rm(old_chk)
 
 
+def _pending_checkpoint_name(updates, suffix):
+    return "checkpoint_pending_{}{}.pt".format(updates, suffix)
+
+
+def update_best_checkpoint(cfg: CheckpointConfig, trainer, updates, val_loss):
+    """Retroactively apply the validation score *val_loss* of the checkpoint
+    saved with *pending_best* at *updates* updates: copy it to
+    ``checkpoint_best.pt`` if the score is the best so far.
+
+    Scores of updates at which no checkpoint was saved are ignored, like
+    :func:`save_checkpoint` only tracks the best score when it saves.
+    Returns whether the score is a new best.
+    """
+    suffix = trainer.checkpoint_suffix
+    pending = os.path.join(cfg.save_dir, _pending_checkpoint_name(updates, suffix))
+    if not PathManager.exists(pending):
+        return False
+
+    def is_better(a, b):
+        return a >= b if cfg.maximize_best_checkpoint_metric else a <= b
+
+    new_best = not hasattr(save_checkpoint, "best") or is_better(
+        val_loss, save_checkpoint.best
+    )
+    if new_best:
+        save_checkpoint.best = val_loss
+        if trainer.should_save_checkpoint_on_current_rank:
+            best = os.path.join(cfg.save_dir, "checkpoint_best{}.pt".format(suffix))
+            assert PathManager.copy(
+                pending, best, overwrite=True
+            ), f"Failed to copy {pending} to {best}"
+            logger.info(
+                "Copied {} to {} ({} {} @ {} updates)".format(
+                    pending, best, cfg.best_checkpoint_metric, val_loss, updates
+                )
+            )
+    if os.path.lexists(pending):
+        os.remove(pending)
+    elif PathManager.exists(pending):
+        PathManager.rm(pending)
+    return new_best
+
+
 def load_checkpoint(cfg: CheckpointConfig, trainer, **passthrough_args):
     """
     Load a checkpoint and restore the training iterator.
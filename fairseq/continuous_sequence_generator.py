@@ -0,0 +1,384 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import math
+from typing import Dict, List
+
+import torch
+from torch import Tensor
+
+from fairseq.ngram_repeat_block import NGramRepeatBlock
+from fairseq.sequence_generator import EnsembleModel
+
+
+def _pad_time(x: Tensor, dim: int, length: int, value=0):
+    """Right-pad *x* with *value* to *length* along *dim*."""
+    if x.size(dim) >= length:
+        return x
+    size = list(x.size())
+    size[dim] = length - x.size(dim)
+    return torch.cat([x, x.new_full(size, value)], dim=dim)
+
+
+def _cat_encoder_outs(
+    a: Dict[str, List[Tensor]], b: Dict[str, List[Tensor]], pad: int
+) -> Dict[str, List[Tensor]]:
+    """Concatenate two encoder outputs along the batch, right-padding the
+    shorter source (masked in `encoder_padding_mask`)."""
+    src_len = max(a["encoder_out"][0].size(0), b["encoder_out"][0].size(0))
+
+    def padding_mask(out):
+        if len(out["encoder_padding_mask"]) > 0:
+            mask = out["encoder_padding_mask"][0]
+        else:
+            x = out["encoder_out"][0]
+            mask = torch.zeros(
+                x.size(1), x.size(0), dtype=torch.bool, device=x.device
+            )
+        return _pad_time(mask, 1, src_len, True)
+
+    def cat(key, dim, value=0):
+        if len(a[key]) == 0 or len(b[key]) == 0:
+            return []
+        return [
+            torch.cat(
+                [
+                    _pad_time(x, dim, src_len, value) if dim is not None else x
+                    for x in (a[key][0], b[key][0])
+                ],
+                dim=1 if key == "encoder_out" else 0,
+            )
+        ]
+
+    encoder_states = []
+    if len(a["encoder_states"]) == len(b["encoder_states"]):
+        encoder_states = [
+            torch.cat([_pad_time(x, 0, src_len), _pad_time(y, 0, src_len)], dim=1)
+            for x, y in zip(a["encoder_states"], b["encoder_states"])
+        ]
+    return {
+        "encoder_out": cat("encoder_out", 0),  # T x B x C
+        "encoder_padding_mask": [
+            torch.cat([padding_mask(a), padding_mask(b)], dim=0)
+        ],  # B x T
+        "encoder_embedding": cat("encoder_embedding", 1),  # B x T x C
+        "encoder_states": encoder_states,  # List[T x B x C]
+        "src_tokens": cat("src_tokens", 1, pad),  # B x T
+        "src_lengths": cat("src_lengths", None),  # B x 1
+    }
+
+
+class ContinuousSequenceGenerator(object):
+    """Beam search with continuous (in-flight) batching.
+
+    Unlike :class:`~fairseq.sequence_generator.SequenceGenerator`, which
+    decodes a fixed batch until its longest sentence is finished, sentences
+    are admitted with :func:`add` and retired by :func:`step` as soon as
+    their beam is finished, so that new requests fill the freed slots at the
+    next step boundary.
+
+    Every active sentence keeps its own length constraints and step count.
+    Sentences that join a running batch get a left-padded decoding history
+    whose padding is masked in self-attention (extending the incremental
+    state tells the decoder to count positions per row from then on);
+    joining drops the cached encoder-decoder keys, which
+    are recomputed for the extended batch at the next step. The history
+    columns that are padding for every sentence are dropped once they make
+    up half of it.
+
+    Constraints, prefixes, sampling, alignments and LM fusion are not
+    supported.
+
+    Args:
+        models (List[~fairseq.models.FairseqModel]): ensemble of models
+        tgt_dict (~fairseq.data.Dictionary): target dictionary
+        max_sentences (int, optional): maximum number of sentences decoded
+            at once (default: 16)
+
+    The other arguments are those of
+    :class:`~fairseq.sequence_generator.SequenceGenerator`.
+    """
+
+    def __init__(
+        self,
+        models,
+        tgt_dict,
+        max_sentences=16,
+        beam_size=1,
+        max_len_a=0,
+        max_len_b=200,
+        max_len=0,
+        min_len=1,
+        normalize_scores=True,
+        len_penalty=1.0,
+        unk_penalty=0.0,
+        temperature=1.0,
+        no_repeat_ngram_size=0,
+    ):
+        if isinstance(models, EnsembleModel):
+            self.model = models
+        else:
+            self.model = EnsembleModel(models)
+        assert self.model.has_incremental_states(), (
+            "continuous batching requires incremental decoders"
+        )
+        self.tgt_dict = tgt_dict
+        self.pad = tgt_dict.pad()
+        self.unk = tgt_dict.unk()
+        self.eos = tgt_dict.eos()
+        self.vocab_size = len(tgt_dict)
+        self.max_sentences = max_sentences
+        # the max beam size is the dictionary size - 1, since we never select pad
+        self.beam_size = min(beam_size, self.vocab_size - 1)
+        self.model.set_decoder_beam_size(self.beam_size)
+        self.max_len_a = max_len_a
+        self.max_len_b = max_len_b
+        self.min_len = min_len
+        self.max_len = max_len or self.model.max_decoder_positions()
+        self.normalize_scores = normalize_scores
+        self.len_penalty = len_penalty
+        self.unk_penalty = unk_penalty
+        assert temperature > 0, "--temperature must be greater than 0"
+        self.temperature = temperature
+        if no_repeat_ngram_size > 0:
+            self.repeat_ngram_blocker = NGramRepeatBlock(no_repeat_ngram_size)
+        else:
+            self.repeat_ngram_blocker = None
+        self.model.eval()
+        self._reset()
+
+    def _reset(self):
+        # per sentence
+        self.ids = []
+        self.finalized = []
+        self.steps = None  # number of tokens generated so far
+        self.max_lens = None
+        self.start = None  # history column of the BOS
+        # per beam
+        self.tokens = None  # left-padded decoding history
+        self.pos_scores = None
+        self.scores = None
+        self.encoder_outs = None
+        self.incremental_states = [{} for _ in range(self.model.models_size)]
+
+    @property
+    def num_active(self):
+        return len(self.ids)
+
+    @property
+    def num_free(self):
+        return self.max_sentences - len(self.ids)
+
+    @torch.no_grad()
+    def add(self, ids, src_tokens, src_lengths):
+        """Admit the sentences *src_tokens* of the request *ids* into the
+        batch; they start decoding at the next :func:`step`."""
+        assert len(ids) <= self.num_free, "no free decoding slots"
+        num_new = len(ids)
+        beam_size = self.beam_size
+        encoder_outs = self.model.forward_encoder(
+            {"src_tokens": src_tokens, "src_lengths": src_lengths}
+        )
+        expand = (
+            torch.arange(num_new, device=src_tokens.device)
+            .repeat_interleave(beam_size)
+        )
+        encoder_outs = self.model.reorder_encoder_out(encoder_outs, expand)
+        num_src_tokens = src_tokens.ne(self.pad).sum(dim=1)
+        max_lens = (
+            (num_src_tokens.float() * self.max_len_a + self.max_len_b)
+            .long()
+            .clamp_(max=self.max_len - 1)
+        )
+
+        if self.num_active == 0:
+            self._reset()
+            self.tokens = src_tokens.new_full((num_new * beam_size, 1), self.eos)
+            self.pos_scores = torch.zeros(
+                num_new * beam_size, 1, device=src_tokens.device
+            )
+            self.scores = torch.zeros(num_new * beam_size, device=src_tokens.device)
+            self.steps = max_lens.new_zeros(num_new)
+            self.max_lens = max_lens
+            self.start = max_lens.new_zeros(num_new)
+            self.encoder_outs = encoder_outs
+        else:
+            hist_len = self.tokens.size(1)
+            tokens = self.tokens.new_full((num_new * beam_size, hist_len), self.pad)
+            tokens[:, -1] = self.eos
+            self.tokens = torch.cat([self.tokens, tokens], dim=0)
+            self.pos_scores = torch.cat(
+                [self.pos_scores, self.pos_scores.new_zeros(tokens.size())], dim=0
+            )
+            self.scores = torch.cat(
+                [self.scores, self.scores.new_zeros(num_new * beam_size)]
+            )
+            self.steps = torch.cat([self.steps, self.steps.new_zeros(num_new)])
+            self.max_lens = torch.cat([self.max_lens, max_lens])
+            self.start = torch.cat(
+                [self.start, self.start.new_full((num_new,), hist_len - 1)]
+            )
+            self.encoder_outs = [
+                _cat_encoder_outs(a, b, self.pad)
+                for a, b in zip(self.encoder_outs, encoder_outs)
+            ]
+            for model, incremental_state in zip(
+                self.model.models, self.incremental_states
+            ):
+                model.decoder.extend_incremental_state(
+                    incremental_state, num_new * beam_size
+                )
+        self.ids.extend(ids)
+        self.finalized.extend([] for _ in ids)
+
+    @torch.no_grad()
+    def step(self):
+        """Decode one token for every active sentence.
+
+        Returns:
+            List[Tuple[Any, List[Dict[str, Tensor]]]]: the id and the
+            hypotheses, best first, of every sentence finished at this step
+        """
+        if self.num_active == 0:
+            return []
+        beam_size = self.beam_size
+        bsz = self.num_active
+        lprobs, _ = self.model.forward_decoder(
+            self.tokens,
+            self.encoder_outs,
+            self.incremental_states,
+            self.temperature,
+        )
+        lprobs[lprobs != lprobs] = torch.tensor(-math.inf).to(lprobs)
+        lprobs[:, self.pad] = -math.inf  # never select pad
+        lprobs[:, self.unk] -= self.unk_penalty  # apply unk penalty
+
+        steps = self.steps.repeat_interleave(beam_size)
+        at_max_len = steps >= self.max_lens.repeat_interleave(beam_size)
+        if at_max_len.any():
+            lprobs[at_max_len, : self.eos] = -math.inf
+            lprobs[at_max_len, self.eos + 1 :] = -math.inf
+        lprobs[steps < self.min_len, self.eos] = -math.inf
+
+        if self.repeat_ngram_blocker is not None:
+            lprobs = self.repeat_ngram_blocker(
+                self.tokens, lprobs, bsz, beam_size, self.tokens.size(1) - 1
+            )
+
+        lprobs = lprobs.view(bsz, beam_size, -1)
+        # the beams of a new sentence are identical: expand the first one only
+        lprobs[:, 1:].masked_fill_(self.steps.eq(0).view(-1, 1, 1), -math.inf)
+        cand_scores = lprobs + self.scores.view(bsz, beam_size, 1)
+        cand_scores, cand_indices = cand_scores.view(bsz, -1).topk(
+            min(2 * beam_size, lprobs.size(1) * lprobs.size(2) - 1)
+        )
+        cand_tokens = cand_indices.fmod(self.vocab_size)
+        cand_rows = torch.div(
+            cand_indices, self.vocab_size, rounding_mode="trunc"
+        ) + (torch.arange(bsz, device=lprobs.device) * beam_size).unsqueeze(1)
+
+        # finalize the hypotheses ending with EOS among the top beam_size
+        cand_eos = cand_tokens.eq(self.eos)
+        final = cand_eos[:, :beam_size] & cand_scores[:, :beam_size].ne(-math.inf)
+        if final.any():
+            self._finalize(final, cand_rows, cand_scores)
+        at_max_len = self.steps.ge(self.max_lens).tolist()
+        done = [
+            len(self.finalized[i]) >= beam_size or at_max_len[i] for i in range(bsz)
+        ]
+
+        # continue with the top beam_size candidates not ending with EOS
+        order = cand_eos.long() * cand_eos.size(1) + torch.arange(
+            cand_eos.size(1), device=cand_eos.device
+        )
+        _, active = order.topk(beam_size, dim=1, largest=False)
+        active_rows = cand_rows.gather(1, active)
+        active_tokens = cand_tokens.gather(1, active)
+        active_scores = cand_scores.gather(1, active)
+        active_pos_scores = active_scores - self.scores[active_rows]
+
+        finished = []
+        if any(done):
+            keep = [i for i in range(bsz) if not done[i]]
+            for i in range(bsz):
+                if done[i]:
+                    hypos = sorted(
+                        self.finalized[i], key=lambda h: float(h["score"]), reverse=True
+                    )
+                    finished.append((self.ids[i], hypos))
+            self.ids = [self.ids[i] for i in keep]
+            self.finalized = [self.finalized[i] for i in keep]
+            if len(keep) == 0:
+                self._reset()
+                return finished
+            keep = torch.tensor(keep, device=lprobs.device)
+            active_rows = active_rows[keep]
+            active_tokens = active_tokens[keep]
+            active_scores = active_scores[keep]
+            active_pos_scores = active_pos_scores[keep]
+            self.steps = self.steps[keep]
+            self.max_lens = self.max_lens[keep]
+            self.start = self.start[keep]
+
+        new_order = active_rows.view(-1)
+        self.tokens = torch.cat(
+            [self.tokens.index_select(0, new_order), active_tokens.view(-1, 1)],
+            dim=1,
+        )
+        self.pos_scores = torch.cat(
+            [
+                self.pos_scores.index_select(0, new_order),
+                active_pos_scores.view(-1, 1),
+            ],
+            dim=1,
+        )
+        self.scores = active_scores.view(-1)
+        self.steps += 1
+        self.model.reorder_incremental_state(self.incremental_states, new_order)
+        if any(done):
+            self.encoder_outs = self.model.reorder_encoder_out(
+                self.encoder_outs, new_order
+            )
+            self._trim()
+        return finished
+
+    def _finalize(self, final, cand_rows, cand_scores):
+        for i, j in final.nonzero().tolist():
+            if len(self.finalized[i]) >= self.beam_size:
+                continue
+            row = int(cand_rows[i, j])
+            start = int(self.start[i]) + 1
+            score = cand_scores[i, j]
+            eos_score = score - self.scores[row]
+            step = int(self.steps[i])
+            if self.normalize_scores:
+                score = score / (step + 1) ** self.len_penalty
+            self.finalized[i].append(
+                {
+                    "tokens": torch.cat(
+                        [self.tokens[row, start:], self.tokens.new([self.eos])]
+                    ),
+                    "score": score,
+                    "attention": None,
+                    "alignment": None,
+                    "positional_scores": torch.cat(
+                        [self.pos_scores[row, start:], eos_score.view(1)]
+                    ),
+                }
+            )
+
+    def _trim(self):
+        """Drop the history columns that are padding for every sentence once
+        they make up half of the history."""
+        num_steps = int(self.start.min())
+        if num_steps == 0 or 2 * num_steps < self.tokens.size(1):
+            return
+        self.tokens = self.tokens[:, num_steps:]
+        self.pos_scores = self.pos_scores[:, num_steps:]
+        self.start -= num_steps
+        for model, incremental_state in zip(
+            self.model.models, self.incremental_states
+        ):
+            model.decoder.trim_incremental_state(incremental_state, num_steps)
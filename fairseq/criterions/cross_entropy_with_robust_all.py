@@ -10,6 +10,8 @@ from statistics import mode
 from fairseq import metrics, utils
 from fairseq.criterions import register_criterion
 
+from fairseq.data.robust_noising import twin_sample_ids
+
 from .label_smoothed_cross_entropy import (
     LabelSmoothedCrossEntropyCriterion,
     LabelSmoothedCrossEntropyCriterionConfig,
@@ -38,6 +40,108 @@ def label_smoothed_nll_loss(lprobs, target, epsilon, ignore_index=None, reduce=T
     loss = (1.0 - epsilon - eps_i) * nll_loss + eps_i * smooth_loss
     return loss, nll_loss
 
+def _twin_loss_chunk(noise_logits, clean_logits, target, epsilon, only_nll, kl_direction):
+    # a single (log-)softmax per half; nothing V-wide outlives the chunk
+    noise_lprobs = F.log_softmax(noise_logits, dim=-1, dtype=torch.float32)
+    clean_lprobs = F.log_softmax(clean_logits, dim=-1, dtype=torch.float32)
+    eps_i = epsilon / (noise_lprobs.size(-1) - 1)
+
+    loss = nll_loss = noise_lprobs.new_zeros(())
+    sides = {'both': (noise_lprobs, clean_lprobs), 'clean': (clean_lprobs,), 'noise': (noise_lprobs,)}[only_nll]
+    for lprobs in sides:
+        nll = -lprobs.gather(dim=-1, index=target.unsqueeze(-1)).sum()
+        smooth = -lprobs.sum()
+        loss = loss + (1.0 - epsilon - eps_i) * nll + eps_i * smooth
+        nll_loss = nll_loss + nll
+
+    log_ratio = clean_lprobs - noise_lprobs
+    if kl_direction == 'clean':
+        kl_loss = (clean_lprobs.exp() * log_ratio).sum()
+    elif kl_direction == 'noise':
+        kl_loss = -(noise_lprobs.exp() * log_ratio).sum()
+    else:
+        kl_loss = ((clean_lprobs.exp() - noise_lprobs.exp()) * log_ratio).sum() / 2
+    return torch.stack([loss, nll_loss, kl_loss])
+
+
+class _FusedRobustLoss(torch.autograd.Function):
+    """The chunked loss of :func:`fused_robust_loss`. Nothing V-wide is kept
+    for the backward pass but the logits themselves: every chunk is
+    recomputed and its gradient written into a single gradient buffer."""
+
+    @staticmethod
+    def forward(ctx, logits, target, positions, epsilon, only_nll, kl_direction, chunk_size):
+        ctx.save_for_backward(logits, target, positions)
+        ctx.loss_args = (epsilon, only_nll, kl_direction)
+        ctx.chunk_size = chunk_size
+        total = logits.new_zeros(3, dtype=torch.float32)
+        for chunk in torch.split(positions, chunk_size):
+            total += _FusedRobustLoss.chunk_loss(logits, target, chunk, ctx.loss_args)[1]
+        return total
+
+    @staticmethod
+    def backward(ctx, grad_total):
+        logits, target, positions = ctx.saved_tensors
+        grad_logits = torch.zeros_like(logits)
+        for chunk in torch.split(positions, ctx.chunk_size):
+            with torch.enable_grad():
+                rows, total = _FusedRobustLoss.chunk_loss(
+                    logits, target, chunk, ctx.loss_args, requires_grad=True
+                )
+                (grad_rows,) = torch.autograd.grad(total, rows[1], grad_total)
+            grad_logits.index_copy_(0, rows[0], grad_rows)
+        return grad_logits, None, None, None, None, None, None
+
+    @staticmethod
+    def chunk_loss(logits, target, chunk, loss_args, requires_grad=False):
+        # rows of the noised half, then of the clean half
+        index = torch.cat([chunk, chunk + target.size(0)])
+        chunk_logits = logits.index_select(0, index)
+        if requires_grad:
+            chunk_logits.requires_grad_()
+        total = _twin_loss_chunk(
+            chunk_logits[: chunk.size(0)],
+            chunk_logits[chunk.size(0) :],
+            target.index_select(0, chunk),
+            *loss_args,
+        )
+        return (index, chunk_logits), total
+
+
+def fused_robust_loss(logits, target, epsilon, ignore_index, only_nll='both', kl_direction='both', chunk_size=1024):
+    """Label-smoothed NLL plus the KL between the two halves of a twin batch.
+
+    Equivalent to :func:`label_smoothed_nll_loss` on the halves selected by
+    *only_nll* plus :meth:`CrossEntropyWithRobustAll.compute_kl_loss` (both
+    reduced), but the non-padding target positions are processed in chunks of
+    *chunk_size* with one softmax per chunk and half, and every chunk is
+    recomputed during the backward pass instead of being stored. The
+    gradients of the chunks are written into one gradient of the logits, so
+    peak memory holds that gradient and a few ``chunk_size x V`` tensors
+    instead of several ``2B x T x V`` ones.
+
+    Args:
+        logits (Tensor): decoder output of shape `(2 * bsz, tgt_len, vocab)`,
+            noised half first
+        target (LongTensor): targets of one half of shape `(bsz, tgt_len)`
+
+    Returns:
+        tuple: the summed loss, NLL loss and KL loss
+    """
+    target = target.reshape(-1)
+    positions = target.ne(ignore_index).nonzero().squeeze(1)
+    total = _FusedRobustLoss.apply(
+        logits.reshape(-1, logits.size(-1)),
+        target,
+        positions,
+        epsilon,
+        only_nll,
+        kl_direction,
+        chunk_size,
+    )
+    return total[0], total[1], total[2]
+
+
 @dataclass
 class CrossEntropyWithRobustAllConfig(
     LabelSmoothedCrossEntropyCriterionConfig):
@@ -51,6 +155,23 @@ class CrossEntropyWithRobustAllConfig(
     only_nll: str = field(
         default='both', metadata={"help": "both clean noise"}
     )
+    dedup_twin_batch: bool = field(
+        default=False,
+        metadata={
+            "help": "forward the clean and noised copy of a sentence only once "
+            "when noising left it unchanged (e.g. while the curriculum rate is 0); "
+            "this drops the dropout-consistency KL term on those sentences"
+        },
+    )
+    fused_loss_chunk_size: int = field(
+        default=0,
+        metadata={
+            "help": "if > 0, compute the NLL and KL losses in chunks of this many "
+            "target tokens with a single softmax per chunk, recomputed in the "
+            "backward pass, instead of materialising full-vocabulary "
+            "probabilities and log-probabilities for the whole batch"
+        },
+    )
   
 @register_criterion(
     "cross_entropy_with_robust_all",
@@ -60,7 +181,7 @@ class CrossEntropyWithRobustAllConfig(
 class CrossEntropyWithRobustAll(
     LabelSmoothedCrossEntropyCriterion
 ):
-    def __init__(self, task, sentence_avg, label_smoothing, reg_alpha, kl_direction, only_nll):
+    def __init__(self, task, sentence_avg, label_smoothing, reg_alpha, kl_direction, only_nll, dedup_twin_batch=False, fused_loss_chunk_size=0):
         super().__init__(task, sentence_avg, label_smoothing)
         
         self.task = task
@@ -68,6 +189,8 @@ class CrossEntropyWithRobustAll(
         self.reg_alpha = reg_alpha        
         self.kl_direction = kl_direction
         self.only_nll = only_nll
+        self.dedup_twin_batch = dedup_twin_batch
+        self.fused_loss_chunk_size = fused_loss_chunk_size
 
     def get_lprobs_and_target(self, model, net_output, sample):
         lprobs = model.get_normalized_probs(net_output, log_probs=True)
@@ -83,13 +206,50 @@ class CrossEntropyWithRobustAll(
     def forward(self, model, sample, reduce=True):
        # print(self.only_one_side_kl) 
         sample_input = sample['net_input']
+        if 'robust_src_tokens' in sample:
+            # twin source already built (and noised) by NoisedLanguagePairDataset
+            src_tokens, src_lengths = sample['robust_src_tokens'], sample['robust_src_lengths']
+        else:
+            src_tokens = torch.cat([sample_input['src_tokens'], sample_input['src_tokens'].clone()], 0)
+            src_lengths = torch.cat([sample_input['src_lengths'], sample_input['src_lengths'].clone()], 0)
         sample_concat_input = {
-            'src_tokens': torch.cat([sample_input['src_tokens'], sample_input['src_tokens'].clone()], 0),
-            'src_lengths': torch.cat([sample_input['src_lengths'], sample_input['src_lengths'].clone()], 0),
+            'src_tokens': src_tokens,
+            'src_lengths': src_lengths,
             'prev_output_tokens': torch.cat([sample_input['prev_output_tokens'], sample_input['prev_output_tokens'].clone()], 0),
+            'sample_ids': twin_sample_ids(sample['id']),
         }
-        
-        net_output = model(**sample_concat_input)
+
+        # without dropout both copies of an unchanged sentence give the same
+        # output, so deduplicating is exact at evaluation time
+        if self.dedup_twin_batch or not model.training:
+            net_output = self.forward_dedup_twin(model, sample_concat_input)
+        else:
+            net_output = model(**sample_concat_input)
+
+        if (
+            self.fused_loss_chunk_size > 0
+            and reduce
+            and getattr(model.decoder, 'adaptive_softmax', None) is None
+        ):
+            loss, nll_loss, kl_loss = fused_robust_loss(
+                net_output[0],
+                model.get_targets(sample, net_output),
+                self.eps,
+                self.padding_idx,
+                only_nll=self.only_nll,
+                kl_direction=self.kl_direction,
+                chunk_size=self.fused_loss_chunk_size,
+            )
+            loss = loss + self.reg_alpha * kl_loss
+            return loss, sample['ntokens'], {
+                'loss': utils.item(loss.data),
+                'nll_loss': utils.item(nll_loss.data),
+                'kl_loss': utils.item(kl_loss.data),
+                'ntokens': sample['ntokens'],
+                'nsentences': sample['target'].size(0),
+                'sample_size': sample['ntokens'],
+            }
+
         lprobs = model.get_normalized_probs(net_output, log_probs=True)
         lprobs = lprobs.view(-1, lprobs.size(-1))
         #print('lprobs=>')
@@ -141,6 +301,48 @@ class CrossEntropyWithRobustAll(
         }
         return loss, sample_size, logging_output
 
+    def forward_dedup_twin(self, model, net_input):
+        """Run the twin batch, forwarding each noised sentence that is
+        identical to its twin only once.
+
+        The source is noised up front so duplicates can be detected; the
+        decoder output is expanded back to the full twin batch afterwards.
+        """
+        src_tokens, src_lengths = net_input['src_tokens'], net_input['src_lengths']
+        if model.training:
+            src_tokens, src_lengths = model.encoder.noise_source(
+                src_tokens, src_lengths, num_updates=model.num_updates, sample_ids=net_input['sample_ids'],
+            )
+        bsz = src_tokens.size(0) // 2
+        dup = src_tokens[:bsz].eq(src_tokens[bsz:]).all(dim=1) & src_lengths[:bsz].eq(src_lengths[bsz:])
+        if not dup.any():
+            return model(
+                src_tokens, src_lengths, net_input['prev_output_tokens'], sample_ids=net_input['sample_ids'], apply_noise=False,
+            )
+
+        keep = torch.cat([~dup, dup.new_ones(bsz)], dim=0)
+        net_output = model(
+            src_tokens[keep],
+            src_lengths[keep],
+            net_input['prev_output_tokens'][keep],
+            sample_ids=net_input['sample_ids'][keep],
+            apply_noise=False,
+        )
+        # map every twin row to the row it was computed in: duplicated first
+        # half rows reuse the output of their second half twin
+        num_kept = int(keep[:bsz].sum())
+        second_half = torch.arange(bsz, device=dup.device) + num_kept
+        first_half = torch.where(dup, second_half, (~dup).long().cumsum(0) - 1)
+        twin_index = torch.cat([first_half, second_half], dim=0)
+
+        logits, extra = net_output
+        if extra is not None and extra.get('attn', None) is not None:
+            extra['attn'] = [
+                attn.index_select(0, twin_index) if attn is not None else None
+                for attn in extra['attn']
+            ]
+        return logits.index_select(0, twin_index), extra
+
     def compute_kl_loss(self, model, net_output, pad_mask=None, reduce=True,kl_direction='both'):
         # print(only_one_side_kl)
         net_prob = model.get_normalized_probs(net_output, log_probs=True)
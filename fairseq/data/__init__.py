@@ -35,7 +35,10 @@ from .mask_tokens_dataset import MaskTokensDataset
 from .monolingual_dataset import MonolingualDataset
 from .multi_corpus_sampled_dataset import MultiCorpusSampledDataset
 from .nested_dictionary_dataset import NestedDictionaryDataset
+from .noise_variants_dataset import NoiseVariantsDataset
 from .noising import NoisingDataset
+from .noised_language_pair_dataset import NoisedLanguagePairDataset
+from .noised_eval_dataset import NoisedEvalDataset
 from .numel_dataset import NumelDataset
 from .num_samples_dataset import NumSamplesDataset
 from .offset_tokens_dataset import OffsetTokensDataset
@@ -57,9 +60,11 @@ from .shorten_dataset import TruncateDataset, RandomCropDataset
 from .multilingual.sampled_multi_dataset import SampledMultiDataset
 from .multilingual.sampled_multi_epoch_dataset import SampledMultiEpochDataset
 from .fasta_dataset import FastaDataset, EncodedFastaDataset
+from .generation_cost_dataset import GenerationCostDataset
 from .transform_eos_concat_langpair_dataset import TransformEosConcatLangPairDataset
 
 from .iterators import (
+    BatchPlan,
     CountingIterator,
     EpochBatchIterator,
     GroupedIterator,
@@ -71,6 +76,7 @@ __all__ = [
     "AppendTokenDataset",
     "BacktranslationDataset",
     "BaseWrapperDataset",
+    "BatchPlan",
     "BinarizedAudioDataset",
     "BucketPadLengthDataset",
     "ColorizeDataset",
@@ -85,6 +91,7 @@ __all__ = [
     "FairseqIterableDataset",
     "FastaDataset",
     "FileAudioDataset",
+    "GenerationCostDataset",
     "GroupedIterator",
     "HubertDataset",
     "IdDataset",
@@ -101,6 +108,9 @@ __all__ = [
     "MonolingualDataset",
     "MultiCorpusSampledDataset",
     "NestedDictionaryDataset",
+    "NoisedEvalDataset",
+    "NoisedLanguagePairDataset",
+    "NoiseVariantsDataset",
     "NoisingDataset",
     "NumelDataset",
     "NumSamplesDataset",
@@ -8,6 +8,7 @@ try:
 except ImportError:
     from collections import Iterable
 import contextlib
+import hashlib
 import itertools
 import logging
 import re
@@ -70,6 +71,59 @@ def collate_tokens(
     return res
 
 
+def collate_spans(
+    tokens,
+    starts,
+    lengths,
+    pad_idx,
+    eos_idx=None,
+    left_pad=False,
+    move_eos_to_beginning=False,
+    pad_to_length=None,
+    pad_to_multiple=1,
+    pin_memory=False,
+):
+    """Like :func:`collate_tokens`, for the token spans
+    ``tokens[starts[i] : starts[i] + lengths[i]]`` of the flat array *tokens*
+    (e.g. the memory-mapped data of a
+    :class:`~fairseq.data.indexed_dataset.MMapIndexedDataset`).
+
+    The spans are read with a single vectorized gather, directly into the
+    2d tensor (in pinned memory if *pin_memory*), instead of one copy per
+    sentence."""
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    size = int(lengths.max())
+    size = size if pad_to_length is None else max(size, pad_to_length)
+    if pad_to_multiple != 1 and size % pad_to_multiple != 0:
+        size = int(((size - 0.1) // pad_to_multiple + 1) * pad_to_multiple)
+
+    # the position in its span of every cell of the batch, out of
+    # [0, length) for the padding
+    offsets = np.arange(size, dtype=np.int64)[None, :]
+    if left_pad:
+        offsets = offsets - (size - lengths)[:, None]
+    mask = (offsets >= 0) & (offsets < lengths[:, None])
+    if move_eos_to_beginning:
+        offsets = offsets - 1
+    index = starts[:, None] + offsets
+    np.clip(index, 0, max(len(tokens) - 1, 0), out=index)
+
+    res = torch.empty((len(lengths), size), dtype=torch.long, pin_memory=pin_memory)
+    out = res.numpy()
+    out[:] = np.take(tokens, index)
+    out[~mask] = pad_idx
+    if move_eos_to_beginning:
+        rows = np.nonzero(lengths > 0)[0]
+        first = size - lengths[rows] if left_pad else 0
+        if eos_idx is None:
+            # if no eos_idx is specified, then use the last token in the span
+            out[rows, first] = tokens[starts[rows] + lengths[rows] - 1]
+        else:
+            out[rows, first] = eos_idx
+    return res
+
+
 def load_indexed_dataset(
     path, dictionary=None, dataset_impl=None, combine=False, default="cached"
 ):
@@ -123,6 +177,33 @@ def load_indexed_dataset(
         return ConcatDataset(datasets)
 
 
+def dataset_fingerprint(dataset):
+    """A hash of what the batches of *dataset* are made from: the classes of
+    *dataset* and of the datasets it wraps (with their shuffling and padding
+    options and ``batch_plan_key()``), the sizes of its items and, if
+    available, their number of tokens."""
+    h = hashlib.sha1()
+    wrapped = dataset
+    while wrapped is not None:
+        h.update(type(wrapped).__name__.encode("utf-8"))
+        for name in ["shuffle", "max_padding_ratio"]:
+            h.update(repr(getattr(wrapped, name, None)).encode("utf-8"))
+        if hasattr(wrapped, "batch_plan_key"):
+            h.update(repr(wrapped.batch_plan_key()).encode("utf-8"))
+        wrapped = getattr(wrapped, "dataset", None)
+    arrays = [np.asarray(dataset.sizes)]
+    try:
+        arrays.append(dataset.num_tokens_vec(np.arange(len(dataset))))
+    except NotImplementedError:
+        pass
+    for array in arrays:
+        h.update("{} {}".format(array.dtype, array.shape).encode("utf-8"))
+        # in chunks, not to copy the (possibly strided) sizes at once
+        for start in range(0, len(array), 2**20):
+            h.update(np.ascontiguousarray(array[start : start + 2**20]).tobytes())
+    return h.hexdigest()
+
+
 @contextlib.contextmanager
 def numpy_seed(seed, *addl_seeds):
     """Context manager which seeds the NumPy PRNG with the specified seed and
@@ -365,6 +446,119 @@ def batch_by_size(
         return batch_fixed_shapes_fast(indices, num_tokens_fn, fixed_shapes_sorted)
 
 
+def batch_by_padding(
+    indices,
+    src_sizes,
+    tgt_sizes=None,
+    max_tokens=None,
+    max_sentences=None,
+    required_batch_size_multiple=1,
+    max_padding_ratio=1.0,
+):
+    """
+    Like :func:`batch_by_size` for source/target pairs, whose batches are
+    also capped in padding: a batch of ``bsz`` pairs is padded to
+    ``bsz * (max source length + max target length)`` positions, and at most
+    *max_padding_ratio* of them may be padding. As in :func:`batch_by_size`,
+    a pair counts ``max(source length, target length)`` tokens towards
+    *max_tokens*. Cutting a batch down to a multiple of
+    *required_batch_size_multiple* may (rarely) leave it above the cap.
+
+    Args:
+        indices (List[int]): ordered list of dataset indices, e.g. sorted by
+            source then target length
+        src_sizes (np.ndarray): source lengths of the dataset
+        tgt_sizes (np.ndarray, optional): target lengths of the dataset
+        max_tokens (int, optional): max number of tokens in each batch
+            (default: None).
+        max_sentences (int, optional): max number of sentences in each
+            batch (default: None).
+        required_batch_size_multiple (int, optional): require batch size to
+            be less than N or a multiple of N (default: 1).
+        max_padding_ratio (float, optional): max fraction of padded positions
+            in each batch (default: 1.0, no cap).
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    src = np.asarray(src_sizes)[indices].astype(np.int64)
+    if tgt_sizes is not None:
+        tgt = np.asarray(tgt_sizes)[indices].astype(np.int64)
+    else:
+        tgt = np.zeros_like(src)
+    max_tokens = max_tokens if max_tokens is not None else float("inf")
+    max_sentences = max_sentences if max_sentences is not None else float("inf")
+    bsz_mult = required_batch_size_multiple
+    assert len(indices) == 0 or np.maximum(src, tgt).max() <= max_tokens, (
+        f"Sentences lengths should not exceed max_tokens={max_tokens}"
+    )
+
+    def overflow(bsz, src_len, tgt_len, num_real):
+        # of the batches [start:start + bsz), elementwise
+        padded = bsz * (src_len + tgt_len)
+        return (bsz > 1) & (
+            (bsz > max_sentences)
+            | (bsz * np.maximum(src_len, tgt_len) > max_tokens)
+            | (padded - num_real > max_padding_ratio * padded)
+        )
+
+    # the batch starts at start and fits up to resume; the batch sizes are
+    # checked for a window of sentences at a time, the window doubling until
+    # the batch overflows
+    batch_ends = []
+    start, resume, window = 0, 0, 64
+    while resume < len(indices):
+        stop = min(len(indices), resume + window)
+        over = overflow(
+            np.arange(1, stop - start + 1),
+            np.maximum.accumulate(src[start:stop]),
+            np.maximum.accumulate(tgt[start:stop]),
+            np.cumsum(src[start:stop] + tgt[start:stop]),
+        )
+        over[: resume - start] = False
+        if not over.any():
+            resume = stop
+            window *= 2
+            continue
+        pos = start + int(over.argmax())
+        # close the batch with a multiple of bsz_mult sentences, the rest is
+        # carried over to the next one
+        end = pos
+        if pos - start >= bsz_mult:
+            end = start + (pos - start) // bsz_mult * bsz_mult
+        batch_ends.append(end)
+        start = end
+        if overflow(
+            pos + 1 - start,
+            src[start : pos + 1].max(),
+            tgt[start : pos + 1].max(),
+            src[start : pos + 1].sum() + tgt[start : pos + 1].sum(),
+        ):
+            # the carried over sentences do not fit with pos either
+            batch_ends.append(pos)
+            start = pos
+        resume = pos + 1
+        window = max(64, 2 * (pos + 1 - batch_ends[-1]))
+    if len(indices) == 0:
+        return []
+    return np.split(indices, batch_ends)
+
+
+def padding_efficiency(batches, src_sizes, tgt_sizes=None):
+    """The number of real tokens and of padded positions of *batches*
+    (source and target)."""
+    num_real, num_padded = 0, 0
+    for batch in batches:
+        batch = np.asarray(batch, dtype=np.int64)
+        if len(batch) == 0:
+            continue
+        lengths = [np.asarray(src_sizes)[batch]]
+        if tgt_sizes is not None:
+            lengths.append(np.asarray(tgt_sizes)[batch])
+        for length in lengths:
+            num_real += int(length.sum())
+            num_padded += len(batch) * int(length.max())
+    return num_real, num_padded
+
+
 def post_process(sentence: str, symbol: str):
     if symbol == "sentencepiece":
         sentence = sentence.replace(" ", "").replace("\u2581", " ").strip()
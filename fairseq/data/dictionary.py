@@ -3,6 +3,7 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import json
 import os
 from collections import Counter
 from multiprocessing import Pool
@@ -10,7 +11,12 @@ from multiprocessing import Pool
 import torch
 from fairseq import utils
 from fairseq.data import data_utils
-from fairseq.file_chunker_utils import Chunker, find_offsets
+from fairseq.file_chunker_utils import (
+    Chunker,
+    find_offsets,
+    find_shard_offsets,
+    input_fingerprint,
+)
 from fairseq.file_io import PathManager
 from fairseq.tokenizer import tokenize_line
 
@@ -380,6 +386,67 @@ class Dictionary:
                 )
             )
 
+    @staticmethod
+    def _count_shard(filename, tokenize, eos_word, start_offset, end_offset, path):
+        fingerprint = input_fingerprint(filename)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                shard = json.load(f)
+            if shard["input"] == fingerprint and shard["offsets"] == [
+                start_offset,
+                end_offset,
+            ]:
+                return Counter(shard["counts"])
+        counter = Dictionary._add_file_to_dictionary_single_worker(
+            filename, tokenize, eos_word, start_offset, end_offset
+        )
+        tmp_path = "{}.tmp{}".format(path, os.getpid())
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "input": fingerprint,
+                    "offsets": [start_offset, end_offset],
+                    "counts": counter,
+                },
+                f,
+            )
+        os.replace(tmp_path, path)
+        return counter
+
+    @staticmethod
+    def add_file_to_dictionary_sharded(
+        filename, dict, tokenize, num_workers, shard_size, counts_dir
+    ):
+        """Same as :func:`add_file_to_dictionary`, counting the words of
+        shards of about *shard_size* bytes, whose counts are saved in
+        *counts_dir*. Shards counted by an interrupted run of the same file are
+        not counted again."""
+        local_file = PathManager.get_local_path(filename)
+        offsets = find_shard_offsets(local_file, shard_size)
+        os.makedirs(counts_dir, exist_ok=True)
+        jobs = [
+            (
+                local_file,
+                tokenize,
+                dict.eos_word,
+                start_offset,
+                end_offset,
+                os.path.join(
+                    counts_dir,
+                    "{}.shard{}.json".format(os.path.basename(local_file), i),
+                ),
+            )
+            for i, (start_offset, end_offset) in enumerate(zip(offsets, offsets[1:]))
+        ]
+        if num_workers > 1 and len(jobs) > 1:
+            with Pool(processes=min(num_workers, len(jobs))) as pool:
+                counters = pool.starmap(Dictionary._count_shard, jobs)
+        else:
+            counters = [Dictionary._count_shard(*job) for job in jobs]
+        for counter in counters:
+            for w, c in sorted(counter.items()):
+                dict.add_symbol(w, c)
+
 
 class TruncatedDictionary(object):
     def __init__(self, wrapped_dict, length):
@@ -72,6 +72,13 @@ class FairseqDataset(torch.utils.data.Dataset, EpochListening):
         on this order."""
         return np.arange(len(self), dtype=np.int64)
 
+    def batch_plan_key(self):
+        """Return the state of this dataset, besides the sizes of its items,
+        that :func:`ordered_indices` and :func:`batch_by_size` depend on (e.g.
+        a subset of the items), as a value with a stable ``repr``. It is part
+        of the key of the cached batches (see ``--batch-plan-cache``)."""
+        return None
+
     @property
     def supports_prefetch(self):
         """Whether this dataset supports prefetching."""
@@ -0,0 +1,89 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import numpy as np
+
+from . import BaseWrapperDataset, data_utils
+
+
+class GenerationCostDataset(BaseWrapperDataset):
+    """Batch a :class:`~fairseq.data.LanguagePairDataset` for beam search by
+    its decoding cost.
+
+    A batch is decoded until its longest sentence reaches the maximum output
+    length ``min(max_len_a * src_len + max_len_b, max_len)`` of its longest
+    source, so the cost of a sentence is its beam times that length, and
+    ``max_tokens`` in :func:`batch_by_size` bounds ``beam * output length *
+    batch size``. Since the indices are ordered by source length, every batch
+    holds sentences of similar output length. The batches are returned
+    longest first, so that the peak memory is reached at the start and the
+    following batches only shrink.
+
+    Args:
+        dataset (~fairseq.data.LanguagePairDataset): dataset to wrap
+        beam_size (int): beam width
+        max_len_a/b (float, int): the maximum output length is ax + b,
+            where x is the source length
+        max_len (int, optional): cap of the maximum output length
+    """
+
+    def __init__(self, dataset, beam_size, max_len_a, max_len_b, max_len=None):
+        super().__init__(dataset)
+        self.beam_size = beam_size
+        self.max_len_a = max_len_a
+        self.max_len_b = max_len_b
+        self.max_len = max_len
+        src_sizes = getattr(dataset, "src_sizes", None)
+        if src_sizes is None:
+            src_sizes = dataset.sizes
+        self.src_sizes = np.asarray(src_sizes)
+
+    def __getitems__(self, indices):
+        # whole batches, see LanguagePairDataset.batch_read
+        if hasattr(self.dataset, "__getitems__"):
+            return self.dataset.__getitems__(indices)
+        return [self[index] for index in indices]
+
+    def max_output_lengths(self, indices):
+        lengths = (self.src_sizes[indices] * self.max_len_a + self.max_len_b).astype(
+            np.int64
+        )
+        if self.max_len is not None:
+            lengths = np.minimum(lengths, self.max_len)
+        return lengths
+
+    def num_tokens(self, index):
+        return int(self.num_tokens_vec(np.array([index]))[0])
+
+    def num_tokens_vec(self, indices):
+        # +1 for the EOS step
+        return self.beam_size * (self.max_output_lengths(indices) + 1)
+
+    def batch_by_size(
+        self,
+        indices,
+        max_tokens=None,
+        max_sentences=None,
+        required_batch_size_multiple=1,
+    ):
+        num_tokens = self.num_tokens_vec(indices)
+        if max_tokens is not None and len(num_tokens) > 0:
+            if num_tokens.max() > max_tokens:
+                raise ValueError(
+                    "the generation batch budget {} is smaller than the cost of "
+                    "a single sentence ({} = beam * maximum output length)".format(
+                        max_tokens, num_tokens.max()
+                    )
+                )
+        batches = data_utils.batch_by_size(
+            indices,
+            num_tokens_fn=self.num_tokens,
+            num_tokens_vec=num_tokens,
+            max_tokens=max_tokens,
+            max_sentences=max_sentences,
+            required_batch_size_multiple=required_batch_size_multiple,
+        )
+        cost = np.array([self.num_tokens_vec(batch).max() for batch in batches])
+        return [batches[i] for i in np.argsort(-cost, kind="stable")]
@@ -3,6 +3,8 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import json
+import os
 import shutil
 import struct
 from functools import lru_cache
@@ -40,7 +42,10 @@ def get_available_dataset_impl():
 
 
 def infer_dataset_impl(path):
-    if IndexedRawTextDataset.exists(path):
+    manifest = read_shard_manifest(path)
+    if manifest is not None:
+        return manifest["dataset_impl"]
+    elif IndexedRawTextDataset.exists(path):
         return "raw"
     elif IndexedDataset.exists(path):
         with open(index_file_path(path), "rb") as f:
@@ -75,7 +80,17 @@ def make_builder(out_file, impl, vocab_size=None):
 
 
 def make_dataset(path, impl, fix_lua_indexing=False, dictionary=None):
-    if impl == "raw" and IndexedRawTextDataset.exists(path):
+    manifest = read_shard_manifest(path)
+    if manifest is not None and impl == manifest["dataset_impl"]:
+        from fairseq.data.concat_dataset import ConcatDataset
+
+        return ConcatDataset(
+            [
+                make_dataset(shard, impl, fix_lua_indexing=fix_lua_indexing)
+                for shard in shard_prefixes(path, manifest)
+            ]
+        )
+    elif impl == "raw" and IndexedRawTextDataset.exists(path):
         assert dictionary is not None
         return IndexedRawTextDataset(path, dictionary)
     elif impl == "lazy" and IndexedDataset.exists(path):
@@ -94,7 +109,10 @@ def make_dataset(path, impl, fix_lua_indexing=False, dictionary=None):
 
 
 def dataset_exists(path, impl):
-    if impl == "raw":
+    manifest = read_shard_manifest(path)
+    if manifest is not None:
+        return impl == manifest["dataset_impl"]
+    elif impl == "raw":
         return IndexedRawTextDataset.exists(path)
     elif impl == "mmap":
         return MMapIndexedDataset.exists(path)
@@ -143,6 +161,40 @@ def data_file_path(prefix_path):
     return prefix_path + ".bin"
 
 
+def shard_manifest_path(prefix_path):
+    return prefix_path + ".shards.json"
+
+
+def read_shard_manifest(prefix_path, complete=True):
+    """The manifest of a dataset binarized in shards by ``fairseq-preprocess
+    --shard-size``, or None. A dataset with a manifest is loaded as the
+    concatenation of its shards, the ``shards`` of the manifest, each of which
+    is the prefix of an indexed dataset next to the manifest. Unless
+    *complete* is False, the manifest of a dataset whose binarization has not
+    finished is ignored."""
+    path = shard_manifest_path(prefix_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if complete and any(shard is None for shard in manifest["shards"]):
+        return None
+    return manifest
+
+
+def write_shard_manifest(prefix_path, manifest):
+    path = shard_manifest_path(prefix_path)
+    tmp_path = "{}.tmp{}".format(path, os.getpid())
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def shard_prefixes(prefix_path, manifest):
+    directory = os.path.dirname(prefix_path)
+    return [os.path.join(directory, shard["prefix"]) for shard in manifest["shards"]]
+
+
 class IndexedDataset(FairseqDataset):
     """Loader for TorchNet IndexedDataset"""
 
@@ -532,6 +584,18 @@ class MMapIndexedDataset(torch.utils.data.Dataset):
     def sizes(self):
         return self._index.sizes
 
+    @property
+    def tokens(self):
+        """The items, concatenated, as a flat array over the memory-mapped
+        data (no copy)."""
+        return np.frombuffer(self._bin_buffer, dtype=self._index.dtype)
+
+    def spans(self, indices):
+        """The start in :attr:`tokens` and the length of the items
+        *indices*, e.g. for :func:`~fairseq.data.data_utils.collate_spans`."""
+        starts = self._index._pointers[indices] // self._index._dtype_size
+        return starts, self._index.sizes[indices]
+
     @property
     def supports_prefetch(self):
         return False
@@ -233,6 +233,102 @@ class StreamingEpochBatchIterator(EpochBatchIterating):
         return itr
 
 
+class BatchPlan(object):
+    """The batches of a dataset as two flat arrays: *indices*, the sample
+    indices of all the batches one after the other, and *offsets*, where
+    batch ``i`` is ``indices[offsets[i] : offsets[i + 1]]``.
+
+    Unlike a list of one array per batch, a plan of millions of batches takes
+    two allocations, can be saved, memory-mapped and shared by processes
+    (see :func:`save` and :func:`load`), and is reordered by permuting batch
+    numbers (see :class:`EpochBatches`).
+    """
+
+    def __init__(self, offsets, indices):
+        self.offsets = offsets
+        self.indices = indices
+
+    @classmethod
+    def from_batches(cls, batches):
+        if isinstance(batches, BatchPlan):
+            return batches
+        batches = [np.asarray(batch, dtype=np.int64).reshape(-1) for batch in batches]
+        offsets = np.zeros(len(batches) + 1, dtype=np.int64)
+        np.cumsum(
+            np.array([len(batch) for batch in batches], dtype=np.int64),
+            out=offsets[1:],
+        )
+        indices = (
+            np.concatenate(batches) if len(batches) > 0 else np.zeros(0, np.int64)
+        )
+        return cls(offsets, indices)
+
+    @staticmethod
+    def files(path):
+        return path + ".offsets.npy", path + ".indices.npy"
+
+    def save(self, path):
+        """Write the plan to ``<path>.offsets.npy`` and ``<path>.indices.npy``
+        (atomically, so that concurrent readers never see a partial plan)."""
+        for filename, array in zip(self.files(path), [self.offsets, self.indices]):
+            tmp_filename = "{}.tmp{}.npy".format(filename[:-4], os.getpid())
+            np.save(tmp_filename, array)
+            os.replace(tmp_filename, filename)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        offsets, indices = [
+            np.load(filename, mmap_mode="r" if mmap else None)
+            for filename in cls.files(path)
+        ]
+        return cls(offsets, indices)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        # a plain array even if memory-mapped, e.g. to be sent to the workers
+        return np.asarray(self.indices[self.offsets[i] : self.offsets[i + 1]])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class EpochBatches(object):
+    """The batches of a :class:`BatchPlan` in the order *order* of their
+    numbers, where -1 is an empty batch (padding of the last shard)."""
+
+    def __init__(self, plan, order):
+        self.plan = plan
+        self.order = order
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return EpochBatches(self.plan, self.order[i])
+        if self.order[i] < 0:
+            return np.zeros(0, dtype=np.int64)
+        return self.plan[self.order[i]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def all_indices(self):
+        """The indices of all the batches, concatenated."""
+        order = self.order[self.order >= 0]
+        starts = self.plan.offsets[order]
+        lengths = self.plan.offsets[order + 1] - starts
+        # position of every index in its batch
+        positions = np.arange(lengths.sum()) - np.repeat(
+            np.cumsum(lengths) - lengths, lengths
+        )
+        return self.plan.indices[np.repeat(starts, lengths) + positions]
+
+
 class FrozenBatchSampler:
     def __init__(
         self,
@@ -327,9 +423,7 @@ class EpochBatchIterator(EpochBatchIterating):
         self.dataset = dataset
         self.collate_fn = collate_fn
         self.batch_sampler = batch_sampler
-        self._frozen_batches = (
-            tuple(batch_sampler) if not callable(batch_sampler) else None
-        )
+        self._frozen_batches = None
         self.seed = seed
         self.num_shards = num_shards
         self.shard_id = shard_id
@@ -355,7 +449,13 @@ class EpochBatchIterator(EpochBatchIterating):
     @property
     def frozen_batches(self):
         if self._frozen_batches is None:
-            self._frozen_batches = tuple(self.batch_sampler(self.dataset, self.epoch))
+            if callable(self.batch_sampler):
+                batches = self.batch_sampler(self.dataset, self.epoch)
+                self._frozen_batches = BatchPlan.from_batches(batches)
+            else:
+                self._frozen_batches = BatchPlan.from_batches(self.batch_sampler)
+                # do not keep the list of batches around
+                self.batch_sampler = self._frozen_batches
         return self._frozen_batches
 
     @property
@@ -531,43 +631,48 @@ class EpochBatchIterator(EpochBatchIterating):
         return itr
 
     def ordered_batches(self, epoch, fix_batches_to_gpus, shuffle):
-        def shuffle_batches(batches, seed):
+        # the batches are reordered and sharded as batch numbers, the batches
+        # themselves stay in self.frozen_batches
+        def shuffle_batches(order, seed):
             with data_utils.numpy_seed(seed):
 
                 if self.grouped_shuffling:
-                    grouped_batches = [
-                        batches[(i * self.num_shards) : ((i + 1) * self.num_shards)]
-                        for i in range((len(batches) // self.num_shards))
-                    ]
-                    np.random.shuffle(grouped_batches)
-                    batches = list(itertools.chain(*grouped_batches))
+                    num_groups = len(order) // self.num_shards
+                    grouped_order = order[: num_groups * self.num_shards].reshape(
+                        num_groups, self.num_shards
+                    )
+                    np.random.shuffle(grouped_order)
+                    order = grouped_order.reshape(-1)
                 else:
-                    np.random.shuffle(batches)
+                    np.random.shuffle(order)
 
-            return batches
+            return order
 
-        if self._supports_prefetch:
-            batches = self.frozen_batches
+        def shard_batches(order):
+            # same as ShardedIterator, with -1 (an empty batch) as fill value
+            sharded_len = int(math.ceil(len(order) / float(self.num_shards)))
+            sharded = np.full(sharded_len, -1, dtype=np.int64)
+            shard = order[self.shard_id :: self.num_shards]
+            sharded[: len(shard)] = shard
+            return sharded
 
+        order = np.arange(len(self.frozen_batches), dtype=np.int64)
+        if self._supports_prefetch:
             if shuffle and not fix_batches_to_gpus:
-                batches = shuffle_batches(list(batches), self.seed + epoch)
+                order = shuffle_batches(order, self.seed + epoch)
 
-            batches = list(
-                ShardedIterator(batches, self.num_shards, self.shard_id, fill_value=[])
+            order = shard_batches(order)
+            self.dataset.prefetch(
+                EpochBatches(self.frozen_batches, order).all_indices()
             )
-            self.dataset.prefetch([i for s in batches for i in s])
 
             if shuffle and fix_batches_to_gpus:
-                batches = shuffle_batches(batches, self.seed + epoch + self.shard_id)
+                order = shuffle_batches(order, self.seed + epoch + self.shard_id)
         else:
             if shuffle:
-                batches = shuffle_batches(list(self.frozen_batches), self.seed + epoch)
-            else:
-                batches = self.frozen_batches
-            batches = list(
-                ShardedIterator(batches, self.num_shards, self.shard_id, fill_value=[])
-            )
-        return batches
+                order = shuffle_batches(order, self.seed + epoch)
+            order = shard_batches(order)
+        return EpochBatches(self.frozen_batches, order)
 
 
 class GroupedIterator(CountingIterator):
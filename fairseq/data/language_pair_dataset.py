@@ -8,6 +8,7 @@ import logging
 import numpy as np
 import torch
 from fairseq.data import FairseqDataset, data_utils
+from fairseq.data.indexed_dataset import MMapIndexedDataset
 
 
 logger = logging.getLogger(__name__)
@@ -202,6 +203,9 @@ class LanguagePairDataset(FairseqDataset):
         tgt_lang_id (int, optional): target language ID, if set, the collated batch
             will contain a field 'tgt_lang_id' which indicates the target language
              of the samples.
+        max_padding_ratio (float, optional): if set, batch by both source and
+            target lengths, with at most this fraction of padded positions per
+            batch (see :func:`~fairseq.data.data_utils.batch_by_padding`)
     """
 
     def __init__(
@@ -226,6 +230,7 @@ class LanguagePairDataset(FairseqDataset):
         src_lang_id=None,
         tgt_lang_id=None,
         pad_to_multiple=1,
+        max_padding_ratio=None,
     ):
         if tgt_dict is not None:
             assert src_dict.pad() == tgt_dict.pad()
@@ -297,6 +302,18 @@ class LanguagePairDataset(FairseqDataset):
         else:
             self.buckets = None
         self.pad_to_multiple = pad_to_multiple
+        self.max_padding_ratio = max_padding_ratio
+        # batches of unmodified memory-mapped sentences are read as a whole,
+        # see collate_batch()
+        self.batch_read = (
+            isinstance(self.src, MMapIndexedDataset)
+            and (self.tgt is None or isinstance(self.tgt, MMapIndexedDataset))
+            and not remove_eos_from_source
+            and not append_eos_to_target
+            and not append_bos
+            and align_dataset is None
+            and constraints is None
+        )
 
     def get_batch_shapes(self):
         return self.buckets
@@ -338,9 +355,88 @@ class LanguagePairDataset(FairseqDataset):
             example["constraints"] = self.constraints[index]
         return example
 
+    def __getitems__(self, indices):
+        """Called by the DataLoader for a whole batch. With :attr:`batch_read`,
+        the sentences are not read here but by :func:`collater`, which only
+        needs their ids."""
+        if self.batch_read:
+            return [{"id": index} for index in indices]
+        return [self[index] for index in indices]
+
     def __len__(self):
         return len(self.src)
 
+    def collate_batch(self, indices, pad_to_length=None):
+        """Like :func:`collater`, for the sentences *indices* of memory-mapped
+        datasets (see :attr:`batch_read`). The batch is sorted by source length
+        first, and the sources, targets and previous output tokens are then
+        each read from the memory-mapped data with a single gather, straight
+        into their (pinned, outside of the DataLoader workers) batch tensor.
+        """
+        pad = self.src_dict.pad()
+        pin_memory = (
+            torch.utils.data.get_worker_info() is None and torch.cuda.is_available()
+        )
+        indices = np.asarray(indices, dtype=np.int64)
+        # sort by descending source length
+        src_starts, src_lengths = self.src.spans(indices)
+        sort_order = np.argsort(-src_lengths, kind="stable")
+        indices = indices[sort_order]
+        src_starts, src_lengths = src_starts[sort_order], src_lengths[sort_order]
+
+        src_tokens = data_utils.collate_spans(
+            self.src.tokens,
+            src_starts,
+            src_lengths,
+            pad,
+            self.eos,
+            left_pad=self.left_pad_source,
+            pad_to_length=pad_to_length["source"]
+            if pad_to_length is not None
+            else None,
+            pad_to_multiple=self.pad_to_multiple,
+            pin_memory=pin_memory,
+        )
+        src_lengths = torch.from_numpy(src_lengths.astype(np.int64))
+        batch = {
+            "id": torch.from_numpy(indices),
+            "nsentences": len(indices),
+            "ntokens": src_lengths.sum().item(),
+            "net_input": {
+                "src_tokens": src_tokens,
+                "src_lengths": src_lengths,
+            },
+            "target": None,
+        }
+        if self.tgt is None:
+            return batch
+
+        tgt_starts, tgt_lengths = self.tgt.spans(indices)
+
+        def merge_target(move_eos_to_beginning):
+            return data_utils.collate_spans(
+                self.tgt.tokens,
+                tgt_starts,
+                tgt_lengths,
+                pad,
+                self.eos,
+                left_pad=self.left_pad_target,
+                move_eos_to_beginning=move_eos_to_beginning,
+                pad_to_length=pad_to_length["target"]
+                if pad_to_length is not None
+                else None,
+                pad_to_multiple=self.pad_to_multiple,
+                pin_memory=pin_memory,
+            )
+
+        batch["target"] = merge_target(move_eos_to_beginning=False)
+        batch["ntokens"] = int(tgt_lengths.sum())
+        if self.input_feeding:
+            batch["net_input"]["prev_output_tokens"] = merge_target(
+                move_eos_to_beginning=True
+            )
+        return batch
+
     def collater(self, samples, pad_to_length=None):
         """Merge a list of samples to form a mini-batch.
 
@@ -377,16 +473,19 @@ class LanguagePairDataset(FairseqDataset):
                 - `tgt_lang_id` (LongTensor): a long Tensor which contains target language
                    IDs of each sample in the batch
         """
-        res = collate(
-            samples,
-            pad_idx=self.src_dict.pad(),
-            eos_idx=self.eos,
-            left_pad_source=self.left_pad_source,
-            left_pad_target=self.left_pad_target,
-            input_feeding=self.input_feeding,
-            pad_to_length=pad_to_length,
-            pad_to_multiple=self.pad_to_multiple,
-        )
+        if self.batch_read and len(samples) > 0:
+            res = self.collate_batch([s["id"] for s in samples], pad_to_length)
+        else:
+            res = collate(
+                samples,
+                pad_idx=self.src_dict.pad(),
+                eos_idx=self.eos,
+                left_pad_source=self.left_pad_source,
+                left_pad_target=self.left_pad_target,
+                input_feeding=self.input_feeding,
+                pad_to_length=pad_to_length,
+                pad_to_multiple=self.pad_to_multiple,
+            )
         if self.src_lang_id is not None or self.tgt_lang_id is not None:
             src_tokens = res["net_input"]["src_tokens"]
             bsz = src_tokens.size(0)
@@ -416,6 +515,43 @@ class LanguagePairDataset(FairseqDataset):
             sizes = np.maximum(sizes, self.tgt_sizes[indices])
         return sizes
 
+    def batch_by_size(
+        self,
+        indices,
+        max_tokens=None,
+        max_sentences=None,
+        required_batch_size_multiple=1,
+    ):
+        if self.max_padding_ratio is None:
+            return super().batch_by_size(
+                indices,
+                max_tokens=max_tokens,
+                max_sentences=max_sentences,
+                required_batch_size_multiple=required_batch_size_multiple,
+            )
+        batches = data_utils.batch_by_padding(
+            indices,
+            self.src_sizes,
+            self.tgt_sizes,
+            max_tokens=max_tokens,
+            max_sentences=max_sentences,
+            required_batch_size_multiple=required_batch_size_multiple,
+            max_padding_ratio=self.max_padding_ratio,
+        )
+        num_real, num_padded = data_utils.padding_efficiency(
+            batches, self.src_sizes, self.tgt_sizes
+        )
+        logger.info(
+            "{} batches of {:.1f} sentences on average, padding efficiency "
+            "{:.3f} (max padding ratio {})".format(
+                len(batches),
+                len(indices) / max(len(batches), 1),
+                num_real / max(num_padded, 1),
+                self.max_padding_ratio,
+            )
+        )
+        return batches
+
     def size(self, index):
         """Return an example's size as a float or tuple. This value is used when
         filtering a dataset with ``--max-positions``."""
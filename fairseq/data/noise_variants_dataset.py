@@ -0,0 +1,203 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+
+import torch
+
+from . import BaseWrapperDataset, data_utils, indexed_dataset
+from .robust_noising import (
+    STREAM_VARIANT,
+    CounterRNG,
+    TokenNoiser,
+    sample_noise_rates,
+    twin_sample_ids,
+)
+
+
+def noise_variants_prefix(split, noise_type, rate):
+    """Output prefix of the noised source variants written by
+    ``fairseq-preprocess --noise-variants``."""
+    return "{}.noise-{}-{:g}".format(split, noise_type, rate)
+
+
+def write_noise_variants(
+    source,
+    dictionary,
+    output_prefix,
+    noise_type,
+    rate,
+    num_variants=1,
+    seed=64,
+    batch_size=256,
+):
+    """Binarize *num_variants* noised copies of every sentence of *source*
+    as a memory-mapped dataset at *output_prefix*.
+
+    Variant *v* of sentence *i* is item ``i * num_variants + v``; it is
+    noised with the :class:`~fairseq.data.robust_noising.CounterRNG` key
+    ``i * num_variants + v``, so the variants can be regenerated exactly.
+    The files are written under a temporary name and then renamed, so that
+    concurrent writers of the same variants do not corrupt each other.
+    """
+    noiser = TokenNoiser(dictionary, noise_type, left_pad=True)
+    tmp_prefix = "{}.tmp{}".format(output_prefix, os.getpid())
+    builder = indexed_dataset.make_builder(
+        tmp_prefix + ".bin", "mmap", vocab_size=len(dictionary)
+    )
+    for start in range(0, len(source), batch_size):
+        ids = torch.arange(start, min(start + batch_size, len(source)))
+        tokens = data_utils.collate_tokens(
+            [source[i] for i in ids.tolist()],
+            dictionary.pad(),
+            dictionary.eos(),
+            left_pad=True,
+        )
+        lengths = tokens.ne(dictionary.pad()).sum(dim=1)
+        keys = (ids * num_variants).repeat_interleave(num_variants) + torch.arange(
+            num_variants
+        ).repeat(len(ids))
+        noised, noised_lengths = noiser.noise(
+            tokens.repeat_interleave(num_variants, dim=0),
+            lengths.repeat_interleave(num_variants),
+            torch.full((len(keys),), rate, dtype=torch.double),
+            rng=CounterRNG(seed, keys),
+        )
+        width = noised.size(1)
+        for row, length in zip(noised, noised_lengths.tolist()):
+            builder.add_item(row[width - length :])
+    builder.finalize(tmp_prefix + ".idx")
+    # the index last: readers check for both files
+    os.replace(tmp_prefix + ".bin", output_prefix + ".bin")
+    os.replace(tmp_prefix + ".idx", output_prefix + ".idx")
+
+
+class NoiseVariantsDataset(BaseWrapperDataset):
+    """A :class:`~fairseq.data.LanguagePairDataset` wrapper that builds the
+    ISDST clean/noisy twin batch from noised source variants precomputed by
+    ``fairseq-preprocess --noise-variants N``.
+
+    Variant *v* of sentence *i* at noise rate *r* is item ``i * N + v`` of
+    the *r* dataset in *variants*. Every sentence of the twin batch gets a
+    noise rate (the constant ``--noise-rate`` or one drawn from the noise
+    curriculum), which is rounded to the nearest precomputed rate, and a
+    variant that changes every epoch. Collation adds the same
+    `robust_src_tokens` and `robust_src_lengths` keys as
+    :class:`~fairseq.data.NoisedLanguagePairDataset`, but only reads the
+    memory-mapped variants instead of generating noise.
+
+    The variants mirror the binarized source, so the wrapped dataset must
+    not modify its source sentences (e.g. with ``--truncate-source``).
+
+    Args:
+        dataset (~fairseq.data.LanguagePairDataset): dataset to wrap
+        variants (Dict[float, ~fairseq.data.MMapIndexedDataset]): noised
+            source variants, keyed by noise rate
+        args (argparse.Namespace): model arguments holding the
+            ``--noise-*`` and ``--is-half-batch`` options
+        noise_curriculum (~fairseq.optim.noise_curriculum.NoiseCurriculumScheduler,
+            optional): schedule of the noise rates (default: the constant
+            ``--noise-rate``)
+    """
+
+    def __init__(self, dataset, variants, args, noise_curriculum=None):
+        super().__init__(dataset)
+        self.rates = sorted(variants.keys())
+        self.variants = [variants[rate] for rate in self.rates]
+        self.num_variants = len(self.variants[0]) // len(dataset)
+        for rate, variant in zip(self.rates, self.variants):
+            if self.num_variants == 0 or len(variant) != self.num_variants * len(
+                dataset
+            ):
+                raise ValueError(
+                    "{} noise variants at rate {:g} do not match the {} source "
+                    "sentences".format(len(variant), rate, len(dataset))
+                )
+        self.rate_buckets = torch.tensor(self.rates, dtype=torch.double)
+        self.noise_rate = getattr(args, "noise_rate", 0.0)
+        self.noise_seed = getattr(args, "noise_seed", 64)
+        self.is_half_batch = getattr(args, "is_half_batch", False)
+        self.noise_curriculum = noise_curriculum
+        self.pad = dataset.src_dict.pad()
+        self.eos = dataset.src_dict.eos()
+        self.left_pad = dataset.left_pad_source
+        # (epoch, num_updates), shared with the DataLoader workers
+        self._state = torch.zeros(2, dtype=torch.long).share_memory_()
+
+    def set_epoch(self, epoch):
+        super().set_epoch(epoch)
+        self._state[0] = epoch
+
+    def set_num_updates(self, num_updates):
+        self._state[1] = num_updates
+
+    @property
+    def epoch(self):
+        return int(self._state[0])
+
+    @property
+    def num_updates(self):
+        return int(self._state[1])
+
+    def _strip(self, tokens, length):
+        if self.left_pad:
+            return tokens[tokens.size(0) - length :]
+        return tokens[:length]
+
+    def __getitems__(self, indices):
+        # whole batches, see LanguagePairDataset.batch_read
+        if hasattr(self.dataset, "__getitems__"):
+            return self.dataset.__getitems__(indices)
+        return [self[index] for index in indices]
+
+    def collater(self, samples, **extra_args):
+        samples = self.dataset.collater(samples, **extra_args)
+        if len(samples) == 0 or self.noise_rate == 0:
+            return samples
+
+        src_tokens = samples["net_input"]["src_tokens"]
+        src_lengths = samples["net_input"]["src_lengths"]
+        bsz = src_tokens.size(0)
+        twin_ids = twin_sample_ids(samples["id"])
+        num_updates = self.num_updates
+        rates = sample_noise_rates(
+            2 * bsz,
+            num_updates,
+            self.noise_rate,
+            is_half_batch=self.is_half_batch,
+            curriculum=self.noise_curriculum,
+            rng=CounterRNG(
+                self.noise_seed, twin_ids, epoch=self.epoch, num_updates=num_updates
+            ),
+        )
+        buckets = (
+            (rates.unsqueeze(1) - self.rate_buckets).abs().argmin(dim=1).tolist()
+        )
+        variant_ids = (
+            CounterRNG(self.noise_seed, twin_ids, epoch=self.epoch)
+            .randint(0, self.num_variants, (2 * bsz,), STREAM_VARIANT)
+            .tolist()
+        )
+
+        ids = samples["id"].tolist()
+        rows = []
+        for j, (rate, bucket, v) in enumerate(zip(rates.tolist(), buckets, variant_ids)):
+            i = j % bsz
+            if rate == 0:
+                rows.append(self._strip(src_tokens[i], int(src_lengths[i])))
+            else:
+                rows.append(self.variants[bucket][ids[i] * self.num_variants + v])
+        samples["robust_src_tokens"] = data_utils.collate_tokens(
+            rows, self.pad, self.eos, left_pad=self.left_pad
+        )
+        samples["robust_src_lengths"] = torch.LongTensor([row.numel() for row in rows])
+        return samples
+
+    def num_tokens_vec(self, indices):
+        return self.dataset.num_tokens_vec(indices)
+
+    @property
+    def supports_prefetch(self):
+        return False
@@ -0,0 +1,73 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import torch
+
+from . import BaseWrapperDataset, data_utils
+
+
+class NoisedEvalDataset(BaseWrapperDataset):
+    """A :class:`~fairseq.data.LanguagePairDataset` wrapper that adds fixed
+    noised copies of the source to every validation batch.
+
+    Collation adds an `eval_net_input` key: the source of the batch followed
+    by its copy from each of the *noised* datasets, as a single
+    ``(K + 1) * B`` batch, so that BLEU on the clean and all noised sources
+    is decoded in one generation pass. The loss is still computed on the
+    clean `net_input` only.
+
+    Args:
+        dataset (~fairseq.data.LanguagePairDataset): dataset to wrap
+        noised (List[Tuple[str, ~fairseq.data.MMapIndexedDataset]]): noise
+            type and noised source of each copy, aligned with the source of
+            *dataset*
+    """
+
+    def __init__(self, dataset, noised):
+        super().__init__(dataset)
+        for noise_type, source in noised:
+            if len(source) != len(dataset):
+                raise ValueError(
+                    "{} {}-noised sentences do not match the {} source "
+                    "sentences".format(len(source), noise_type, len(dataset))
+                )
+        self.noise_types = [noise_type for noise_type, _ in noised]
+        self.noised = [source for _, source in noised]
+        self.pad = dataset.src_dict.pad()
+        self.eos = dataset.src_dict.eos()
+        self.left_pad = dataset.left_pad_source
+
+    def __getitems__(self, indices):
+        # whole batches, see LanguagePairDataset.batch_read
+        if hasattr(self.dataset, "__getitems__"):
+            return self.dataset.__getitems__(indices)
+        return [self[index] for index in indices]
+
+    def collater(self, samples, **extra_args):
+        samples = self.dataset.collater(samples, **extra_args)
+        if len(samples) == 0:
+            return samples
+
+        src_tokens = samples["net_input"]["src_tokens"]
+        src_lengths = samples["net_input"]["src_lengths"].tolist()
+        tsz = src_tokens.size(1)
+        rows = [
+            src_tokens[i, tsz - length :] if self.left_pad else src_tokens[i, :length]
+            for i, length in enumerate(src_lengths)
+        ]
+        ids = samples["id"].tolist()
+        for source in self.noised:
+            rows.extend(source[i] for i in ids)
+        samples["eval_net_input"] = {
+            "src_tokens": data_utils.collate_tokens(
+                rows, self.pad, self.eos, left_pad=self.left_pad
+            ),
+            "src_lengths": torch.LongTensor([row.numel() for row in rows]),
+        }
+        samples["eval_noise_types"] = self.noise_types
+        return samples
+
+    def num_tokens_vec(self, indices):
+        return self.dataset.num_tokens_vec(indices)
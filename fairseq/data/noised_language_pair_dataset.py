@@ -0,0 +1,115 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import torch
+
+from . import BaseWrapperDataset
+from .robust_noising import (
+    CounterRNG,
+    TokenNoiser,
+    sample_noise_rates,
+    twin_sample_ids,
+)
+
+
+class NoisedLanguagePairDataset(BaseWrapperDataset):
+    """A :class:`~fairseq.data.LanguagePairDataset` wrapper that builds the
+    noised source of the ISDST clean/noisy twin batch in :func:`collater`.
+
+    Collation runs inside the ``--num-workers`` DataLoader processes, so noise
+    generation overlaps with the training step instead of running in the
+    encoder forward. The collated batch gets two extra keys:
+
+        - `robust_src_tokens` (LongTensor): the twin source of shape
+          `(2 * bsz, src_len')`, noised first half followed by the clean (or,
+          without *is_half_batch*, independently noised) second half
+        - `robust_src_lengths` (LongTensor): the matching lengths
+
+    The current epoch and update count are kept in shared memory so that
+    curriculum schedules followed by the workers advance with training;
+    batches that were prefetched before an update use the update count they
+    were built at. Noise is drawn from a :class:`CounterRNG` keyed on
+    (``--noise-seed``, epoch, update, sample id), so a batch collated at a
+    given update can be regenerated exactly by any process.
+
+    Args:
+        dataset (~fairseq.data.LanguagePairDataset): dataset to wrap
+        args (argparse.Namespace): model arguments holding the
+            ``--noise-*`` and ``--is-half-batch`` options
+        noise_curriculum (~fairseq.optim.noise_curriculum.NoiseCurriculumScheduler,
+            optional): schedule of the noise rates (default: the constant
+            ``--noise-rate``)
+    """
+
+    def __init__(self, dataset, args, noise_curriculum=None):
+        super().__init__(dataset)
+        self.noise_rate = getattr(args, "noise_rate", 0.0)
+        self.noise_seed = getattr(args, "noise_seed", 64)
+        self.is_half_batch = getattr(args, "is_half_batch", False)
+        self.noise_curriculum = noise_curriculum
+        self.noiser = TokenNoiser(
+            dataset.src_dict,
+            noise_type=getattr(args, "noise_type", "replace"),
+            left_pad=dataset.left_pad_source,
+        )
+        # (epoch, num_updates), shared with the DataLoader workers
+        self._state = torch.zeros(2, dtype=torch.long).share_memory_()
+
+    def set_epoch(self, epoch):
+        super().set_epoch(epoch)
+        self._state[0] = epoch
+
+    def set_num_updates(self, num_updates):
+        self._state[1] = num_updates
+
+    @property
+    def epoch(self):
+        return int(self._state[0])
+
+    @property
+    def num_updates(self):
+        return int(self._state[1])
+
+    def __getitems__(self, indices):
+        # whole batches, see LanguagePairDataset.batch_read
+        if hasattr(self.dataset, "__getitems__"):
+            return self.dataset.__getitems__(indices)
+        return [self[index] for index in indices]
+
+    def collater(self, samples, **extra_args):
+        samples = self.dataset.collater(samples, **extra_args)
+        if len(samples) == 0 or self.noise_rate == 0:
+            return samples
+
+        src_tokens = samples["net_input"]["src_tokens"]
+        src_lengths = samples["net_input"]["src_lengths"]
+        num_updates = self.num_updates
+        rng = CounterRNG(
+            self.noise_seed,
+            twin_sample_ids(samples["id"]),
+            epoch=self.epoch,
+            num_updates=num_updates,
+        )
+        rates = sample_noise_rates(
+            2 * src_tokens.size(0),
+            num_updates,
+            self.noise_rate,
+            is_half_batch=self.is_half_batch,
+            curriculum=self.noise_curriculum,
+            rng=rng,
+        )
+        (
+            samples["robust_src_tokens"],
+            samples["robust_src_lengths"],
+        ) = self.noiser.noise(
+            torch.cat([src_tokens, src_tokens], dim=0),
+            torch.cat([src_lengths, src_lengths], dim=0),
+            rates,
+            rng=rng,
+        )
+        return samples
+
+    def num_tokens_vec(self, indices):
+        return self.dataset.num_tokens_vec(indices)
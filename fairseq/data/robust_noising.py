@@ -0,0 +1,325 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import torch
+
+
+_MASK32 = 0xFFFFFFFF
+
+# independent random streams used by the noise operations
+STREAM_RATE = 1
+STREAM_OP = 2
+STREAM_POSITION = 3
+STREAM_TOKEN = 4
+STREAM_VARIANT = 5
+
+
+def _mix32(x):
+    """lowbias32 integer finalizer on a Python int."""
+    x &= _MASK32
+    x ^= x >> 16
+    x = (x * 0x7FEB352D) & _MASK32
+    x ^= x >> 15
+    x = (x * 0x846CA68B) & _MASK32
+    x ^= x >> 16
+    return x
+
+
+def _mul32_tensor(x, c):
+    # (x * c) mod 2**32 for x < 2**32 without overflowing int64
+    return (x * (c & 0xFFFF) + (((x * (c >> 16)) & 0xFFFF) << 16)) & _MASK32
+
+
+def _mix32_tensor(x):
+    """:func:`_mix32` on an int64 tensor holding 32-bit values."""
+    x = x ^ (x >> 16)
+    x = _mul32_tensor(x, 0x7FEB352D)
+    x = x ^ (x >> 15)
+    x = _mul32_tensor(x, 0x846CA68B)
+    return x ^ (x >> 16)
+
+
+def twin_sample_ids(sample_ids):
+    """Distinct noise keys for both halves of a clean/noisy twin batch."""
+    return torch.cat([sample_ids * 2, sample_ids * 2 + 1], dim=0)
+
+
+class CounterRNG(object):
+    """Counter-based RNG keyed on (seed, epoch, update, sample id).
+
+    Every random number is a hash of its key, the stream it is drawn from and
+    its position in the sentence, so a noised sample can be regenerated
+    anywhere (another rank, a DataLoader worker, a later job) without any
+    shared generator state, and a whole batch is drawn in one tensor op.
+
+    Args:
+        seed (int): noise seed (``--noise-seed``)
+        sample_ids (LongTensor): one key per row of the batch, e.g. dataset
+            sample ids; only rows with distinct keys get independent noise
+        epoch (int, optional): training epoch
+        num_updates (int, optional): number of updates so far
+    """
+
+    def __init__(self, seed, sample_ids, epoch=0, num_updates=0):
+        key = _mix32(seed)
+        for counter in (epoch, num_updates):
+            key = _mix32(key ^ _mix32(counter))
+        self.key = key
+        sample_ids = sample_ids.long()
+        self.sample_ids = (sample_ids ^ (sample_ids >> 32)) & _MASK32
+
+    def bits(self, size, stream, positions=None):
+        """Random 32-bit integers of shape *size* for the first ``size[0]``
+        rows of the batch.
+
+        *positions* gives the counter of each of the ``size[1]`` columns
+        (default: the column index).
+        """
+        stream_key = _mix32(self.key ^ _mix32(stream))
+        rows = _mix32_tensor(self.sample_ids[: size[0]] ^ stream_key)
+        if len(size) == 1:
+            return rows
+        if positions is None:
+            positions = torch.arange(size[1], device=rows.device)
+        positions = _mix32_tensor((positions + stream_key) & _MASK32)
+        return _mix32_tensor(rows.unsqueeze(1) ^ positions)
+
+    def uniform(self, size, stream, dtype=torch.float, positions=None):
+        """Uniform samples in [0, 1)."""
+        bits = self.bits(size, stream, positions)
+        if dtype == torch.double:
+            return bits.double() * 2.0 ** -32
+        return (bits >> 8).to(dtype) * 2.0 ** -24
+
+    def randint(self, low, high, size, stream, positions=None):
+        """Random integers in [*low*, *high*)."""
+        return low + self.bits(size, stream, positions) % (high - low)
+
+
+def sample_noise_rates(
+    bsz,
+    num_updates,
+    noise_rate,
+    is_half_batch=False,
+    curriculum=None,
+    device=None,
+    rng=None,
+):
+    """Draw the per-sentence noise rates of a batch of *bsz* sentences.
+
+    With *is_half_batch* only the first half of the batch is noised and the
+    remaining rates are 0. The noised sentences get *noise_rate*, or rates
+    drawn from *curriculum* (a
+    :class:`~fairseq.optim.noise_curriculum.NoiseCurriculumScheduler`) after
+    *num_updates* updates if given. Random rates come from *rng* (a
+    :class:`CounterRNG`) if given, and from the global torch RNG otherwise.
+    """
+    rates = torch.zeros(bsz, dtype=torch.double, device=device)
+    num_noised = bsz // 2 if is_half_batch else bsz
+    if curriculum is None:
+        rates[:num_noised] = noise_rate
+    else:
+        rates[:num_noised] = curriculum.sample_rates(
+            num_noised, num_updates, device=device, rng=rng
+        )
+    return rates
+
+
+class TokenNoiser(object):
+    """Apply ISDST source-side noise to a whole padded batch at once.
+
+    Every operation works on the full ``B x T`` token tensor with masked
+    tensor ops on the tensor's own device, instead of looping over sentences
+    in Python. Each row gets its own noise rate; for a row with ``n`` real
+    tokens (excluding padding and the final EOS), ``ceil(rate * n)`` positions
+    are noised, matching the per-sentence semantics of the original
+    implementation. Rows with a rate of 0 are returned unchanged.
+
+    Args:
+        dictionary (~fairseq.data.Dictionary): source dictionary
+        noise_type (str): one of *replace*, *remove*, *swap*, *insert* or
+            *hybrid* (a uniformly sampled choice of replace/remove/swap per
+            sentence)
+        left_pad (bool): whether the source side is left-padded
+    """
+
+    NOISE_TYPES = ["replace", "remove", "swap", "insert", "hybrid"]
+
+    def __init__(self, dictionary, noise_type="replace", left_pad=True):
+        if noise_type not in self.NOISE_TYPES:
+            raise ValueError("unknown noise type: {}".format(noise_type))
+        self.dictionary = dictionary
+        self.pad = dictionary.pad()
+        self.eos = dictionary.eos()
+        self.nspecial = dictionary.nspecial
+        self.vocab_size = len(dictionary)
+        self.noise_type = noise_type
+        self.left_pad = left_pad
+
+    def noise(self, tokens, lengths, rates, rng=None):
+        """
+        Args:
+            tokens (LongTensor): padded source tokens of shape `(batch, src_len)`
+            lengths (LongTensor): source lengths of shape `(batch)`
+            rates (Tensor): per-sentence noise rates of shape `(batch)`
+            rng (CounterRNG, optional): keyed RNG to draw from; the global
+                torch RNG is used if not given
+
+        Returns:
+            tuple: the noised tokens and lengths, as new tensors
+        """
+        if self.noise_type == "replace":
+            return self.replace(tokens, lengths, rates, rng)
+        elif self.noise_type == "remove":
+            return self.remove(tokens, lengths, rates, rng)
+        elif self.noise_type == "swap":
+            return self.swap(tokens, lengths, rates, rng)
+        elif self.noise_type == "insert":
+            return self.insert(tokens, lengths, rates, rng)
+        return self.hybrid(tokens, lengths, rates, rng)
+
+    def content_mask(self, tokens):
+        """Positions that may be noised: everything but padding and EOS."""
+        return tokens.ne(self.pad) & tokens.ne(self.eos)
+
+    def _positions(self, tokens):
+        """Column counters that do not depend on the padded batch width."""
+        tsz = tokens.size(1)
+        if self.left_pad:
+            return torch.arange(tsz - 1, -1, -1, device=tokens.device)
+        return torch.arange(tsz, device=tokens.device)
+
+    def _uniform(self, size, tokens, stream, rng=None):
+        if rng is not None:
+            positions = self._positions(tokens) if len(size) == 2 else None
+            return rng.uniform(size, stream, positions=positions)
+        return torch.rand(size, device=tokens.device)
+
+    def _num_noised(self, rates, num_candidates):
+        return torch.ceil(rates.double() * num_candidates.double()).long()
+
+    def _sample_positions(self, candidates, k, rng=None):
+        """Pick *k[i]* distinct positions per row among *candidates*.
+
+        Every candidate gets a uniform key; the *k* smallest keys of each row
+        are selected with a single sort, which is equivalent to sampling
+        without replacement.
+        """
+        keys = self._uniform(candidates.size(), candidates, STREAM_POSITION, rng)
+        keys = keys.masked_fill(~candidates, 2.0)
+        sorted_keys, _ = keys.sort(dim=1)
+        kth = sorted_keys.gather(1, (k - 1).clamp(min=0).unsqueeze(1))
+        return candidates & keys.le(kth) & k.gt(0).unsqueeze(1)
+
+    def _random_tokens(self, tokens, rng=None):
+        if rng is not None:
+            return rng.randint(
+                self.nspecial,
+                self.vocab_size,
+                tokens.size(),
+                STREAM_TOKEN,
+                positions=self._positions(tokens),
+            ).to(tokens)
+        return torch.randint(
+            self.nspecial,
+            self.vocab_size,
+            tokens.size(),
+            device=tokens.device,
+            dtype=tokens.dtype,
+        )
+
+    def _compact(self, tokens, keep):
+        """Drop the positions not in *keep* and re-pad each row."""
+        bsz, tsz = tokens.size()
+        if self.left_pad:
+            dest = tsz - keep.flip([1]).cumsum(1).flip([1])
+        else:
+            dest = keep.cumsum(1) - 1
+        # dropped tokens are all routed to an extra column that is cut off
+        dest = dest.masked_fill(~keep, tsz)
+        out = tokens.new_full((bsz, tsz + 1), self.pad)
+        out.scatter_(1, dest, tokens)
+        return out[:, :tsz]
+
+    def replace(self, tokens, lengths, rates, rng=None):
+        content = self.content_mask(tokens)
+        k = self._num_noised(rates, content.sum(1))
+        chosen = self._sample_positions(content, k, rng)
+        noised = torch.where(chosen, self._random_tokens(tokens, rng), tokens)
+        return noised, lengths
+
+    def remove(self, tokens, lengths, rates, rng=None):
+        content = self.content_mask(tokens)
+        k = self._num_noised(rates, content.sum(1))
+        chosen = self._sample_positions(content, k, rng)
+        noised = self._compact(tokens, tokens.ne(self.pad) & ~chosen)
+        return noised, lengths - chosen.sum(1).to(lengths)
+
+    def swap(self, tokens, lengths, rates, rng=None):
+        content = self.content_mask(tokens)
+        n = content.sum(1)
+        k = self._num_noised(rates, n)
+        # a swap at *i* exchanges tokens *i* and *i + 1*; sentences with fewer
+        # swappable pairs than requested swaps are left untouched
+        k = k.masked_fill(k.gt(n - 1), 0)
+        candidates = torch.zeros_like(content)
+        candidates[:, :-1] = content[:, :-1] & content[:, 1:]
+        chosen = self._sample_positions(candidates, k, rng)
+        # same write order as the sequential reference: every chosen *i*
+        # receives token *i + 1* first, then every *i + 1* receives token *i*
+        noised = torch.where(chosen, tokens.roll(-1, 1), tokens)
+        noised = torch.where(chosen.roll(1, 1), tokens.roll(1, 1), noised)
+        return noised, lengths
+
+    def hybrid(self, tokens, lengths, rates, rng=None):
+        op = self._uniform(rates.size(), tokens, STREAM_OP, rng)
+        op = (op * 3).long().clamp(max=2)
+        replaced, _ = self.replace(tokens, lengths, rates, rng)
+        removed, removed_lengths = self.remove(tokens, lengths, rates, rng)
+        swapped, _ = self.swap(tokens, lengths, rates, rng)
+        noised = torch.where(
+            op.eq(0).unsqueeze(1),
+            replaced,
+            torch.where(op.eq(1).unsqueeze(1), removed, swapped),
+        )
+        return noised, torch.where(op.eq(1), removed_lengths, lengths)
+
+    def insert(self, tokens, lengths, rates, rng=None):
+        """Insert a random token before each of ``ceil(rate * n)`` sampled
+        positions.
+
+        The output is ``B x (T + k_max)`` for the largest number of insertions
+        ``k_max`` of the batch, and every original and inserted token is
+        written with a single scatter.
+        """
+        content = self.content_mask(tokens)
+        n = content.sum(1)
+        k = torch.min(self._num_noised(rates, n), n)
+        k_max = int(k.max()) if k.numel() > 0 else 0
+        if k_max == 0:
+            return tokens.clone(), lengths.clone()
+        chosen = self._sample_positions(content, k, rng)
+
+        bsz, tsz = tokens.size()
+        out_tsz = tsz + k_max
+        shift = chosen.long()
+        if self.left_pad:
+            # right-aligned: a token moves left by one for every insertion
+            # after it
+            after = shift.flip([1]).cumsum(1).flip([1]) - shift
+            dest = torch.arange(tsz, device=tokens.device) + k_max - after
+        else:
+            dest = torch.arange(tsz, device=tokens.device) + shift.cumsum(1)
+        # padding and unused insertions are routed to an extra column that
+        # is cut off
+        dest = dest.masked_fill(tokens.eq(self.pad), out_tsz)
+        insert_dest = (dest - 1).masked_fill(~chosen, out_tsz)
+        out = tokens.new_full((bsz, out_tsz + 1), self.pad)
+        out.scatter_(
+            1,
+            torch.cat([dest, insert_dest], dim=1),
+            torch.cat([tokens, self._random_tokens(tokens, rng)], dim=1),
+        )
+        return out[:, :out_tsz], lengths + k.to(lengths)
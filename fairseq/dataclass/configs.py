@@ -831,6 +831,51 @@ class GenerationConfig(FairseqDataclass):
         default=1,
         metadata={"help": "minimum generation length"},
     )
+    encoder_cache_size: float = field(
+        default=0,
+        metadata={
+            "help": "keep up to this many MB of encoder outputs in memory, keyed "
+            "by model and source sentence, and reuse them when a source is "
+            "decoded or scored again (0: no cache)"
+        },
+    )
+    encoder_cache_dir: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "with --encoder-cache-size, also keep the encoder outputs in "
+            "this directory (capped at the same size) to reuse them across runs"
+        },
+    )
+    gen_batch_budget: Optional[int] = field(
+        default=None,
+        metadata={
+            "help": "batch the sentences to generate by their decoding cost, "
+            "beam * (ax + b) tokens, with at most this many per batch; the "
+            "longest batches are decoded first (overrides --max-tokens)"
+        },
+    )
+    stream: bool = field(
+        default=False,
+        metadata={
+            "help": "decode the input --stream-window sentences at a time and "
+            "write the results in order as they come; with --results-path, "
+            "checkpoint the progress after every window and resume from it"
+        },
+    )
+    stream_window: int = field(
+        default=10000,
+        metadata={
+            "help": "with --stream, the number of sentences read, batched and "
+            "held for reordering at a time"
+        },
+    )
+    stream_input: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "with --stream, read raw text sentences from this file "
+            "(- for stdin) instead of the binarized --gen-subset"
+        },
+    )
     match_source_len: bool = field(
         default=False,
         metadata={"help": "generations should match the source length"},
@@ -1072,6 +1117,23 @@ class InteractiveConfig(FairseqDataclass):
         default="-",
         metadata={"help": "file to read from; use - for stdin"},
     )
+    serve: bool = field(
+        default=False,
+        metadata={
+            "help": "translate every sentence as soon as it is read, with "
+            "continuous batching: finished sentences leave the batch and new "
+            "ones join it at every decoding step; --batch-size sets the number "
+            "of sentences decoded at once"
+        },
+    )
+    serve_socket: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "with --serve, read the sentences from the connections to "
+            "this Unix socket instead of --input, and write every translation "
+            "back to its connection"
+        },
+    )
 
 
 @dataclass
@@ -1121,4 +1183,5 @@ class FairseqConfig(FairseqDataclass):
     scoring: Any = None
     bpe: Any = None
     tokenizer: Any = None
+    noise_curriculum: Any = None
     ema: EMAConfig = EMAConfig()
@@ -0,0 +1,195 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import hashlib
+import os
+import weakref
+from collections import OrderedDict
+from typing import Dict, List
+
+import torch
+from torch import Tensor
+
+
+def model_fingerprint(model):
+    """A hash of the parameters and buffers of *model*."""
+    h = hashlib.sha1()
+    for name, tensor in model.state_dict().items():
+        h.update(name.encode("utf-8"))
+        h.update(str(tensor.dtype).encode("utf-8"))
+        tensor = tensor.detach().cpu()
+        if tensor.dtype == torch.bfloat16:
+            tensor = tensor.float()  # not supported by numpy
+        h.update(tensor.numpy().tobytes())
+    return h.hexdigest()
+
+
+class EncoderOutputCache(object):
+    """LRU cache of the encoder output of every source sentence, keyed by
+    (model fingerprint, source token ids).
+
+    Decoding the same sources several times (ensemble sweeps, different
+    ``--beam``/``--lenpen``, rescoring) then only runs the encoder on the
+    sentences it has not seen. The output of a sentence does not depend on
+    the padding of its batch, so sentences are cached one by one, without
+    padding, and any batch is reassembled from them. Only the final encoder
+    output and its padding mask are kept; models whose decoders need the
+    other encoder outputs (e.g. ``encoder_states``) must not use the cache.
+
+    Args:
+        pad (int): padding index of the source
+        max_size_mb (float): size cap of the in-RAM cache
+        cache_dir (str, optional): also keep the entries in this directory,
+            capped at the same size, so that other processes reuse them
+    """
+
+    def __init__(self, pad, max_size_mb, cache_dir=None):
+        self.pad = pad
+        self.max_bytes = int(max_size_mb * 2**20)
+        self.entries = OrderedDict()
+        self.num_bytes = 0
+        self.cache_dir = cache_dir
+        self.num_disk_bytes = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.num_disk_bytes = sum(
+                os.path.getsize(os.path.join(cache_dir, f))
+                for f in os.listdir(cache_dir)
+                if f.endswith(".pt")
+            )
+        # keyed by the model itself: an id() may be reused by another model
+        # once the first one is freed
+        self.fingerprints = weakref.WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
+
+    def fingerprint(self, model):
+        if model not in self.fingerprints:
+            self.fingerprints[model] = model_fingerprint(model)
+        return self.fingerprints[model]
+
+    def _path(self, key):
+        fingerprint, tokens = key
+        h = hashlib.sha1(fingerprint.encode("utf-8"))
+        h.update(torch.LongTensor(tokens).numpy().tobytes())
+        return os.path.join(self.cache_dir, h.hexdigest() + ".pt")
+
+    def _get(self, key):
+        out = self.entries.get(key, None)
+        if out is not None:
+            self.entries.move_to_end(key)
+            return out
+        if self.cache_dir is not None:
+            path = self._path(key)
+            try:
+                out = torch.load(path)
+            except (OSError, EOFError, RuntimeError):
+                return None
+            os.utime(path)  # for the LRU eviction from disk
+            self._put_in_memory(key, out)
+        return out
+
+    def _put_in_memory(self, key, out):
+        size = out.numel() * out.element_size()
+        if size > self.max_bytes:
+            return
+        self.entries[key] = out
+        self.num_bytes += size
+        while self.num_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.num_bytes -= evicted.numel() * evicted.element_size()
+
+    def _put(self, key, out):
+        self._put_in_memory(key, out)
+        if self.cache_dir is None:
+            return
+        path = self._path(key)
+        tmp_path = "{}.tmp{}".format(path, os.getpid())
+        torch.save(out, tmp_path)
+        os.replace(tmp_path, path)
+        self.num_disk_bytes += os.path.getsize(path)
+        if self.num_disk_bytes > self.max_bytes:
+            self._evict_from_disk()
+
+    def _evict_from_disk(self):
+        files = []
+        for f in os.listdir(self.cache_dir):
+            if f.endswith(".pt"):
+                path = os.path.join(self.cache_dir, f)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+        self.num_disk_bytes = sum(size for _, size, _ in files)
+        # evict down to 90% of the cap, not to scan the directory every time
+        for _, size, path in files:
+            if self.num_disk_bytes <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.num_disk_bytes -= size
+
+    @torch.no_grad()
+    def forward_encoder(
+        self, models, net_input: Dict[str, Tensor]
+    ) -> List[Dict[str, List[Tensor]]]:
+        """The encoder output of each of *models* for the batch *net_input*,
+        as returned by ``EnsembleModel.forward_encoder``."""
+        src_tokens = net_input["src_tokens"]
+        src_mask = src_tokens.ne(self.pad)
+        rows = [
+            tuple(row[mask].tolist())
+            for row, mask in zip(src_tokens.cpu(), src_mask.cpu())
+        ]
+        return [self._forward_encoder(model, src_tokens, rows) for model in models]
+
+    def _forward_encoder(self, model, src_tokens, rows):
+        fingerprint = self.fingerprint(model)
+        keys = [(fingerprint, row) for row in rows]
+        outs = [self._get(key) for key in keys]
+        missing = [i for i, out in enumerate(outs) if out is None]
+        self.hits += len(rows) - len(missing)
+        self.misses += len(missing)
+        if len(missing) > 0:
+            index = torch.tensor(missing, device=src_tokens.device)
+            missing_tokens = src_tokens.index_select(0, index)
+            encoder_out = model.encoder.forward_torchscript(
+                {
+                    "src_tokens": missing_tokens,
+                    "src_lengths": missing_tokens.ne(self.pad).sum(dim=1),
+                }
+            )
+            x = encoder_out["encoder_out"][0].transpose(0, 1).cpu()  # B x T x C
+            if len(encoder_out["encoder_padding_mask"]) > 0:
+                padding_mask = encoder_out["encoder_padding_mask"][0].cpu()
+            else:
+                padding_mask = torch.zeros(x.shape[:2], dtype=torch.bool)
+            for j, i in enumerate(missing):
+                outs[i] = x[j][~padding_mask[j]]
+                self._put(keys[i], outs[i])
+
+        # reassemble the batch, left-padded like the source
+        lengths = [out.size(0) for out in outs]
+        src_len = max(lengths)
+        x = outs[0].new_zeros(len(outs), src_len, outs[0].size(1))
+        padding_mask = torch.ones(len(outs), src_len, dtype=torch.bool)
+        for i, out in enumerate(outs):
+            x[i, src_len - lengths[i] :] = out
+            padding_mask[i, src_len - lengths[i] :] = False
+        device = src_tokens.device
+        return {
+            "encoder_out": [x.transpose(0, 1).to(device)],  # T x B x C
+            "encoder_padding_mask": [padding_mask.to(device)],  # B x T
+            "encoder_embedding": [],
+            "encoder_states": [],
+            "src_tokens": [],
+            "src_lengths": [
+                torch.tensor(lengths, dtype=torch.int32, device=device).view(-1, 1)
+            ],
+        }
@@ -34,6 +34,34 @@ def find_offsets(filename: str, num_chunks: int) -> tp.List[int]:
         return offsets
 
 
+def find_shard_offsets(filename: str, shard_size: int) -> tp.List[int]:
+    """
+    same as find_offsets, with chunks of about shard_size bytes. The offsets
+    only depend on the file and shard_size, so that a sharded job can be resumed.
+    """
+    size = os.path.getsize(filename)
+    num_shards = max(1, (size + shard_size - 1) // shard_size)
+    offsets = find_offsets(filename, num_shards)
+    if size == 0:
+        return offsets
+    # lines longer than shard_size would make empty shards
+    return offsets[:1] + [
+        end for start, end in zip(offsets, offsets[1:]) if end > start
+    ]
+
+
+def input_fingerprint(filename: str) -> tp.Dict[str, tp.Any]:
+    """
+    identifies the version of an input file, to resume a sharded job
+    """
+    stat = os.stat(filename)
+    return {
+        "path": os.path.abspath(filename),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+    }
+
+
 class ChunkLineIterator:
     """
     Iterator to properly iterate over lines of a file chunck.
@@ -100,6 +100,40 @@ class FairseqIncrementalDecoder(FairseqDecoder):
                 if result is not None:
                     incremental_state = result
 
+    def set_kv_cache_size(self, kv_cache_size):
+        """Sets the number of decoding steps the key/value caches of all
+        children are preallocated for."""
+        if getattr(self, "_kv_cache_size", -1) != kv_cache_size:
+
+            def apply_set_kv_cache_size(module):
+                if module != self and hasattr(module, "set_kv_cache_size"):
+                    module.set_kv_cache_size(kv_cache_size)
+
+            self.apply(apply_set_kv_cache_size)
+            self._kv_cache_size = kv_cache_size
+
+    def extend_incremental_state(
+        self,
+        incremental_state: Dict[str, Dict[str, Optional[Tensor]]],
+        num_rows: int,
+    ):
+        """Append *num_rows* sentences without decoding history to the
+        incremental state of all children (for continuous batching)."""
+        for module in self.modules():
+            if module != self and hasattr(module, "extend_incremental_state"):
+                module.extend_incremental_state(incremental_state, num_rows)
+
+    def trim_incremental_state(
+        self,
+        incremental_state: Dict[str, Dict[str, Optional[Tensor]]],
+        num_steps: int,
+    ):
+        """Drop the first *num_steps* decoding steps, masked for every
+        sentence, from the incremental state of all children."""
+        for module in self.modules():
+            if module != self and hasattr(module, "trim_incremental_state"):
+                module.trim_incremental_state(incremental_state, num_steps)
+
     def set_beam_size(self, beam_size):
         """Sets the beam size in the decoder and all children."""
         if getattr(self, "_beam_size", -1) != beam_size:
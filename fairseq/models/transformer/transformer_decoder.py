@@ -298,9 +298,17 @@ class TransformerDecoderBase(FairseqIncrementalDecoder):
         # embed positions
         positions = None
         if self.embed_positions is not None:
-            positions = self.embed_positions(
-                prev_output_tokens, incremental_state=incremental_state
-            )
+            if (
+                self.get_incremental_state(incremental_state, "left_padded")
+                is not None
+            ):
+                # left-padded histories of sentences that joined the batch at
+                # different steps (continuous batching): count positions per row
+                positions = self.embed_positions(prev_output_tokens)
+            else:
+                positions = self.embed_positions(
+                    prev_output_tokens, incremental_state=incremental_state
+                )
 
         if incremental_state is not None:
             prev_output_tokens = prev_output_tokens[:, -1:]
@@ -375,6 +383,16 @@ class TransformerDecoderBase(FairseqIncrementalDecoder):
 
         return x, {"attn": [attn], "inner_states": inner_states}
 
+    def extend_incremental_state(
+        self,
+        incremental_state: Dict[str, Dict[str, Optional[Tensor]]],
+        num_rows: int,
+    ):
+        super().extend_incremental_state(incremental_state, num_rows)
+        # the new rows have a left-padded history from now on
+        empty: Dict[str, Optional[Tensor]] = {}
+        self.set_incremental_state(incremental_state, "left_padded", empty)
+
     def output_layer(self, features):
         """Project features to the vocabulary size."""
         if self.adaptive_softmax is None:
@@ -24,8 +24,12 @@ from fairseq.modules import (
 )
 from fairseq.modules.checkpoint_activations import checkpoint_wrapper
 from fairseq.modules.quant_noise import quant_noise as apply_quant_noise_
-import json 
-import random
+from fairseq.data.robust_noising import (
+    CounterRNG,
+    TokenNoiser,
+    sample_noise_rates,
+)
+from fairseq.optim.noise_curriculum import build_noise_curriculum
 # rewrite name for backward compatibility in `make_generation_fast_`
 def module_name_fordropout(module_name: str) -> str:
     if module_name == "TransformerEncoderBase":
@@ -50,6 +54,8 @@ class TransformerEncoderBase(FairseqEncoder):
         self.cfg = cfg
         self.cur_max_noise_rate = 0.0
         self.src_dict = dictionary
+        # replaced by the Trainer's (stepped and checkpointed) curriculum
+        self.noise_curriculum = build_noise_curriculum(None, cfg)
 
         super().__init__(dictionary)
         self.register_buffer("version", torch.Tensor([3]))
@@ -144,6 +150,8 @@ class TransformerEncoderBase(FairseqEncoder):
         token_embeddings: Optional[torch.Tensor] = None,
         layer_norm_dropout_rate = -1.0, #(1.0 if (not self.training and self.cfg.layer_norm_dropout != -1) else self.cfg.layer_norm_dropout),
         num_updates=0,
+        sample_ids: Optional[torch.Tensor] = None,
+        apply_noise: bool = True,
     ):
         """
         Args:
@@ -155,6 +163,12 @@ class TransformerEncoderBase(FairseqEncoder):
                 intermediate hidden states (default: False).
             token_embeddings (torch.Tensor, optional): precomputed embeddings
                 default `None` will recompute embeddings
+            num_updates (int, optional): number of updates so far, drives the
+                noise curriculum
+            sample_ids (LongTensor, optional): per-row keys of the noise RNG
+                of shape `(batch)`; defaults to the row index
+            apply_noise (bool, optional): noise the source during training
+                (default: True); disable for an already noised source
 
         Returns:
             dict:
@@ -169,12 +183,25 @@ class TransformerEncoderBase(FairseqEncoder):
                   Only populated if *return_all_hiddens* is True.
         """
 
-        src_tokens,src_lengths,cur_max_noise_rate = replace_tokens(src_tokens,src_lengths,cur_max_noise_rate=self.cur_max_noise_rate,src_dict=self.src_dict,training_state=self.training,num_updates=num_updates,args=self.cfg)
+        if apply_noise:
+            src_tokens, src_lengths = self.noise_source(
+                src_tokens, src_lengths, num_updates=num_updates, sample_ids=sample_ids
+            )
 
         return self.forward_scriptable(
             src_tokens, src_lengths, return_all_hiddens, token_embeddings, layer_norm_dropout_rate=layer_norm_dropout_rate
         )
 
+    def noise_source(self, src_tokens, src_lengths, num_updates=0, sample_ids=None):
+        """Apply the training-time source noise (a no-op in eval mode)."""
+        src_tokens,src_lengths,cur_max_noise_rate = replace_tokens(src_tokens,src_lengths,cur_max_noise_rate=self.cur_max_noise_rate,src_dict=self.src_dict,training_state=self.training,num_updates=num_updates,args=self.cfg,sample_ids=sample_ids,noise_curriculum=self.noise_curriculum)
+        return src_tokens, src_lengths
+
+    def set_noise_curriculum(self, noise_curriculum):
+        """Draw the noise rates from *noise_curriculum* (None: constant
+        ``--noise-rate``)."""
+        self.noise_curriculum = noise_curriculum
+
     # TorchScript doesn't support super() method so that the scriptable Subclass
     # can't access the base class model in Torchscript.
     # Current workaround is to add a helper function with different name and
@@ -433,208 +460,45 @@ class TransformerEncoderBase(FairseqEncoder):
             state_dict[version_key] = torch.Tensor([1])
         return state_dict
 
-def replace_tokens(src_tokens,src_lengths,cur_max_noise_rate,src_dict,training_state,num_updates,args):
-
-    def cl_noise_rate(num_updates, max_num_updates, R_max, R_min=0.0, p=2, reverse=0):
-        square_Rmax = R_max ** p
-        square_Rmin = R_min ** p if R_min != 0 else 0
-
-        temp = ((square_Rmax - square_Rmin) * (num_updates / max_num_updates) + square_Rmin)
-        if reverse:
-            #print('decrease')
-            return max(R_max - temp ** (1 / p) if temp != 0 else R_max, 0)
-        else:
-            #print('increase')
-            return min(temp ** (1 / p) if temp != 0 else 0, R_max)
+def replace_tokens(src_tokens,src_lengths,cur_max_noise_rate,src_dict,training_state,num_updates,args,sample_ids=None,noise_curriculum=None):
+    """Noise the (first half of the) batch in place of the clean source.
 
+    The noise itself is applied to the whole batch at once by
+    :class:`~fairseq.data.robust_noising.TokenNoiser`; this function only
+    works out the per-sentence noise rates from *noise_curriculum*. With
+    ``--noise-seed`` the noise is a pure function of (seed, update, sample id).
+    """
     add_noise = getattr(args,'add_noise',False)
     noise_rate = getattr(args,'noise_rate',None)
     is_half_batch = getattr(args,'is_half_batch',False)
-    clearning = getattr(args,'curriculum_learning',False)
-    cargs =  getattr(args,'curriculum_args',None)
-    cargs = json.loads(args.curriculum_args) if cargs is not None else None
     noise_type = getattr(args,'noise_type','replace')
-    if noise_type == 'insert':
-        src_tokens_extend = torch.zeros(size=(src_tokens.size(0),src_tokens.size(1)+1)).to(src_tokens)
-    #print(noise_rate)
-    if training_state and add_noise and (noise_rate !=0):
-        bsz = src_tokens.size(0)//2 if is_half_batch else src_tokens.size(0)
-        for i,s in enumerate(src_tokens[:bsz]): # each sentence
-            if clearning and cargs:
-                max_rate = cargs['max_rate']
-                min_rate = cargs['min_rate']
-                cupdates =  cargs['cupdates']
-                mupdates = cargs['mupdates']
-                reverse = cargs['reverse'] if 'reverse' in cargs else 0
-                p = cargs['p']
-                cl_type = cargs['type'] if 'type' in cargs else 1
-
-                if num_updates % cupdates == 0:
-                    cur_max_noise_rate = cl_noise_rate(
-                        num_updates=num_updates,
-                        R_max=max_rate,
-                        R_min=min_rate,
-                        p=p,
-                        max_num_updates=mupdates,
-                        reverse=reverse,
-                    )
-                #print(cur_max_noise_rate)
-                if cl_type == 2:
-                    noise_rate = cl_noise_rate(
-                        num_updates=num_updates,
-                        R_max=max_rate,
-                        R_min=min_rate,
-                        p=p,
-                        max_num_updates=mupdates,
-                        reverse=reverse,
-                    )
-                elif cl_type == 3:
-                    #print('sample from fixed range')
-                    noise_rate = random.uniform(0, max_rate)
-                else:
-                    noise_rate = random.uniform(0, cur_max_noise_rate)
-            if noise_rate == 0.0:
-               break
-            start_idx = 0
-            end_idx = len(s) - 1
-            if s[0].cpu().numpy() != src_dict.pad(): # 无填充
-                # 采样需要替换的位置
-                n_sampled = math.ceil(noise_rate * end_idx)
-
-                if noise_type == 'replace':
-                    idx_list1 = torch.LongTensor(random.sample(range(start_idx,end_idx),n_sampled)).to(src_tokens)
-                    idx_list2 = torch.LongTensor(random.sample(range(4,len(src_dict.symbols)),n_sampled)).to(src_tokens)
-                    s_rp = s.scatter(0,idx_list1,idx_list2)
-                    src_tokens[i] = s_rp
-                elif noise_type == 'remove':
-                    idx_reserved = random.sample(range(start_idx,end_idx),end_idx - n_sampled)+[end_idx]
-                    idx_reserved.sort()
-                    idx_reserved = torch.LongTensor(idx_reserved).to(src_tokens)
-                    pad_tensor = torch.LongTensor([src_dict.pad()] * n_sampled).to(src_tokens)
-                    src_tokens[i] = torch.cat((pad_tensor,s[idx_reserved]),0).to(src_tokens)
-                    src_lengths[i] = src_lengths[i] - n_sampled
-                elif noise_type == 'swap':
-                    if start_idx >= end_idx-1 or n_sampled > end_idx-1-start_idx:
-                       continue
-                    origial_src = s.clone()
-                    idx_swap1 = torch.LongTensor(random.sample(range(start_idx,end_idx-1),n_sampled)).to(src_tokens)
-                    idx_swap2 = idx_swap1 + 1
-                    s[idx_swap1] = origial_src[idx_swap2]
-                    s[idx_swap2] = origial_src[idx_swap1]
-                    src_tokens[i] = s
-                elif noise_type == 'hybrid':
-                    rd = random.uniform(0,1)
-                    rd1,rd2 = 1/3,2/3
-                    if rd >= 0 and rd < rd1: # replace
-                        # replace
-                        idx_list1 = torch.LongTensor(random.sample(range(start_idx,end_idx),n_sampled)).to(src_tokens)
-                        idx_list2 = torch.LongTensor(random.sample(range(4,len(src_dict.symbols)),n_sampled)).to(src_tokens)
-                        s_rp = s.scatter(0,idx_list1,idx_list2)
-                        src_tokens[i] = s_rp
-                    elif rd >= rd1 and rd < rd2: # remove
-                        # remove
-                        idx_reserved = random.sample(range(start_idx,end_idx),end_idx - n_sampled)+[end_idx]
-                        idx_reserved.sort()
-                        idx_reserved = torch.LongTensor(idx_reserved).to(src_tokens)
-                        pad_tensor = torch.LongTensor([src_dict.pad()] * n_sampled).to(src_tokens)
-                        src_tokens[i] = torch.cat((pad_tensor,s[idx_reserved]),0).to(src_tokens)
-                        src_lengths[i] = src_lengths[i] - n_sampled
-                    elif rd >= rd2 and rd < 1: # swap
-                        # swap
-                        if start_idx >= end_idx-1 or n_sampled > end_idx-1-start_idx:
-                           continue
-                        origial_src = s.clone()
-                        idx_swap1 = torch.LongTensor(random.sample(range(start_idx,end_idx-1),n_sampled)).to(src_tokens)
-                        idx_swap2 = idx_swap1 + 1
-                        s[idx_swap1] = origial_src[idx_swap2]
-                        s[idx_swap2] = origial_src[idx_swap1]
-                        src_tokens[i] = s
-                elif noise_type == 'insert':
-
-                    idx_list1 = random.sample(range(start_idx,end_idx),n_sampled)
-                    idx_list1.sort()
-                    idx_list2 = random.sample(range(4,len(src_dict.symbols)),n_sampled)
-                    s_list = s.tolist()
-
-                    #print('insert => ',idx_list1)
-                    #print('before => ',src_tokens[i])
-                    #print('length => ',src_lengths[i])
-
-                    for insert_id,insert_idx in enumerate(idx_list1):
-                        s_list.insert(insert_idx,idx_list2[insert_id])
-
-                    src_tokens_extend[i] = torch.LongTensor(s_list).to(src_tokens)
-                    src_lengths[i] = src_lengths[i] + n_sampled
-            else: # 填充
-                # 确定填充数量
-                start_idx=1
-                for idx,word_idx in enumerate(s[1:],start=1):
-                    if word_idx.cpu().numpy() != src_dict.pad():
-                        start_idx = idx
-                        break
-                n_sampled = math.ceil(noise_rate * (end_idx-start_idx))
-                if noise_type == 'replace':
-                    idx_list1 = torch.LongTensor(random.sample(range(start_idx,end_idx),n_sampled)).to(src_tokens)
-                    idx_list2 = torch.LongTensor(random.sample(range(4,len(src_dict.symbols)),n_sampled)).to(src_tokens)
-                    s_rp = s.scatter(0,idx_list1,idx_list2)
-                    src_tokens[i] = s_rp
-                elif noise_type == 'remove':
-                    pad_tensor = torch.LongTensor([src_dict.pad()] * (n_sampled + start_idx)).to(src_tokens)
-                    idx_reserved = random.sample(range(start_idx,end_idx),end_idx - n_sampled-start_idx)+[end_idx]
-                    idx_reserved.sort()
-                    idx_reserved = torch.LongTensor(idx_reserved).to(src_tokens)
-                    src_tokens[i] = torch.cat((pad_tensor,s[idx_reserved]),0).to(src_tokens)
-                    src_lengths[i] = src_lengths[i] - n_sampled
-                elif noise_type == 'swap':
-                    if start_idx >= end_idx-1 or n_sampled > end_idx-1-start_idx:
-                       continue
-                    origial_src = s.clone()
-                    idx_swap1 = torch.LongTensor(random.sample(range(start_idx,end_idx-1),n_sampled)).to(src_tokens)
-                    idx_swap2 = idx_swap1 + 1
-                    s[idx_swap1] = origial_src[idx_swap2]
-                    s[idx_swap2] = origial_src[idx_swap1]
-                    src_tokens[i] = s
-                elif noise_type == 'hybrid':
-                    rd = random.uniform(0,1)
-                    rd1,rd2 = 1/3,2/3
-                    if rd >= 0 and rd < rd1: # replace
-                        # replace
-                        idx_list1 = torch.LongTensor(random.sample(range(start_idx,end_idx),n_sampled)).to(src_tokens)
-                        idx_list2 = torch.LongTensor(random.sample(range(4,len(src_dict.symbols)),n_sampled)).to(src_tokens)
-                        s_rp = s.scatter(0,idx_list1,idx_list2)
-                        src_tokens[i] = s_rp
-                    elif rd >= rd1 and rd < rd2: # remove
-                        # remove
-                        pad_tensor = torch.LongTensor([src_dict.pad()] * (n_sampled + start_idx)).to(src_tokens)
-                        idx_reserved = random.sample(range(start_idx,end_idx),end_idx - n_sampled-start_idx)+[end_idx]
-                        idx_reserved.sort()
-                        idx_reserved = torch.LongTensor(idx_reserved).to(src_tokens)
-                        src_tokens[i] = torch.cat((pad_tensor,s[idx_reserved]),0).to(src_tokens)
-                        src_lengths[i] = src_lengths[i] - n_sampled
-                    elif rd >= rd2 and rd < 1: # swap
-                        # swap
-                        if start_idx >= end_idx-1 or n_sampled > end_idx-1-start_idx:
-                           continue 
-                        origial_src = s.clone()
-                        idx_swap1 = torch.LongTensor(random.sample(range(start_idx,end_idx-1),n_sampled)).to(src_tokens)
-                        idx_swap2 = idx_swap1 + 1
-                        s[idx_swap1] = origial_src[idx_swap2]
-                        s[idx_swap2] = origial_src[idx_swap1]
-                        src_tokens[i] = s
-
-                elif noise_type == 'insert':
-                    idx_list1 = random.sample(range(start_idx,end_idx),n_sampled)
-                    idx_list1.sort()
-                    idx_list2 = random.sample(range(4,len(src_dict.symbols)),n_sampled)
-                    s_list = s.tolist()
-
-                    for insert_id,insert_idx in enumerate(idx_list1):
-                        s_list.insert(insert_idx,idx_list2[insert_id])
-
-                    src_tokens_extend[i] = torch.LongTensor(s_list).to(src_tokens)
-                    src_lengths[i] = src_lengths[i] + n_sampled
-        if (noise_rate != 0.0) and  (noise_type == 'insert'):
-            src_tokens = src_tokens_extend      
+    noise_seed = getattr(args,'noise_seed',None)
+    left_pad = getattr(args,'left_pad_source',True)
+    # the twin batch was already noised by NoisedLanguagePairDataset or
+    # NoiseVariantsDataset
+    noise_in_dataloader = getattr(args,'noise_in_dataloader',False) or getattr(args,'noise_from_variants',False)
+
+    if not (training_state and add_noise and (noise_rate != 0)) or noise_in_dataloader:
+        return src_tokens,src_lengths,cur_max_noise_rate
+
+    if noise_curriculum is not None:
+        cur_max_noise_rate = noise_curriculum.get_max_rate(num_updates)
+    rng = None
+    if noise_seed is not None:
+        if sample_ids is None:
+            sample_ids = torch.arange(src_tokens.size(0), device=src_tokens.device)
+        rng = CounterRNG(noise_seed, sample_ids, num_updates=num_updates)
+    rates = sample_noise_rates(
+        src_tokens.size(0),
+        num_updates,
+        noise_rate,
+        is_half_batch=is_half_batch,
+        curriculum=noise_curriculum,
+        device=src_tokens.device,
+        rng=rng,
+    )
+    noiser = TokenNoiser(src_dict, noise_type=noise_type, left_pad=left_pad)
+    src_tokens, src_lengths = noiser.noise(src_tokens, src_lengths, rates, rng=rng)
     return src_tokens,src_lengths,cur_max_noise_rate
 
 class TransformerEncoderRobustAll(TransformerEncoderBase):
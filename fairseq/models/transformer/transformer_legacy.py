@@ -177,6 +177,11 @@ class TransformerModel(TransformerModelRobustAll):
         parser.add_argument('--noise-type',type=str,choices=['replace','swap','remove','insert','hybrid'],default='replace')
         parser.add_argument('--noise-rate',type=float,default=0.0)
         parser.add_argument('--noise-seed',type=int,default=64)
+        parser.add_argument('--noise-in-dataloader',action='store_true',default=False)
+        parser.add_argument('--noise-from-variants',action='store_true',default=False,
+                            help='read the noised source from variants precomputed by fairseq-preprocess --noise-variants')
+        parser.add_argument('--noise-variant-rates',type=str,default=None,
+                            help='comma separated noise rates of the precomputed variants (default: --noise-rate)')
 
         parser.add_argument('--is-half-batch',action='store_true',default=False)
         parser.add_argument('--symmetry',action='store_true',default=False)
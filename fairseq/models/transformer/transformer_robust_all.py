@@ -149,12 +149,16 @@ class TransformerModelRobustAll(FairseqEncoderDecoderModel):
         features_only: bool = False,
         alignment_layer: Optional[int] = None,
         alignment_heads: Optional[int] = None,
+        sample_ids: Optional[Tensor] = None,
+        apply_noise: bool = True,
     ):
         """
         Run the forward pass for an encoder-decoder model.
 
         Copied from the base class, but without ``**kwargs``,
-        which are not supported by TorchScript.
+        which are not supported by TorchScript. *sample_ids* keys the
+        encoder's source noise RNG; *apply_noise* can be set to ``False``
+        for a source that was already noised.
         """
         #print('layernorm_dropout',self.cfg.layer_norm_dropout)
         #if self.cfg.scheduled_layer_norm_dropout is not None:
@@ -169,6 +173,8 @@ class TransformerModelRobustAll(FairseqEncoderDecoderModel):
         # --warmup-layer-norm-step
         encoder_out = self.encoder(
             src_tokens, src_lengths=src_lengths, return_all_hiddens=return_all_hiddens, layer_norm_dropout_rate=0.0,num_updates=self.num_updates,
+            sample_ids=sample_ids,
+            apply_noise=apply_noise,
         )
         decoder_out = self.decoder(
             prev_output_tokens,
@@ -142,6 +142,9 @@ class MultiheadAttention(nn.Module):
 
         self.add_zero_attn = add_zero_attn
         self.beam_size = 1
+        # length of the preallocated self-attention key/value cache of
+        # incremental decoding (0: grow it as needed)
+        self.kv_cache_size = 0
         self.reset_parameters()
 
         if self.use_xformers:
@@ -626,7 +629,27 @@ class MultiheadAttention(nn.Module):
                 .transpose(0, 1)
             )
 
-        if saved_state is not None:
+        if (
+            saved_state is not None
+            and self.self_attention
+            and not static_kv
+            and self.bias_k is None
+            and not self.onnx_trace
+        ):
+            assert k is not None and v is not None
+            k, v = self._append_kv_cache(saved_state, k, v, kv_bsz)
+            src_len = k.size(1)
+            key_padding_mask = MultiheadAttention._append_prev_key_padding_mask(
+                key_padding_mask=key_padding_mask,
+                prev_key_padding_mask=saved_state.get("prev_key_padding_mask", None),
+                batch_size=kv_bsz,
+                src_len=src_len,
+                static_kv=static_kv,
+            )
+            saved_state["prev_key_padding_mask"] = key_padding_mask
+            assert incremental_state is not None
+            incremental_state = self._set_input_buffer(incremental_state, saved_state)
+        elif saved_state is not None:
             # saved states are stored with shape (bsz, num_heads, seq_len, head_dim)
             if "prev_key" in saved_state:
                 _prev_key = saved_state["prev_key"]
@@ -780,6 +803,64 @@ class MultiheadAttention(nn.Module):
 
         return attn, attn_weights
 
+    def _append_kv_cache(
+        self,
+        saved_state: Dict[str, Optional[Tensor]],
+        k: Tensor,
+        v: Tensor,
+        kv_bsz: int,
+    ) -> Tuple[Tensor, Tensor]:
+        """Write the keys and values of the new decoding step(s) into the
+        preallocated cache and return the keys and values of all steps so far.
+
+        Keys and values share a single ``(2, bsz, num_heads, capacity,
+        head_dim)`` buffer, so that a beam reorder is one gather (into a
+        second buffer of the same size, which it then swaps with the first).
+        The *prev_key* and *prev_value* entries are views of its filled part.
+        """
+        new_len = k.size(1)
+        prev_len = 0
+        _prev_key = saved_state.get("prev_key", None)
+        _prev_value = saved_state.get("prev_value", None)
+        if _prev_key is not None:
+            prev_len = _prev_key.size(2)
+        total_len = prev_len + new_len
+
+        kv_cache = saved_state.get("kv_cache", None)
+        if (
+            kv_cache is None
+            or kv_cache.size(1) < kv_bsz
+            or kv_cache.size(3) < total_len
+        ):
+            if self.kv_cache_size >= total_len:
+                capacity = self.kv_cache_size
+            else:
+                # the generator did not size the cache: grow it geometrically
+                capacity = max(2 * total_len, 16)
+            new_cache = k.new_empty(
+                (2, kv_bsz, self.num_heads, capacity, self.head_dim)
+            )
+            if _prev_key is not None and _prev_value is not None:
+                new_cache[0, :, :, :prev_len] = _prev_key
+                new_cache[1, :, :, :prev_len] = _prev_value
+            kv_cache = new_cache
+            saved_state["kv_cache"] = kv_cache
+
+        kv_cache[0, :kv_bsz, :, prev_len:total_len] = k.view(
+            kv_bsz, self.num_heads, new_len, self.head_dim
+        )
+        kv_cache[1, :kv_bsz, :, prev_len:total_len] = v.view(
+            kv_bsz, self.num_heads, new_len, self.head_dim
+        )
+        prev_key = kv_cache[0, :kv_bsz, :, :total_len]
+        prev_value = kv_cache[1, :kv_bsz, :, :total_len]
+        saved_state["prev_key"] = prev_key
+        saved_state["prev_value"] = prev_value
+        return (
+            prev_key.view(kv_bsz * self.num_heads, total_len, self.head_dim),
+            prev_value.view(kv_bsz * self.num_heads, total_len, self.head_dim),
+        )
+
     @staticmethod
     def _append_prev_key_padding_mask(
         key_padding_mask: Optional[Tensor],
@@ -833,8 +914,40 @@ class MultiheadAttention(nn.Module):
         """Reorder buffered internal state (for incremental generation)."""
         input_buffer = self._get_input_buffer(incremental_state)
         if input_buffer is not None:
+            kv_cache = input_buffer.get("kv_cache", None)
+            prev_key = input_buffer.get("prev_key", None)
+            if kv_cache is not None and prev_key is not None:
+                # gather keys and values into a second buffer of the same
+                # size with a single index_select, then swap the buffers, so
+                # that a reorder allocates nothing
+                prev_bsz, new_bsz = prev_key.size(0), new_order.size(0)
+                prev_len = prev_key.size(2)
+                spare = input_buffer.get("kv_cache_spare", None)
+                if new_bsz > kv_cache.size(1):
+                    spare = kv_cache.new_empty((2, new_bsz) + kv_cache.size()[2:])
+                elif spare is None or spare.size() != kv_cache.size():
+                    spare = torch.empty_like(kv_cache)
+                torch.index_select(
+                    kv_cache[:, :prev_bsz, :, :prev_len],
+                    1,
+                    new_order,
+                    out=spare[:, :new_bsz, :, :prev_len],
+                )
+                if spare.size() == kv_cache.size():
+                    input_buffer["kv_cache_spare"] = kv_cache
+                kv_cache = spare
+                input_buffer["kv_cache"] = kv_cache
+                input_buffer["prev_key"] = kv_cache[0, :new_bsz, :, :prev_len]
+                input_buffer["prev_value"] = kv_cache[1, :new_bsz, :, :prev_len]
             for k in input_buffer.keys():
                 input_buffer_k = input_buffer[k]
+                if kv_cache is not None and (
+                    k == "kv_cache"
+                    or k == "kv_cache_spare"
+                    or k == "prev_key"
+                    or k == "prev_value"
+                ):
+                    continue
                 if input_buffer_k is not None:
                     if self.encoder_decoder_attention:
                         if input_buffer_k.size(0) * self.beam_size == new_order.size(0):
@@ -856,6 +969,95 @@ class MultiheadAttention(nn.Module):
         """Used for effiecient beamable enc-dec attention"""
         self.beam_size = beam_size
 
+    def set_kv_cache_size(self, kv_cache_size):
+        """Preallocate the self-attention key/value cache of incremental
+        decoding for *kv_cache_size* steps."""
+        self.kv_cache_size = kv_cache_size
+
+    def extend_incremental_state(
+        self,
+        incremental_state: Dict[str, Dict[str, Optional[Tensor]]],
+        num_rows: int,
+    ):
+        """Append *num_rows* sentences without history to the buffered state
+        (for continuous batching).
+
+        The new rows get masked self-attention steps up to the current
+        length. The static encoder-decoder keys and values are dropped, to be
+        recomputed from the extended encoder output at the next step.
+        """
+        input_buffer = self._get_input_buffer(incremental_state)
+        if self.encoder_decoder_attention:
+            for k in ["prev_key", "prev_value", "prev_key_padding_mask"]:
+                if k in input_buffer:
+                    del input_buffer[k]
+            self._set_input_buffer(incremental_state, input_buffer)
+            return
+        prev_key = input_buffer.get("prev_key", None)
+        prev_value = input_buffer.get("prev_value", None)
+        if prev_key is None or prev_value is None:
+            return
+        bsz, _, seq_len, _ = prev_key.size()
+        new_bsz = bsz + num_rows
+        kv_cache = input_buffer.get("kv_cache", None)
+        if kv_cache is None or kv_cache.size(1) < new_bsz:
+            capacity = seq_len if kv_cache is None else kv_cache.size(3)
+            new_cache = prev_key.new_empty(
+                (2, new_bsz, self.num_heads, capacity, self.head_dim)
+            )
+            new_cache[0, :bsz, :, :seq_len] = prev_key
+            new_cache[1, :bsz, :, :seq_len] = prev_value
+            kv_cache = new_cache
+            input_buffer["kv_cache"] = kv_cache
+        # masked, but must not hold NaNs that the attention would multiply by 0
+        kv_cache[:, bsz:new_bsz, :, :seq_len] = 0
+        input_buffer["prev_key"] = kv_cache[0, :new_bsz, :, :seq_len]
+        input_buffer["prev_value"] = kv_cache[1, :new_bsz, :, :seq_len]
+
+        prev_key_padding_mask = input_buffer.get("prev_key_padding_mask", None)
+        if prev_key_padding_mask is None:
+            prev_key_padding_mask = prev_key.new_zeros((bsz, seq_len))
+        input_buffer["prev_key_padding_mask"] = torch.cat(
+            [
+                prev_key_padding_mask.float(),
+                prev_key_padding_mask.new_ones((num_rows, seq_len)).float(),
+            ],
+            dim=0,
+        )
+        self._set_input_buffer(incremental_state, input_buffer)
+
+    def trim_incremental_state(
+        self,
+        incremental_state: Dict[str, Dict[str, Optional[Tensor]]],
+        num_steps: int,
+    ):
+        """Drop the first *num_steps* self-attention steps from the buffered
+        state, once they are masked for every sentence."""
+        input_buffer = self._get_input_buffer(incremental_state)
+        prev_key = input_buffer.get("prev_key", None)
+        if self.encoder_decoder_attention or prev_key is None or num_steps == 0:
+            return
+        bsz, seq_len = prev_key.size(0), prev_key.size(2)
+        new_len = seq_len - num_steps
+        kv_cache = input_buffer.get("kv_cache", None)
+        if kv_cache is not None:
+            kv_cache[:, :bsz, :, :new_len] = kv_cache[
+                :, :bsz, :, num_steps:seq_len
+            ].clone()
+            input_buffer["prev_key"] = kv_cache[0, :bsz, :, :new_len]
+            input_buffer["prev_value"] = kv_cache[1, :bsz, :, :new_len]
+        else:
+            for k in ["prev_key", "prev_value"]:
+                input_buffer_k = input_buffer[k]
+                assert input_buffer_k is not None
+                input_buffer[k] = input_buffer_k[:, :, num_steps:]
+        prev_key_padding_mask = input_buffer.get("prev_key_padding_mask", None)
+        if prev_key_padding_mask is not None:
+            input_buffer["prev_key_padding_mask"] = prev_key_padding_mask[
+                :, num_steps:
+            ]
+        self._set_input_buffer(incremental_state, input_buffer)
+
     def _get_input_buffer(
         self, incremental_state: Optional[Dict[str, Dict[str, Optional[Tensor]]]]
     ) -> Dict[str, Optional[Tensor]]:
@@ -4,7 +4,6 @@
 """ Wrapper for ngram_repeat_block cuda extension """
 import math
 import warnings
-from typing import List
 
 import torch
 from torch import nn
@@ -94,27 +93,20 @@ class NGramRepeatBlock(nn.Module):
             )
 
     def _no_repeat_ngram(self, tokens, lprobs, bsz: int, beam_size: int, step: int):
-        """For each hypothesis generate a list of previous ngrams and set associated lprobs to -inf"""
-        banned_tokens = [
-            torch.jit.annotate(List[int], []) for bbsz_idx in range(bsz * beam_size)
-        ]
-        if step + 2 - self.no_repeat_ngram_size >= 0:
-            cpu_tokens: List[List[int]] = tokens.cpu().tolist()
-            check_start_pos = step + 2 - self.no_repeat_ngram_size
-            for bbsz_idx in range(bsz * beam_size):
-                ngram_to_check = cpu_tokens[bbsz_idx][
-                    -(self.no_repeat_ngram_size - 1) :
-                ]
-                for i in range(check_start_pos):
-                    if (
-                        ngram_to_check
-                        == cpu_tokens[bbsz_idx][i : i + self.no_repeat_ngram_size - 1]
-                    ):
-                        banned_tokens[bbsz_idx].append(
-                            cpu_tokens[bbsz_idx][i + self.no_repeat_ngram_size - 1]
-                        )
-        for bbsz_idx in range(bsz * beam_size):
-            lprobs[bbsz_idx][
-                torch.tensor(banned_tokens[bbsz_idx], dtype=torch.int64)
-            ] = torch.tensor(-math.inf).to(lprobs)
-        return lprobs
+        """For each hypothesis, set the lprobs of the tokens that would repeat
+        an ngram of its first ``step + 1`` tokens to -inf"""
+        n = self.no_repeat_ngram_size
+        num_ngrams = step + 2 - n
+        if num_ngrams <= 0:
+            return lprobs
+        # (bsz * beam_size, num_ngrams, n): the ngrams of every hypothesis
+        ngrams = tokens[:, : step + 1].unfold(1, n, 1)
+        # an ngram whose first n - 1 tokens are the last n - 1 tokens of the
+        # hypothesis bans its last token
+        last_tokens = tokens[:, num_ngrams : step + 1].unsqueeze(1)
+        matches = ngrams[:, :, :-1].eq(last_tokens).all(dim=2)
+        # scatter_add_, as a token may be both banned and not by different ngrams
+        banned = torch.zeros_like(lprobs).scatter_add_(
+            1, ngrams[:, :, -1], matches.to(lprobs)
+        )
+        return lprobs.masked_fill_(banned > 0, -math.inf)
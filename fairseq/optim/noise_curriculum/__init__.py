@@ -0,0 +1,42 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""isort:skip_file"""
+
+import importlib
+import os
+
+from fairseq import registry
+from fairseq.optim.noise_curriculum.noise_curriculum_scheduler import (  # noqa
+    NoiseCurriculumScheduler,
+)
+
+
+(
+    build_noise_curriculum_,
+    register_noise_curriculum,
+    NOISE_CURRICULUM_REGISTRY,
+    NOISE_CURRICULUM_DATACLASS_REGISTRY,
+) = registry.setup_registry(
+    "--noise-curriculum", base_class=NoiseCurriculumScheduler, default=None
+)
+
+
+def build_noise_curriculum(cfg, model_cfg=None):
+    """Build the noise curriculum selected with ``--noise-curriculum``.
+
+    Without one, fall back to the ``--curriculum-learning --curriculum-args``
+    options of the robust models in *model_cfg*. Returns ``None`` if no
+    curriculum is configured.
+    """
+    if cfg is None and model_cfg is not None:
+        return NOISE_CURRICULUM_REGISTRY["power"].from_model_args(model_cfg)
+    return build_noise_curriculum_(cfg)
+
+
+# automatically import any Python files in the optim/noise_curriculum/ directory
+for file in sorted(os.listdir(os.path.dirname(__file__))):
+    if file.endswith(".py") and not file.startswith("_"):
+        file_name = file[: file.find(".py")]
+        importlib.import_module("fairseq.optim.noise_curriculum." + file_name)
@@ -0,0 +1,63 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import torch
+
+from fairseq.dataclass.utils import gen_parser_from_dataclass
+
+
+class NoiseCurriculumScheduler(object):
+    """Schedule of the source noise rate of robust (ISDST) training.
+
+    Like the LR schedulers, it is stepped by the :class:`~fairseq.trainer.Trainer`
+    after each update and its state is saved with the checkpoint. Its rates
+    are a function of the number of updates only, so the noise of a resumed
+    run follows the same schedule.
+    """
+
+    def __init__(self, cfg):
+        super().__init__()
+        self.cfg = cfg
+        self.num_updates = 0
+
+    @classmethod
+    def add_args(cls, parser):
+        """Add arguments to the parser for this noise curriculum."""
+        dc = getattr(cls, "__dataclass", None)
+        if dc is not None:
+            gen_parser_from_dataclass(parser, dc())
+
+    def state_dict(self):
+        """Return the noise curriculum state dict."""
+        return {"num_updates": self.num_updates}
+
+    def load_state_dict(self, state_dict):
+        """Load a noise curriculum state dict."""
+        self.num_updates = state_dict["num_updates"]
+
+    def step_update(self, num_updates):
+        """Update the noise rate after each update."""
+        self.num_updates = num_updates
+        return self.get_rate()
+
+    def get_rate(self, num_updates=None):
+        """Noise rate after *num_updates* updates (default: the current
+        number of updates)."""
+        raise NotImplementedError
+
+    def get_max_rate(self, num_updates=None):
+        """Upper bound of the per-sentence noise rates."""
+        return self.get_rate(num_updates)
+
+    def sample_rates(self, bsz, num_updates=None, device=None, rng=None):
+        """Per-sentence noise rates of *bsz* sentences, as a double tensor.
+
+        Random rates are drawn from *rng* (a
+        :class:`~fairseq.data.robust_noising.CounterRNG`) if given, and from
+        the global torch RNG otherwise.
+        """
+        return torch.full(
+            (bsz,), self.get_rate(num_updates), dtype=torch.double, device=device
+        )
@@ -0,0 +1,162 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import json
+from dataclasses import dataclass, field
+
+import torch
+
+from fairseq.data.robust_noising import STREAM_RATE
+from fairseq.dataclass import FairseqDataclass
+from fairseq.optim.noise_curriculum import (
+    NoiseCurriculumScheduler,
+    register_noise_curriculum,
+)
+
+
+@dataclass
+class PowerNoiseCurriculumConfig(FairseqDataclass):
+    curriculum_max_rate: float = field(
+        default=0.1, metadata={"help": "noise rate at the end of the curriculum"}
+    )
+    curriculum_min_rate: float = field(
+        default=0.0, metadata={"help": "noise rate at the start of the curriculum"}
+    )
+    curriculum_power: float = field(
+        default=2.0,
+        metadata={
+            "help": "p of the curriculum: the p-th power of the rate grows "
+            "linearly from min to max rate"
+        },
+    )
+    curriculum_updates: int = field(
+        default=10000,
+        metadata={
+            "help": "refresh the upper bound of the per-sentence rates every N "
+            "updates (--curriculum-type 1); only these updates are noised, "
+            "unless --curriculum-hold-max-rate"
+        },
+    )
+    curriculum_hold_max_rate: bool = field(
+        default=False,
+        metadata={
+            "help": "keep the upper bound of --curriculum-type 1 between its "
+            "refreshes, so that every update is noised"
+        },
+    )
+    curriculum_max_updates: int = field(
+        default=200000,
+        metadata={"help": "length of the curriculum in updates"},
+    )
+    curriculum_reverse: bool = field(
+        default=False,
+        metadata={"help": "decrease the noise rate over the curriculum instead"},
+    )
+    curriculum_type: int = field(
+        default=1,
+        metadata={
+            "help": "1: per-sentence rates drawn below the (stepwise) curriculum "
+            "rate; 2: the curriculum rate itself; 3: per-sentence rates drawn "
+            "below --curriculum-max-rate"
+        },
+    )
+
+
+@register_noise_curriculum("power", dataclass=PowerNoiseCurriculumConfig)
+class PowerNoiseCurriculum(NoiseCurriculumScheduler):
+    """Competence-style curriculum of the ISDST paper.
+
+    The noise rate after *t* of *T* updates is::
+
+      rate = (min_rate**p + (max_rate**p - min_rate**p) * t / T) ** (1 / p)
+
+    capped at *max_rate* (or ``max_rate - rate``, floored at 0, with
+    *reverse*). The rate of every update is computed once when the
+    curriculum is built, so stepping it is a table lookup.
+
+    This is the curriculum of the legacy ``--curriculum-learning
+    --curriculum-args`` model options, see :func:`from_model_args`.
+    """
+
+    def __init__(self, cfg: PowerNoiseCurriculumConfig):
+        super().__init__(cfg)
+        if cfg.curriculum_type not in {1, 2, 3}:
+            raise ValueError(
+                "unknown curriculum type: {}".format(cfg.curriculum_type)
+            )
+        if cfg.curriculum_max_updates <= 0 or cfg.curriculum_updates <= 0:
+            raise ValueError("curriculum lengths must be positive")
+
+        p = cfg.curriculum_power
+        max_rate, min_rate = cfg.curriculum_max_rate, cfg.curriculum_min_rate
+        # one entry past the end, after which the rate no longer changes
+        t = torch.arange(cfg.curriculum_max_updates + 2, dtype=torch.double)
+        temp = (max_rate ** p - min_rate ** p) * (
+            t / cfg.curriculum_max_updates
+        ) + min_rate ** p
+        if cfg.curriculum_reverse:
+            rates = (max_rate - temp.pow(1 / p)).clamp(min=0)
+        else:
+            rates = temp.pow(1 / p).clamp(max=max_rate)
+        self.rates = rates.tolist()
+
+    @classmethod
+    def from_model_args(cls, args):
+        """Build the curriculum from the ``--curriculum-args`` JSON of the
+        robust models, or return ``None`` without ``--curriculum-learning``."""
+        curriculum_args = getattr(args, "curriculum_args", None)
+        if not (getattr(args, "curriculum_learning", False) and curriculum_args):
+            return None
+        if isinstance(curriculum_args, str):
+            curriculum_args = json.loads(curriculum_args)
+        return cls(
+            PowerNoiseCurriculumConfig(
+                curriculum_max_rate=curriculum_args["max_rate"],
+                curriculum_min_rate=curriculum_args["min_rate"],
+                curriculum_power=curriculum_args["p"],
+                curriculum_updates=curriculum_args["cupdates"],
+                curriculum_max_updates=curriculum_args["mupdates"],
+                curriculum_reverse=bool(curriculum_args.get("reverse", 0)),
+                curriculum_type=curriculum_args.get("type", 1),
+                curriculum_hold_max_rate=bool(
+                    curriculum_args.get("hold_max_rate", 0)
+                ),
+            )
+        )
+
+    def get_rate(self, num_updates=None):
+        if num_updates is None:
+            num_updates = self.num_updates
+        return self.rates[min(num_updates, len(self.rates) - 1)]
+
+    def get_max_rate(self, num_updates=None):
+        """Upper bound of the per-sentence noise rates.
+
+        For type-1 curricula the bound is only set every
+        ``--curriculum-updates`` updates. As in the original implementation,
+        it is 0 (no noise) on the other updates, unless
+        ``--curriculum-hold-max-rate`` keeps it until the next refresh.
+        """
+        if num_updates is None:
+            num_updates = self.num_updates
+        if self.cfg.curriculum_type == 3:
+            return self.cfg.curriculum_max_rate
+        if self.cfg.curriculum_type == 2:
+            return self.get_rate(num_updates)
+        cupdates = self.cfg.curriculum_updates
+        if num_updates % cupdates == 0:
+            return self.get_rate(num_updates)
+        if self.cfg.curriculum_hold_max_rate:
+            return self.get_rate((num_updates // cupdates) * cupdates)
+        return 0.0
+
+    def sample_rates(self, bsz, num_updates=None, device=None, rng=None):
+        if self.cfg.curriculum_type == 2:
+            return super().sample_rates(bsz, num_updates, device=device)
+        if rng is not None:
+            uniform = rng.uniform((bsz,), STREAM_RATE, dtype=torch.double)
+        else:
+            uniform = torch.rand(bsz, device=device, dtype=torch.double)
+        return uniform * self.get_max_rate(num_updates)
@@ -305,6 +305,20 @@ def add_preprocess_args(parser):
                        help="number of parallel workers")
     group.add_argument("--dict-only", action='store_true',
                        help="if true, only builds a dictionary and then exits")
+    group.add_argument("--shard-size", metavar="MB", default=0, type=int,
+                       help="if > 0, count the words and binarize each input file in "
+                            "shards of about MB megabytes, written directly and "
+                            "listed in a manifest; an interrupted run resumes "
+                            "from the shards it finished")
+    group.add_argument("--noise-variants", metavar="N", default=0, type=int,
+                       help="also binarize N noised variants of every training "
+                            "source sentence, read by --noise-from-variants")
+    group.add_argument("--noise-types", metavar="TYPES", default="hybrid",
+                       help="comma separated noise types of the variants")
+    group.add_argument("--noise-rates", metavar="RATES", default="0.1",
+                       help="comma separated noise rates of the variants")
+    group.add_argument("--noise-seed", metavar="N", default=64, type=int,
+                       help="noise seed of the variants")
     # fmt: on
     return parser
 
@@ -0,0 +1,102 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+from collections import namedtuple
+
+import numpy as np
+
+# what sacrebleu.corpus_bleu returns, minus the score
+BleuStats = namedtuple("BleuStats", ["counts", "totals", "sys_len", "ref_len"])
+
+# a detokenized reference with its n-gram statistics
+CachedReference = namedtuple("CachedReference", ["string", "length", "ngrams"])
+
+# odd 64-bit multiplier of the n-gram hash
+_NGRAM_PRIME = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _build_sacrebleu_tokenizer(tokenize):
+    try:
+        # sacrebleu >= 2.0
+        from sacrebleu.metrics import BLEU
+
+        return BLEU(tokenize=tokenize).tokenizer
+    except TypeError:
+        from sacrebleu.tokenizers import TOKENIZERS
+
+        return TOKENIZERS[tokenize]()
+
+
+class CachedCorpusBleu(object):
+    """Single-reference corpus BLEU statistics, as computed by
+    ``sacrebleu.corpus_bleu``, with cached references.
+
+    The detokenized references and their n-gram counts are computed the
+    first time a reference is seen and reused afterwards, so that repeated
+    validations only process the hypotheses. N-grams are hashed from word
+    ids with numpy and matched with sorted-array intersections instead of
+    per-sentence Counters.
+
+    Args:
+        tokenize (str, optional): sacrebleu tokenizer (default: ``13a``)
+        max_order (int, optional): maximum n-gram order (default: 4)
+    """
+
+    def __init__(self, tokenize="13a", max_order=4):
+        self.tokenizer = _build_sacrebleu_tokenizer(tokenize)
+        self.max_order = max_order
+        self.vocab = {}
+        self.references = {}
+
+    def _word_ids(self, sentence):
+        words = self.tokenizer(sentence.rstrip()).split()
+        return np.fromiter(
+            (self.vocab.setdefault(w, len(self.vocab)) for w in words),
+            dtype=np.uint64,
+            count=len(words),
+        )
+
+    def _ngrams(self, ids):
+        """Unique n-gram hashes and their counts for every order."""
+        ngrams = []
+        keys = ids
+        with np.errstate(over="ignore"):
+            for n in range(1, self.max_order + 1):
+                if n > 1:
+                    # wraps around modulo 2**64
+                    keys = keys[:-1] * _NGRAM_PRIME + ids[n - 1 :]
+                ngrams.append(np.unique(keys, return_counts=True))
+        return ngrams
+
+    def reference(self, key, decode):
+        """The cached reference for *key* (e.g. its target token ids),
+        built with ``decode()`` if it was not seen before."""
+        ref = self.references.get(key, None)
+        if ref is None:
+            string = decode()
+            ids = self._word_ids(string)
+            ref = CachedReference(string, len(ids), self._ngrams(ids))
+            self.references[key] = ref
+        return ref
+
+    def corpus_bleu(self, hyps, refs):
+        """Corpus statistics of the hypothesis strings *hyps* against the
+        :class:`CachedReference` *refs*."""
+        counts = np.zeros(self.max_order, dtype=np.int64)
+        totals = np.zeros(self.max_order, dtype=np.int64)
+        sys_len, ref_len = 0, 0
+        for hyp, ref in zip(hyps, refs):
+            ids = self._word_ids(hyp)
+            sys_len += len(ids)
+            ref_len += ref.length
+            for n, ((keys, hyp_counts), (ref_keys, ref_counts)) in enumerate(
+                zip(self._ngrams(ids), ref.ngrams)
+            ):
+                totals[n] += max(0, len(ids) - n)
+                _, i, j = np.intersect1d(
+                    keys, ref_keys, assume_unique=True, return_indices=True
+                )
+                counts[n] += np.minimum(hyp_counts[i], ref_counts[j]).sum()
+        return BleuStats(counts.tolist(), totals.tolist(), sys_len, ref_len)
@@ -9,13 +9,21 @@ from typing import List, Optional
 import torch
 import torch.nn as nn
 from fairseq.token_generation_constraints import (
-    ConstraintState,
-    OrderedConstraintState,
-    UnorderedConstraintState,
+    ConstraintTable,
+    OrderedConstraintTable,
+    UnorderedConstraintTable,
 )
 from torch import Tensor
 
 
+def _stable_partition(mask: Tensor) -> Tensor:
+    """The permutation of each row of *mask* that moves its True entries
+    first, keeping their order."""
+    width = mask.size(1)
+    positions = torch.arange(width, device=mask.device).unsqueeze(0)
+    return ((~mask).long() * width + positions).sort(dim=1)[1]
+
+
 class Search(nn.Module):
     def __init__(self, tgt_dict):
         super().__init__()
@@ -221,9 +229,11 @@ class LexicallyConstrainedBeamSearch(Search):
         2019. https://www.aclweb.org/anthology/N19-1090/
 
     This is accomplished by maintaining, for each beam hypothesis, a
-    ConstraintState object (see constraints.py) that tracks which
+    constraint state (see token_generation_constraints.py) that tracks which
     constraints have been generated and using this information to
-    shape the beam for each input sentence.
+    shape the beam for each input sentence. The states of the whole batch
+    are a tensor, advanced for all candidates at once by an array-backed
+    ConstraintTable.
     """
 
     def __init__(self, tgt_dict, representation):
@@ -232,32 +242,38 @@ class LexicallyConstrainedBeamSearch(Search):
         self.vocab_size = len(tgt_dict)
         self.num_cands = 0
         self.supports_constraints = True
+        self.constraint_table: Optional[ConstraintTable] = None
+        self.constraint_states: Optional[Tensor] = None
 
     @torch.jit.export
     def init_constraints(self, batch_constraints: Optional[Tensor], beam_size: int):
-        self.constraint_states = []
-        for constraint_tensor in batch_constraints:
-            if self.representation == "ordered":
-                constraint_state = OrderedConstraintState.create(constraint_tensor)
-            elif self.representation == "unordered":
-                constraint_state = UnorderedConstraintState.create(constraint_tensor)
-
-            self.constraint_states.append([constraint_state for i in range(beam_size)])
+        self.constraint_table = None
+        self.constraint_states = None
+        if batch_constraints is None:
+            return
+        if self.representation == "ordered":
+            self.constraint_table = OrderedConstraintTable(batch_constraints)
+        elif self.representation == "unordered":
+            self.constraint_table = UnorderedConstraintTable(batch_constraints)
+        self.constraint_states = self.constraint_table.init_states(beam_size)
 
     @torch.jit.export
     def prune_sentences(self, batch_idxs: Tensor):
-        self.constraint_states = [
-            self.constraint_states[i] for i in batch_idxs.tolist()
-        ]
+        if self.constraint_table is not None:
+            self.constraint_table.prune(batch_idxs)
+            self.constraint_states = self.constraint_states.index_select(
+                0, batch_idxs
+            )
 
     @torch.jit.export
     def update_constraints(self, active_hypos: Tensor):
-        if self.constraint_states:
-            batch_size = active_hypos.size(0)
-            for sentid in range(batch_size):
-                self.constraint_states[sentid] = [
-                    self.constraint_states[sentid][i] for i in active_hypos[sentid]
-                ]
+        if self.constraint_table is not None:
+            self.constraint_states = self.constraint_states.gather(
+                1,
+                active_hypos.unsqueeze(-1).expand(
+                    -1, -1, self.constraint_states.size(-1)
+                ),
+            )
 
     @torch.jit.export
     def step(
@@ -279,19 +295,22 @@ class LexicallyConstrainedBeamSearch(Search):
         on. We then sort by (stripe, score), and truncate the list at
         2 * beam size.
 
+        All sentences of the batch are processed together: each sentence has
+        the same number of candidate slots, and the slots that are not used
+        (e.g. a beam item with fewer next constraint tokens) are masked and
+        sorted last.
+
         Args:
             step: the decoder step
             lprobs: (batch size, beam size, target vocab)
                 the target-vocab distributions for each item in the beam.
-        Retrun: A tuple of (scores, indices, beams, constraints) where:
+        Retrun: A tuple of (scores, indices, beams) where:
             scores: (batch, output beam size)
                 the scores of the chosen elements
             indices: (batch, output beam size)
                 the target vocab indices of the chosen elements
             beams: (batch, output beam size)
                 the 0-indexed hypothesis ids of the chosen elements
-            constraints: (batch, output beam size)
-                the new constraint states
         """
         each_k = 1
         device = lprobs.device
@@ -306,19 +325,12 @@ class LexicallyConstrainedBeamSearch(Search):
         )
 
         # STEP 0: Preliminary. Prevent EOS for unfinished hyps across all batch items
-        constraint_states = self.constraint_states
-        if constraint_states and step > 0:
-            not_finished_indices = []
-            for sentno, sent_constraints in enumerate(constraint_states):
-                for beamno, state in enumerate(sent_constraints):
-                    index = sentno * beam_size + beamno
-                    if not state.finished:
-                        not_finished_indices.append(index)
-            not_finished_indices = torch.tensor(not_finished_indices)
-            if not_finished_indices.numel() > 0:
-                lprobs.view(batch_size * beam_size, -1)[
-                    not_finished_indices, self.eos
-                ] = -math.inf
+        table = self.constraint_table
+        states = self.constraint_states
+        if table is not None and states is not None and step > 0:
+            lprobs.view(batch_size * beam_size, -1)[:, self.eos].masked_fill_(
+                ~table.finished(states).view(-1), -math.inf
+            )
 
         if step == 0:
             # at the first step all hypotheses are equally likely, so use
@@ -339,7 +351,7 @@ class LexicallyConstrainedBeamSearch(Search):
         indices_buf = indices_buf.fmod(vocab_size)
 
         # Short circuit if there are no constraints in this batch
-        if not constraint_states:
+        if table is None or states is None:
             return scores_buf, indices_buf, beams_buf
 
         # STEP 1: get top-1 from each hypothesis across all sentences in the batch
@@ -356,62 +368,27 @@ class LexicallyConstrainedBeamSearch(Search):
             new_beams = torch.arange(0, beam_size, device=device).repeat(batch_size, 1)
             beams_buf = torch.cat((beams_buf, new_beams), dim=1)
 
-        # Now, process sentences in the batch one by one.
-        new_scores_buf = torch.zeros((batch_size, 2 * beam_size), device=device)
-        new_indices_buf = torch.zeros((batch_size, 2 * beam_size), device=device).long()
-        new_beams_buf = torch.zeros((batch_size, 2 * beam_size), device=device).long()
-        for sentno, states in enumerate(constraint_states):
-            scores, indices, beams, new_states = self.step_sentence(
-                step,
-                sentno,
-                lprobs[sentno],
-                constraint_states[sentno],
-                beams_buf[sentno].clone(),
-                indices_buf[sentno].clone(),
-                scores_buf[sentno].clone(),
-            )
-            new_scores_buf[sentno] = scores
-            new_indices_buf[sentno] = indices
-            new_beams_buf[sentno] = beams
-            self.constraint_states[sentno] = new_states
-
-        return new_scores_buf, new_indices_buf, new_beams_buf
-
-    @torch.jit.export
-    def step_sentence(
-        self,
-        step: int,
-        sentno: int,
-        lprobs: Tensor,
-        constraint_states: List[List[ConstraintState]],
-        beams_buf: Tensor,
-        indices_buf: Tensor,
-        scores_buf: Tensor,
-    ):
-        """Does per-sentence processing. Adds all constraints for each
-        hypothesis to the list of candidates; then removes duplicates,
-        sorts, and dynamically stripes across the banks. All tensor inputs
-        are collapsed to those pertaining to a single input sentence.
-        """
-        device = lprobs.device
-
-        # STEP 2: Add all constraints for each beam item
-        for beamno, state in enumerate(constraint_states):
-            next_tokens = torch.tensor(list(state.next_tokens()), device=device).long()
-            if next_tokens.numel() != 0:
-                indices_buf = torch.cat((indices_buf, next_tokens))
-                next_beams = (
-                    torch.tensor(beamno, device=device)
-                    .repeat(next_tokens.size(0))
-                    .long()
-                )
-                beams_buf = torch.cat((beams_buf, next_beams))
-                next_values = lprobs[beamno].take(next_tokens.view(-1))
-                scores_buf = torch.cat((scores_buf, next_values))
-
-            # At the 0th time step, there is just one beam item
-            if step == 0:
-                break
+        # STEP 2: Add all constraints for each beam item (at the 0th time
+        # step, there is just one beam item)
+        num_beams = lprobs.size(1)
+        next_tokens = table.next_tokens(states[:, :num_beams])
+        valid = torch.cat(
+            (
+                torch.ones_like(indices_buf, dtype=torch.bool),
+                next_tokens.ge(0).view(batch_size, -1),
+            ),
+            dim=1,
+        )
+        next_tokens = next_tokens.clamp(min=0)
+        next_beams = torch.arange(num_beams, device=device).view(1, -1, 1)
+        scores_buf = torch.cat(
+            (scores_buf, lprobs.gather(2, next_tokens).view(batch_size, -1)), dim=1
+        )
+        indices_buf = torch.cat((indices_buf, next_tokens.view(batch_size, -1)), dim=1)
+        beams_buf = torch.cat(
+            (beams_buf, next_beams.expand_as(next_tokens).reshape(batch_size, -1)),
+            dim=1,
+        )
 
         # STEP 3: Compute the "bank" for each candidate. This is the
         # number of constraints it's generated. We need this so that
@@ -423,59 +400,54 @@ class LexicallyConstrainedBeamSearch(Search):
         # creating a sort key and striping across the banks.
 
         # Compute the new states for all candidates
-        cands_size = indices_buf.size(0)
-        constraint_states = [
-            constraint_states[beams_buf[i]].advance(indices_buf[i])
-            for i in range(cands_size)
-        ]
-
-        banks = torch.tensor([state.bank for state in constraint_states], device=device)
+        state_size = states.size(2)
+        cand_states = table.advance(
+            states.gather(1, beams_buf.unsqueeze(-1).expand(-1, -1, state_size)),
+            indices_buf,
+        )
+        banks = table.banks(cand_states)
+
+        def select(order: Tensor):
+            return (
+                scores_buf.gather(1, order),
+                indices_buf.gather(1, order),
+                beams_buf.gather(1, order),
+                banks.gather(1, order),
+                cand_states.gather(1, order.unsqueeze(-1).expand(-1, -1, state_size)),
+            )
 
         # STEP 4: Sort
-        num_constraint_tokens = len(state.tokens)
+        num_constraint_tokens = table.num_tokens.unsqueeze(1)
 
         # Sort by keys (bank, score) (i.e., sort banks together, and scores
-        # within banks). AFAIK pytorch doesn't support either stable sort or
-        # multi-key sorting, so we have to hack this.
+        # within banks), and move the unused slots to the end.
         MAX_SCORE = -100
         sort_key = (num_constraint_tokens - banks) * MAX_SCORE + scores_buf
-        sort_values, sort_indices = sort_key.sort(dim=0, descending=True)
-        scores_buf = scores_buf[sort_indices]
-        indices_buf = indices_buf[sort_indices]
-        beams_buf = beams_buf[sort_indices]
-        banks = banks[sort_indices]
-
-        # Sort the constraints to follow suit
-        constraint_states = [constraint_states[i] for i in sort_indices]
+        sort_indices = sort_key.sort(dim=1, descending=True)[1]
+        sort_indices = sort_indices.gather(
+            1, _stable_partition(valid.gather(1, sort_indices))
+        )
+        valid = valid.gather(1, sort_indices)
+        scores_buf, indices_buf, beams_buf, banks, cand_states = select(sort_indices)
 
         # STEP 5: Remove duplicates. The topk calls (overall and
         # per-row) plus the per-row generation of constraints will
         # produce duplicates. Here we remove them.
 
-        def roll(t):
-            """Rolls a 1d tensor left by 1.
-
-            [0, 1, 2, 3, 4] becomes [4, 0, 1, 2, 3]
-            """
-            return torch.cat((t[-1].unsqueeze(0), t[0:-1]), dim=0)
-
         # We map candidates (beam, token_id) to a single dimension.
-        # This is then shifted by 1. We can then easily identify
-        # duplicates and create a mask that identifies unique
-        # extensions.
-        uniques_mask = beams_buf * (self.vocab_size + 1) + indices_buf
-        uniques_mask = roll(uniques_mask) != uniques_mask
+        # This is then rolled by 1 among the used slots (the last one
+        # coming first). We can then easily identify duplicates and
+        # create a mask that identifies unique extensions.
+        cands = beams_buf * (self.vocab_size + 1) + indices_buf
+        num_valid = valid.sum(dim=1, keepdim=True)
+        rolled = torch.cat((cands.gather(1, num_valid - 1), cands[:, :-1]), dim=1)
+        uniques_mask = valid & (rolled != cands)
 
         # Use the mask to pare down the data structures
-        scores_buf = torch.masked_select(scores_buf, uniques_mask)
-        indices_buf = torch.masked_select(indices_buf, uniques_mask)
-        beams_buf = torch.masked_select(beams_buf, uniques_mask)
-        banks = torch.masked_select(banks, uniques_mask)
-        i = 1
-        for mask in uniques_mask[1:]:
-            if not mask:
-                constraint_states.pop(i)
-            i += mask
+        unique_indices = _stable_partition(uniques_mask)
+        uniques_mask = uniques_mask.gather(1, unique_indices)
+        scores_buf, indices_buf, beams_buf, banks, cand_states = select(unique_indices)
+        num_uniques = uniques_mask.sum(dim=1, keepdim=True)
 
         # STEP 6: Assign IDs round-robin across banks, sort, and
         # truncate. Now that the candidates are sorted by (bank,
@@ -495,32 +467,33 @@ class LexicallyConstrainedBeamSearch(Search):
         #
         #             3 2 1 0 3 2 1 0 3 2 1 2
         #
-        # We'll take the top {beam_size} of these.
-        stripe_offsets = [offset * (len(banks) + 1) for offset in range(len(banks) + 1)]
-        stripes = torch.zeros_like(banks)
-        cur_bank_count = -1
-        cur_bank = banks[0]
-        for i, bank in enumerate(banks):
-            if bank != cur_bank:
-                cur_bank_count = 0
-                cur_bank = bank
-            else:
-                cur_bank_count += 1
-            stripes[i] = num_constraint_tokens - bank + stripe_offsets[cur_bank_count]
+        # We'll take the top {beam_size} of these. The old stripe of a
+        # candidate is its distance to the start of its run of equal banks.
+        positions = torch.arange(banks.size(1), device=device).unsqueeze(0)
+        run_starts = torch.cat(
+            (torch.ones_like(uniques_mask[:, :1]), banks[:, 1:] != banks[:, :-1]),
+            dim=1,
+        )
+        run_starts = torch.where(
+            run_starts, positions, torch.zeros_like(positions)
+        ).cummax(dim=1)[0]
+        stripes = (
+            num_constraint_tokens
+            - banks
+            + (positions - run_starts) * (num_uniques + 1)
+        )
 
-        # STEP 7: Sort by the stripes values
-        sort_values, sort_indices = stripes.sort(dim=0)
-        scores_buf = scores_buf[sort_indices]
-        indices_buf = indices_buf[sort_indices]
-        beams_buf = beams_buf[sort_indices]
-        constraint_states = [constraint_states[i] for i in sort_indices]
+        # STEP 7: Sort by the stripes values, the unused slots last and ties
+        # in candidate order
+        stripes = torch.where(uniques_mask, stripes, stripes.max() + 1)
+        sort_indices = (stripes * banks.size(1) + positions).sort(dim=1)[1]
 
         # STEP 8: Truncate to the candidates size!
-        scores_buf = scores_buf[: self.num_cands]
-        indices_buf = indices_buf[: self.num_cands]
-        beams_buf = beams_buf[: self.num_cands]
+        sort_indices = sort_indices[:, : self.num_cands]
+        scores_buf, indices_buf, beams_buf, _, cand_states = select(sort_indices)
+        self.constraint_states = cand_states
 
-        return scores_buf, indices_buf, beams_buf, constraint_states
+        return scores_buf, indices_buf, beams_buf
 
 
 class LengthConstrainedBeamSearch(Search):
@@ -39,6 +39,7 @@ class SequenceGenerator(nn.Module):
         lm_model=None,
         lm_weight=1.0,
         tokens_to_suppress=(),
+        encoder_cache=None,
     ):
         """Generates translations of a given source sentence.
 
@@ -63,6 +64,8 @@ class SequenceGenerator(nn.Module):
                 sharper samples (default: 1.0)
             match_source_len (bool, optional): outputs should match the source
                 length (default: False)
+            encoder_cache (~fairseq.encoder_cache.EncoderOutputCache, optional):
+                reuse the encoder outputs of the sources seen before
         """
         super().__init__()
         if isinstance(models, EnsembleModel):
@@ -124,6 +127,7 @@ class SequenceGenerator(nn.Module):
         )
 
         self.model.eval()
+        self.encoder_cache = encoder_cache
 
         self.lm_model = lm_model
         self.lm_weight = lm_weight
@@ -269,9 +273,17 @@ class SequenceGenerator(nn.Module):
         assert (
             self.min_len <= max_len
         ), "min_len cannot be larger than max_len, please adjust these!"
+        if not torch.jit.is_scripting():
+            # one extra step for EOS marker
+            self.model.set_decoder_kv_cache_size(max_len + 1)
         # compute the encoder output for each beam
         with torch.autograd.profiler.record_function("EnsembleModel: forward_encoder"):
-            encoder_outs = self.model.forward_encoder(net_input)
+            if self.encoder_cache is not None and not torch.jit.is_scripting():
+                encoder_outs = self.encoder_cache.forward_encoder(
+                    self.model.models, net_input
+                )
+            else:
+                encoder_outs = self.model.forward_encoder(net_input)
 
         # placeholder of indices for bsz * beam_size to hold tokens and accumulative scores
         new_order = torch.arange(bsz).view(-1, 1).repeat(1, beam_size).view(-1)
@@ -794,6 +806,14 @@ class EnsembleModel(nn.Module):
                 if hasattr(model, "set_beam_size"):
                     model.set_beam_size(beam_size)
 
+    def set_decoder_kv_cache_size(self, kv_cache_size):
+        """Preallocate the decoder key/value caches for *kv_cache_size*
+        decoding steps."""
+        for model in self.models:
+            decoder = getattr(model, "decoder", None)
+            if hasattr(decoder, "set_kv_cache_size"):
+                decoder.set_kv_cache_size(kv_cache_size)
+
     @torch.jit.export
     def forward_encoder(self, net_input: Dict[str, Tensor]):
         if not self.has_encoder():
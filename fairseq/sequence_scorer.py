@@ -19,6 +19,7 @@ class SequenceScorer(object):
         compute_alignment=False,
         eos=None,
         symbols_to_strip_from_output=None,
+        encoder_cache=None,
     ):
         self.pad = tgt_dict.pad()
         self.eos = tgt_dict.eos() if eos is None else eos
@@ -30,6 +31,7 @@ class SequenceScorer(object):
             if symbols_to_strip_from_output is not None
             else {self.eos}
         )
+        self.encoder_cache = encoder_cache
 
     @torch.no_grad()
     def generate(self, models, sample, **kwargs):
@@ -65,7 +67,15 @@ class SequenceScorer(object):
         avg_attn = None
         for model in models:
             model.eval()
-            decoder_out = model(**net_input)
+            if self.encoder_cache is not None and hasattr(model, "encoder"):
+                encoder_out = self.encoder_cache.forward_encoder([model], net_input)
+                decoder_out = model.decoder(
+                    net_input["prev_output_tokens"],
+                    encoder_out=encoder_out[0],
+                    src_lengths=net_input["src_lengths"],
+                )
+            else:
+                decoder_out = model(**net_input)
             attn = decoder_out[1] if len(decoder_out) > 1 else None
             if type(attn) is dict:
                 attn = attn.get("attn", None)
@@ -3,6 +3,7 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import hashlib
 import logging
 import os
 import warnings
@@ -204,6 +205,19 @@ class FairseqTask(object):
         # ``FairseqDataset`` due to the base implementation there.
         return getattr(dataset, "can_reuse_epoch_itr_across_epochs", False)
 
+    def batch_plan_cache_dir(self):
+        """Directory where :func:`get_batch_iterator` keeps the batches of the
+        datasets, or None not to cache them."""
+        return None
+
+    def _batch_plan_path(self, dataset, **params):
+        cache_dir = self.batch_plan_cache_dir()
+        if cache_dir is None or not self.can_reuse_epoch_itr(dataset):
+            return None
+        h = hashlib.sha1(data_utils.dataset_fingerprint(dataset).encode("utf-8"))
+        h.update(repr(sorted(params.items())).encode("utf-8"))
+        return os.path.join(cache_dir, h.hexdigest())
+
     def get_batch_iterator(
         self,
         dataset,
@@ -281,23 +295,48 @@ class FairseqTask(object):
         # initialize the dataset with the correct starting epoch
         dataset.set_epoch(epoch)
 
-        # get indices ordered by example size
-        with data_utils.numpy_seed(seed):
-            indices = dataset.ordered_indices()
+        # the batches only depend on the data and on these parameters, so
+        # they are kept on disk and memory-mapped by the next runs (unless
+        # the dataset is batched once, e.g. a window of fairseq-generate)
+        batch_plan_path = None
+        if not disable_iterator_cache:
+            batch_plan_path = self._batch_plan_path(
+                dataset,
+                max_tokens=max_tokens,
+                max_sentences=max_sentences,
+                max_positions=max_positions,
+                ignore_invalid_inputs=ignore_invalid_inputs,
+                required_batch_size_multiple=required_batch_size_multiple,
+                seed=seed,
+            )
+        if batch_plan_path is not None and all(
+            os.path.exists(f) for f in iterators.BatchPlan.files(batch_plan_path)
+        ):
+            logger.info("loading the batches from {}".format(batch_plan_path))
+            batch_sampler = iterators.BatchPlan.load(batch_plan_path)
+        else:
+            # get indices ordered by example size
+            with data_utils.numpy_seed(seed):
+                indices = dataset.ordered_indices()
+
+            # filter examples that are too large
+            if max_positions is not None:
+                indices = self.filter_indices_by_size(
+                    indices, dataset, max_positions, ignore_invalid_inputs
+                )
 
-        # filter examples that are too large
-        if max_positions is not None:
-            indices = self.filter_indices_by_size(
-                indices, dataset, max_positions, ignore_invalid_inputs
+            # create mini-batches with given size constraints
+            batch_sampler = dataset.batch_by_size(
+                indices,
+                max_tokens=max_tokens,
+                max_sentences=max_sentences,
+                required_batch_size_multiple=required_batch_size_multiple,
             )
 
-        # create mini-batches with given size constraints
-        batch_sampler = dataset.batch_by_size(
-            indices,
-            max_tokens=max_tokens,
-            max_sentences=max_sentences,
-            required_batch_size_multiple=required_batch_size_multiple,
-        )
+            if batch_plan_path is not None:
+                batch_sampler = iterators.BatchPlan.from_batches(batch_sampler)
+                os.makedirs(os.path.dirname(batch_plan_path), exist_ok=True)
+                batch_sampler.save(batch_plan_path)
 
         reuse_dataloader = getattr(self.cfg, "reuse_dataloader", True)
         persistent_workers = getattr(self.cfg, "persistent_workers", False)
@@ -388,12 +427,23 @@ class FairseqTask(object):
                 (https://arxiv.org/abs/2010.00904) and
                 https://github.com/facebookresearch/GENRE.
         """
+        encoder_cache = None
+        if getattr(args, "encoder_cache_size", 0) > 0:
+            from fairseq.encoder_cache import EncoderOutputCache
+
+            encoder_cache = EncoderOutputCache(
+                self.source_dictionary.pad(),
+                args.encoder_cache_size,
+                cache_dir=getattr(args, "encoder_cache_dir", None),
+            )
+
         if getattr(args, "score_reference", False):
             from fairseq.sequence_scorer import SequenceScorer
 
             return SequenceScorer(
                 self.target_dictionary,
                 compute_alignment=getattr(args, "print_alignment", False),
+                encoder_cache=encoder_cache,
             )
 
         from fairseq.sequence_generator import (
@@ -463,6 +513,8 @@ class FairseqTask(object):
             search_strategy = search.BeamSearch(self.target_dictionary)
 
         extra_gen_cls_kwargs = extra_gen_cls_kwargs or {}
+        if encoder_cache is not None:
+            extra_gen_cls_kwargs["encoder_cache"] = encoder_cache
         if seq_gen_cls is None:
             if getattr(args, "print_alignment", False):
                 seq_gen_cls = SequenceGeneratorWithAlignment
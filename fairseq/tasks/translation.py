@@ -4,6 +4,7 @@
 # LICENSE file in the root directory of this source tree.
 
 from dataclasses import dataclass, field
+import hashlib
 import itertools
 import json
 import logging
@@ -18,6 +19,9 @@ from fairseq.data import (
     AppendTokenDataset,
     ConcatDataset,
     LanguagePairDataset,
+    NoisedEvalDataset,
+    NoisedLanguagePairDataset,
+    NoiseVariantsDataset,
     PrependTokenDataset,
     StripTokenDataset,
     TruncateDataset,
@@ -26,7 +30,13 @@ from fairseq.data import (
     indexed_dataset,
 )
 from fairseq.data.indexed_dataset import get_available_dataset_impl
+from fairseq.data.noise_variants_dataset import (
+    noise_variants_prefix,
+    write_noise_variants,
+)
 from fairseq.dataclass import ChoiceEnum, FairseqDataclass
+from fairseq.optim.noise_curriculum import build_noise_curriculum
+from fairseq.scoring.cached_bleu import CachedCorpusBleu
 from fairseq.tasks import FairseqTask, register_task
 
 
@@ -58,6 +68,7 @@ def load_langpair_dataset(
     shuffle=True,
     pad_to_multiple=1,
     prepend_bos_src=None,
+    max_padding_ratio=None,
 ):
     def split_exists(split, src, tgt, lang, data_path):
         filename = os.path.join(data_path, "{}.{}-{}.{}".format(split, src, tgt, lang))
@@ -167,6 +178,7 @@ def load_langpair_dataset(
         num_buckets=num_buckets,
         shuffle=shuffle,
         pad_to_multiple=pad_to_multiple,
+        max_padding_ratio=max_padding_ratio,
     )
 
 
@@ -262,6 +274,52 @@ class TranslationConfig(FairseqDataclass):
     eval_bleu_print_samples: bool = field(
         default=False, metadata={"help": "print sample generations during validation"}
     )
+    eval_bleu_noise_types: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "comma separated noise types; also report the BLEU of fixed "
+            "noised copies of the validation source, as bleu_TYPE"
+        },
+    )
+    eval_bleu_noise_rate: float = field(
+        default=0.1, metadata={"help": "noise rate of the noised validation copies"}
+    )
+    eval_bleu_noise_seed: int = field(
+        default=64, metadata={"help": "noise seed of the noised validation copies"}
+    )
+    eval_bleu_noise_dir: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "where to binarize the noised validation copies "
+            "(default: next to the data)"
+        },
+    )
+    eval_bleu_async: bool = field(
+        default=False,
+        metadata={
+            "help": "decode the validation BLEU in a background process on a "
+            "snapshot of the weights, instead of blocking training"
+        },
+    )
+    eval_bleu_async_device: str = field(
+        default="cpu",
+        metadata={"help": "device of the background BLEU process, e.g. cuda:1"},
+    )
+    max_padding_ratio: Optional[float] = field(
+        default=None,
+        metadata={
+            "help": "if set, batch by source and target lengths jointly, with at "
+            "most this fraction of padded positions per batch (e.g. 0.1)"
+        },
+    )
+    batch_plan_cache: bool = field(
+        default=False,
+        metadata={
+            "help": "keep the batches of every split in DATA/batch-plans, keyed "
+            "by the data and the batching options, and memory-map them on the "
+            "next runs instead of batching again"
+        },
+    )
 
 
 @register_task("translation", dataclass=TranslationConfig)
@@ -285,6 +343,15 @@ class TranslationTask(FairseqTask):
         super().__init__(cfg)
         self.src_dict = src_dict
         self.tgt_dict = tgt_dict
+        # model args of an ISDST model noising its twin batch in the collater
+        self.noise_args = None
+        # shared by the Trainer, which steps it
+        self.noise_curriculum = None
+        # references of the validation BLEU, see CachedCorpusBleu
+        self._bleu_cache = None
+        # data path of the loaded train split, where --noise-from-variants
+        # looks for the precomputed variants
+        self._train_data_path = None
 
     @classmethod
     def setup_task(cls, cfg: TranslationConfig, **kwargs):
@@ -354,7 +421,143 @@ class TranslationTask(FairseqTask):
             num_buckets=self.cfg.num_batch_buckets,
             shuffle=(split != "test"),
             pad_to_multiple=self.cfg.required_seq_len_multiple,
+            max_padding_ratio=self.cfg.max_padding_ratio,
         )
+        if split == self.cfg.train_subset:
+            self._train_data_path = data_path
+        elif self.cfg.eval_bleu and self.cfg.eval_bleu_noise_types:
+            self._add_noised_eval_copies(split, data_path)
+        self._maybe_noise_dataset(split)
+
+    def _add_noised_eval_copies(self, split, data_path):
+        """Wrap a validation split with its noised copies, which are
+        binarized next to the data (or in ``--eval-bleu-noise-dir``) the first
+        time they are needed, and again whenever the source tokens or the
+        source dictionary they were made from change."""
+        dataset = self.datasets[split]
+        src, tgt = self.cfg.source_lang, self.cfg.target_lang
+        rate, seed = self.cfg.eval_bleu_noise_rate, self.cfg.eval_bleu_noise_seed
+        noise_dir = self.cfg.eval_bleu_noise_dir or data_path
+        fingerprint = self._noised_copy_fingerprint(dataset.src)
+        noised = []
+        for noise_type in self.cfg.eval_bleu_noise_types.split(","):
+            prefix = os.path.join(
+                noise_dir,
+                "{}.seed{}.{}-{}.{}".format(
+                    noise_variants_prefix(split, noise_type, rate), seed, src, tgt, src
+                ),
+            )
+            # the fingerprint of the source the copy was made from
+            fingerprint_path = prefix + ".fingerprint"
+            current = False
+            if indexed_dataset.MMapIndexedDataset.exists(prefix) and os.path.exists(
+                fingerprint_path
+            ):
+                with open(fingerprint_path) as f:
+                    current = f.read().strip() == fingerprint
+            if not current:
+                os.makedirs(noise_dir, exist_ok=True)
+                if not os.access(noise_dir, os.W_OK):
+                    raise PermissionError(
+                        "cannot binarize the {}-noised copy of {} in {}, which is "
+                        "not writable; set --eval-bleu-noise-dir to a writable "
+                        "directory".format(noise_type, split, noise_dir)
+                    )
+                logger.info(
+                    "binarizing {}-noised copy of {}: {}".format(noise_type, split, prefix)
+                )
+                write_noise_variants(
+                    dataset.src, self.src_dict, prefix, noise_type, rate, seed=seed
+                )
+                tmp_path = "{}.tmp{}".format(fingerprint_path, os.getpid())
+                with open(tmp_path, "w") as f:
+                    f.write(fingerprint + "\n")
+                os.replace(tmp_path, fingerprint_path)
+            noised.append(
+                (noise_type, data_utils.load_indexed_dataset(prefix, self.src_dict, "mmap"))
+            )
+        self.datasets[split] = NoisedEvalDataset(dataset, noised)
+
+    def _noised_copy_fingerprint(self, src):
+        """A hash of the source tokens a noised copy is made from and of the
+        words of the source dictionary they stand for."""
+        h = hashlib.sha1(data_utils.dataset_fingerprint(src).encode("utf-8"))
+        for i in range(len(src)):
+            h.update(src[i].long().numpy().tobytes())
+        h.update("\n".join(self.src_dict.symbols).encode("utf-8"))
+        return h.hexdigest()
+
+    def _maybe_noise_dataset(self, split):
+        if (
+            self.noise_args is None
+            or split != self.cfg.train_subset
+            or split not in self.datasets
+            or isinstance(
+                self.datasets[split], (NoisedLanguagePairDataset, NoiseVariantsDataset)
+            )
+        ):
+            return
+        noise_curriculum = self.noise_curriculum
+        if noise_curriculum is None:
+            noise_curriculum = build_noise_curriculum(None, self.noise_args)
+        if getattr(self.noise_args, "noise_from_variants", False):
+            self.datasets[split] = NoiseVariantsDataset(
+                self.datasets[split],
+                self._load_noise_variants(split),
+                self.noise_args,
+                noise_curriculum,
+            )
+        else:
+            self.datasets[split] = NoisedLanguagePairDataset(
+                self.datasets[split], self.noise_args, noise_curriculum
+            )
+
+    def _load_noise_variants(self, split):
+        rates = getattr(self.noise_args, "noise_variant_rates", None)
+        if rates is None:
+            rates = [self.noise_args.noise_rate]
+        else:
+            rates = [float(rate) for rate in rates.split(",")]
+        src, tgt = self.cfg.source_lang, self.cfg.target_lang
+        variants = {}
+        for rate in rates:
+            prefix = os.path.join(
+                self._train_data_path,
+                "{}.{}-{}.{}".format(
+                    noise_variants_prefix(split, self.noise_args.noise_type, rate),
+                    src,
+                    tgt,
+                    src,
+                ),
+            )
+            variants[rate] = data_utils.load_indexed_dataset(
+                prefix, self.src_dict, self.cfg.dataset_impl
+            )
+            if variants[rate] is None:
+                raise FileNotFoundError(
+                    "Noise variants not found: {} (binarize them with "
+                    "fairseq-preprocess --noise-variants)".format(prefix)
+                )
+            logger.info(
+                "{} {} noise variants at rate {:g}: {}".format(
+                    len(variants[rate]), self.noise_args.noise_type, rate, prefix
+                )
+            )
+        return variants
+
+    def set_noise_curriculum(self, noise_curriculum):
+        """Noise the train split with the Trainer's noise curriculum."""
+        self.noise_curriculum = noise_curriculum
+        self.refresh_noised_dataset()
+
+    def refresh_noised_dataset(self):
+        """Re-read the noise options after they changed, e.g. between the
+        stages of ``fairseq-isdst-train``."""
+        split = self.cfg.train_subset
+        dataset = self.datasets.get(split, None)
+        if isinstance(dataset, (NoisedLanguagePairDataset, NoiseVariantsDataset)):
+            self.datasets[split] = dataset.dataset
+            self._maybe_noise_dataset(split)
 
     def build_dataset_for_inference(self, src_tokens, src_lengths, constraints=None):
         return LanguagePairDataset(
@@ -367,6 +570,12 @@ class TranslationTask(FairseqTask):
 
     def build_model(self, cfg, from_checkpoint=False):
         model = super().build_model(cfg, from_checkpoint)
+        if getattr(cfg, "add_noise", False) and (
+            getattr(cfg, "noise_in_dataloader", False)
+            or getattr(cfg, "noise_from_variants", False)
+        ):
+            self.noise_args = cfg
+            self._maybe_noise_dataset(self.cfg.train_subset)
         if self.cfg.eval_bleu:
             detok_args = json.loads(self.cfg.eval_bleu_detok_args)
             self.tokenizer = encoders.build_tokenizer(
@@ -379,72 +588,144 @@ class TranslationTask(FairseqTask):
             )
         return model
 
+    def train_step(
+        self, sample, model, criterion, optimizer, update_num, ignore_grad=False
+    ):
+        dataset = self.datasets.get(self.cfg.train_subset, None)
+        if isinstance(dataset, (NoisedLanguagePairDataset, NoiseVariantsDataset)):
+            # read by the DataLoader workers collating upcoming batches
+            dataset.set_num_updates(update_num)
+        loss, sample_size, logging_output = super().train_step(
+            sample, model, criterion, optimizer, update_num, ignore_grad
+        )
+        if not ignore_grad and "net_input" in sample:
+            logging_output.update(self._padding_stats(sample))
+        return loss, sample_size, logging_output
+
+    def _padding_stats(self, sample):
+        """The number of real tokens and of padded positions of the source
+        (both halves of the ISDST twin source, if any) and target of
+        *sample*, for the padding efficiency metric. The number of real
+        tokens is left on the device of *sample*, so that it does not wait
+        for the GPU; it is only read when the metrics are reduced."""
+        net_input = sample["net_input"]
+        num_real = net_input["src_lengths"].sum()
+        num_padded = net_input["src_tokens"].numel()
+        if "robust_src_tokens" in sample:
+            num_real = num_real + sample["robust_src_lengths"].sum()
+            num_padded += sample["robust_src_tokens"].numel()
+        if sample.get("target", None) is not None:
+            num_real = num_real + sample["target"].ne(self.tgt_dict.pad()).sum()
+            num_padded += sample["target"].numel()
+        return {"real_tokens": num_real, "padded_tokens": num_padded}
+
     def valid_step(self, sample, model, criterion):
         loss, sample_size, logging_output = super().valid_step(sample, model, criterion)
-        if self.cfg.eval_bleu:
-            bleu = self._inference_with_bleu(self.sequence_generator, sample, model)
-            logging_output["_bleu_sys_len"] = bleu.sys_len
-            logging_output["_bleu_ref_len"] = bleu.ref_len
+        if self.cfg.eval_bleu and not self.cfg.eval_bleu_async:
+            logging_output.update(self.valid_bleu_step(sample, model))
+        return loss, sample_size, logging_output
+
+    def valid_bleu_step(self, sample, model):
+        """Decode a validation batch and return its BLEU statistics as
+        logging outputs, see :func:`reduce_bleu_metrics`."""
+        if "eval_net_input" in sample:
+            bleus = self._inference_with_noised_bleu(
+                self.sequence_generator, sample, model
+            )
+        else:
+            bleus = {
+                "bleu": self._inference_with_bleu(self.sequence_generator, sample, model)
+            }
+        logging_output = {}
+        for name, bleu in bleus.items():
+            logging_output["_" + name + "_sys_len"] = bleu.sys_len
+            logging_output["_" + name + "_ref_len"] = bleu.ref_len
             # we split counts into separate entries so that they can be
             # summed efficiently across workers using fast-stat-sync
             assert len(bleu.counts) == EVAL_BLEU_ORDER
             for i in range(EVAL_BLEU_ORDER):
-                logging_output["_bleu_counts_" + str(i)] = bleu.counts[i]
-                logging_output["_bleu_totals_" + str(i)] = bleu.totals[i]
-        return loss, sample_size, logging_output
+                logging_output["_" + name + "_counts_" + str(i)] = bleu.counts[i]
+                logging_output["_" + name + "_totals_" + str(i)] = bleu.totals[i]
+        return logging_output
 
     def reduce_metrics(self, logging_outputs, criterion):
         super().reduce_metrics(logging_outputs, criterion)
-        if self.cfg.eval_bleu:
+        num_padded = sum(log.get("padded_tokens", 0) for log in logging_outputs)
+        if num_padded > 0:
+            num_real = utils.item(
+                sum(log.get("real_tokens", 0) for log in logging_outputs)
+            )
+            # real tokens / padded positions, over the epoch
+            metrics.log_scalar("pad_eff", num_real / num_padded, num_padded, round=3)
+        if self.cfg.eval_bleu and not self.cfg.eval_bleu_async:
+            self.reduce_bleu_metrics(logging_outputs)
 
-            def sum_logs(key):
-                import torch
+    def reduce_bleu_metrics(self, logging_outputs):
+        """Log the BLEU metrics (*bleu* and *bleu_TYPE* for the noised
+        validation copies) of :func:`valid_bleu_step` logging outputs."""
 
-                result = sum(log.get(key, 0) for log in logging_outputs)
-                if torch.is_tensor(result):
-                    result = result.cpu()
-                return result
+        def sum_logs(key):
+            import torch
 
+            result = sum(log.get(key, 0) for log in logging_outputs)
+            if torch.is_tensor(result):
+                result = result.cpu()
+            return result
+
+        def log_bleu(name):
+            key = "_" + name
             counts, totals = [], []
             for i in range(EVAL_BLEU_ORDER):
-                counts.append(sum_logs("_bleu_counts_" + str(i)))
-                totals.append(sum_logs("_bleu_totals_" + str(i)))
-
-            if max(totals) > 0:
-                # log counts as numpy arrays -- log_scalar will sum them correctly
-                metrics.log_scalar("_bleu_counts", np.array(counts))
-                metrics.log_scalar("_bleu_totals", np.array(totals))
-                metrics.log_scalar("_bleu_sys_len", sum_logs("_bleu_sys_len"))
-                metrics.log_scalar("_bleu_ref_len", sum_logs("_bleu_ref_len"))
-
-                def compute_bleu(meters):
-                    import inspect
-
-                    try:
-                        from sacrebleu.metrics import BLEU
-
-                        comp_bleu = BLEU.compute_bleu
-                    except ImportError:
-                        # compatibility API for sacrebleu 1.x
-                        import sacrebleu
-
-                        comp_bleu = sacrebleu.compute_bleu
-
-                    fn_sig = inspect.getfullargspec(comp_bleu)[0]
-                    if "smooth_method" in fn_sig:
-                        smooth = {"smooth_method": "exp"}
-                    else:
-                        smooth = {"smooth": "exp"}
-                    bleu = comp_bleu(
-                        correct=meters["_bleu_counts"].sum,
-                        total=meters["_bleu_totals"].sum,
-                        sys_len=int(meters["_bleu_sys_len"].sum),
-                        ref_len=int(meters["_bleu_ref_len"].sum),
-                        **smooth,
-                    )
-                    return round(bleu.score, 2)
+                counts.append(sum_logs(key + "_counts_" + str(i)))
+                totals.append(sum_logs(key + "_totals_" + str(i)))
+            if max(totals) == 0:
+                return
+
+            # log counts as numpy arrays -- log_scalar will sum them correctly
+            metrics.log_scalar(key + "_counts", np.array(counts))
+            metrics.log_scalar(key + "_totals", np.array(totals))
+            metrics.log_scalar(key + "_sys_len", sum_logs(key + "_sys_len"))
+            metrics.log_scalar(key + "_ref_len", sum_logs(key + "_ref_len"))
+
+            def compute_bleu(meters):
+                import inspect
+
+                try:
+                    from sacrebleu.metrics import BLEU
+
+                    comp_bleu = BLEU.compute_bleu
+                except ImportError:
+                    # compatibility API for sacrebleu 1.x
+                    import sacrebleu
+
+                    comp_bleu = sacrebleu.compute_bleu
+
+                fn_sig = inspect.getfullargspec(comp_bleu)[0]
+                if "smooth_method" in fn_sig:
+                    smooth = {"smooth_method": "exp"}
+                else:
+                    smooth = {"smooth": "exp"}
+                bleu = comp_bleu(
+                    correct=meters[key + "_counts"].sum,
+                    total=meters[key + "_totals"].sum,
+                    sys_len=int(meters[key + "_sys_len"].sum),
+                    ref_len=int(meters[key + "_ref_len"].sum),
+                    **smooth,
+                )
+                return round(bleu.score, 2)
+
+            metrics.log_derived(name, compute_bleu)
 
-                metrics.log_derived("bleu", compute_bleu)
+        log_bleu("bleu")
+        if self.cfg.eval_bleu_noise_types:
+            for noise_type in self.cfg.eval_bleu_noise_types.split(","):
+                log_bleu("bleu_" + noise_type)
+
+    def batch_plan_cache_dir(self):
+        if not self.cfg.batch_plan_cache:
+            return None
+        # next to the binarized data (of all the splits)
+        return os.path.join(utils.split_paths(self.cfg.data)[0], "batch-plans")
 
     def max_positions(self):
         """Return the max sentence length allowed by the task."""
@@ -461,8 +742,40 @@ class TranslationTask(FairseqTask):
         return self.tgt_dict
 
     def _inference_with_bleu(self, generator, sample, model):
-        import sacrebleu
+        hyps, refs = self._inference(generator, sample, model)
+        if self.cfg.eval_bleu_print_samples:
+            logger.info("example hypothesis: " + hyps[0])
+            logger.info("example reference: " + refs[0].string)
+        return self._corpus_bleu(hyps, refs)
+
+    def _inference_with_noised_bleu(self, generator, sample, model):
+        """BLEU of the clean and of every noised source of a
+        :class:`~fairseq.data.NoisedEvalDataset` batch, decoded as a single
+        batch."""
+        noise_types = sample["eval_noise_types"]
+        eval_sample = {
+            "id": sample["id"].repeat(len(noise_types) + 1),
+            "net_input": sample["eval_net_input"],
+            "target": sample["target"].repeat(len(noise_types) + 1, 1),
+        }
+        hyps, refs = self._inference(generator, eval_sample, model)
+        bsz = sample["target"].size(0)
+        names = ["bleu"] + ["bleu_" + noise_type for noise_type in noise_types]
+        bleus = {}
+        for k, name in enumerate(names):
+            bleus[name] = self._corpus_bleu(
+                hyps[k * bsz : (k + 1) * bsz], refs[k * bsz : (k + 1) * bsz]
+            )
+        if self.cfg.eval_bleu_print_samples:
+            logger.info("example reference: " + refs[0].string)
+            for k, name in enumerate(names):
+                logger.info("example hypothesis ({}): {}".format(name, hyps[k * bsz]))
+        return bleus
+
+    def _corpus_bleu(self, hyps, refs):
+        return self._bleu_cache.corpus_bleu(hyps, refs)
 
+    def _inference(self, generator, sample, model):
         def decode(toks, escape_unk=False):
             s = self.tgt_dict.string(
                 toks.int().cpu(),
@@ -478,20 +791,25 @@ class TranslationTask(FairseqTask):
                 s = self.tokenizer.decode(s)
             return s
 
+        if self._bleu_cache is None:
+            self._bleu_cache = CachedCorpusBleu(
+                tokenize="none" if self.cfg.eval_tokenized_bleu else "13a"
+            )
         gen_out = self.inference_step(generator, [model], sample, prefix_tokens=None)
         hyps, refs = [], []
+        targets = sample["target"].cpu()
         for i in range(len(gen_out)):
             hyps.append(decode(gen_out[i][0]["tokens"]))
+            # references only change with the validation set, so they are
+            # detokenized and counted once
+            target = utils.strip_pad(targets[i], self.tgt_dict.pad())
             refs.append(
-                decode(
-                    utils.strip_pad(sample["target"][i], self.tgt_dict.pad()),
-                    escape_unk=True,  # don't count <unk> as matches to the hypo
+                self._bleu_cache.reference(
+                    tuple(target.tolist()),
+                    lambda: decode(
+                        target,
+                        escape_unk=True,  # don't count <unk> as matches to the hypo
+                    ),
                 )
             )
-        if self.cfg.eval_bleu_print_samples:
-            logger.info("example hypothesis: " + hyps[0])
-            logger.info("example reference: " + refs[0])
-        if self.cfg.eval_tokenized_bleu:
-            return sacrebleu.corpus_bleu(hyps, [refs], tokenize="none")
-        else:
-            return sacrebleu.corpus_bleu(hyps, [refs])
+        return hyps, refs
@@ -504,3 +504,276 @@ class OrderedConstraintState(ConstraintState):
             next_state = OrderedConstraintState(self.sequence, -1)
 
         return next_state
+
+
+class ConstraintTable:
+    """Array-backed constraints of a batch of sentences, kept on the device of
+    the packed constraints. The constraint state of each beam item is a row of
+    integers, so that the states of a batch are a single (batch size, beam
+    size, state size) tensor that is advanced for all candidates at once. The
+    transitions, banks and finished states are the same as those of the
+    ConstraintState classes above.
+    """
+
+    # the number of constraint tokens of each sentence, as counted by the
+    # ConstraintState classes, which sets the sort key of the banks
+    num_tokens: torch.Tensor
+
+    def init_states(self, beam_size: int) -> torch.Tensor:
+        """The root states, (batch size, beam size, state size)."""
+        raise NotImplementedError
+
+    def prune(self, batch_idxs: torch.Tensor):
+        """Keeps the constraints of the sentences *batch_idxs* only."""
+        raise NotImplementedError
+
+    def advance(self, states: torch.Tensor, tokens: torch.Tensor) -> torch.Tensor:
+        """The states after reading *tokens* (batch size, num states)."""
+        raise NotImplementedError
+
+    def banks(self, states: torch.Tensor) -> torch.Tensor:
+        raise NotImplementedError
+
+    def finished(self, states: torch.Tensor) -> torch.Tensor:
+        raise NotImplementedError
+
+    def next_tokens(self, states: torch.Tensor) -> torch.Tensor:
+        """The tokens that could come next, (batch size, num states, width),
+        padded with -1. A token may be listed more than once."""
+        raise NotImplementedError
+
+
+class UnorderedConstraintTable(ConstraintTable):
+    """The ConstraintNode tries of a batch, as arrays indexed by sentence and
+    integer node id, the root being node 0. Transitions are a dense table of
+    the (token, node id) of each child slot of each node, padded with
+    (-1, 0). A state is [node id, generated count of each node, completed
+    count of each node], i.e. an UnorderedConstraintState.
+    """
+
+    def __init__(self, batch_constraints: torch.Tensor):
+        constraint_lists = [unpack_constraints(c) for c in batch_constraints.cpu()]
+        tries = []
+        for constraints in constraint_lists:
+            nodes = [ConstraintNode.create(constraints)]
+            for node in nodes:  # breadth first
+                nodes.extend(node.children.values())
+            tries.append(nodes)
+        self.num_nodes = max(len(nodes) for nodes in tries)
+        self.max_depth = max(
+            [c.size(0) for constraints in constraint_lists for c in constraints],
+            default=0,
+        )
+        num_slots = max(
+            [len(node.children) for nodes in tries for node in nodes], default=0
+        )
+        num_slots = max(num_slots, 1)
+
+        parent, terminal, num_constraints = [], [], []
+        child_tokens, child_nodes, num_tokens = [], [], []
+        for nodes in tries:
+            ids = {node: i for i, node in enumerate(nodes)}
+            padding = [0] * (self.num_nodes - len(nodes))
+            parent.append(
+                [ids[n.parent] if n.parent is not None else 0 for n in nodes] + padding
+            )
+            terminal.append([n.terminal for n in nodes] + padding)
+            num_constraints.append([n.num_constraints for n in nodes] + padding)
+            tokens = [[-1] * num_slots for _ in range(self.num_nodes)]
+            children = [[0] * num_slots for _ in range(self.num_nodes)]
+            for i, node in enumerate(nodes):
+                for slot, child in enumerate(node.children.values()):
+                    tokens[i][slot] = child.token
+                    children[i][slot] = ids[child]
+            child_tokens.append(tokens)
+            child_nodes.append(children)
+            num_tokens.append(len(nodes[0].tokens()))
+
+        device = batch_constraints.device
+        self.parent = torch.tensor(parent, dtype=torch.long, device=device)
+        self.terminal = torch.tensor(terminal, dtype=torch.long, device=device)
+        self.num_constraints = torch.tensor(
+            num_constraints, dtype=torch.long, device=device
+        )
+        self.child_tokens = torch.tensor(child_tokens, dtype=torch.long, device=device)
+        self.child_nodes = torch.tensor(child_nodes, dtype=torch.long, device=device)
+        self.num_tokens = torch.tensor(num_tokens, dtype=torch.long, device=device)
+
+    def init_states(self, beam_size: int) -> torch.Tensor:
+        return self.parent.new_zeros(
+            self.parent.size(0), beam_size, 1 + 2 * self.num_nodes
+        )
+
+    def prune(self, batch_idxs: torch.Tensor):
+        self.parent = self.parent.index_select(0, batch_idxs)
+        self.terminal = self.terminal.index_select(0, batch_idxs)
+        self.num_constraints = self.num_constraints.index_select(0, batch_idxs)
+        self.child_tokens = self.child_tokens.index_select(0, batch_idxs)
+        self.child_nodes = self.child_nodes.index_select(0, batch_idxs)
+        self.num_tokens = self.num_tokens.index_select(0, batch_idxs)
+
+    def _split(self, states: torch.Tensor):
+        node = states[:, :, 0]
+        generated = states[:, :, 1 : 1 + self.num_nodes]
+        completed = states[:, :, 1 + self.num_nodes :]
+        return node, generated, completed
+
+    @staticmethod
+    def _count(counts: torch.Tensor, node: torch.Tensor) -> torch.Tensor:
+        return counts.gather(2, node.unsqueeze(-1)).squeeze(-1)
+
+    def _child(self, node: torch.Tensor, tokens: torch.Tensor) -> torch.Tensor:
+        """The child of *node* labeled with *tokens*, 0 if there is none."""
+        index = node.unsqueeze(-1).expand(-1, -1, self.child_tokens.size(2))
+        match = self.child_tokens.gather(1, index).eq(tokens.unsqueeze(-1))
+        return (self.child_nodes.gather(1, index) * match).sum(dim=-1)
+
+    def advance(self, states: torch.Tensor, tokens: torch.Tensor) -> torch.Tensor:
+        """See UnorderedConstraintState.advance()."""
+        node, generated, completed = self._split(states)
+
+        # advance from the current node if the child is not saturated...
+        child = self._child(node, tokens)
+        can_advance = child.ne(0) & self._count(generated, child).lt(
+            self.num_constraints.gather(1, child)
+        )
+        # ...or fall off the graph and try again from the root
+        root_child = self._child(torch.zeros_like(node), tokens)
+        can_restart = root_child.ne(0) & self._count(generated, root_child).lt(
+            self.num_constraints.gather(1, root_child)
+        )
+        next_node = torch.where(
+            can_advance,
+            child,
+            torch.where(can_restart, root_child, torch.zeros_like(child)),
+        )
+        next_generated = generated.scatter_add(
+            2, next_node.unsqueeze(-1), next_node.ne(0).long().unsqueeze(-1)
+        )
+        next_completed = completed.clone()
+
+        # when falling off, rewind from the current node to the root: complete
+        # the deepest constraint on the path that can be, and ungenerate the
+        # nodes below it
+        rewind = ~can_advance & node.ne(0)
+        for _ in range(self.max_depth):
+            terminal = self.terminal.gather(1, node)
+            complete = (
+                rewind & terminal.gt(0) & self._count(completed, node).lt(terminal)
+            )
+            ungenerate = rewind & ~complete
+            next_completed.scatter_add_(
+                2, node.unsqueeze(-1), complete.long().unsqueeze(-1)
+            )
+            next_generated.scatter_add_(
+                2, node.unsqueeze(-1), -ungenerate.long().unsqueeze(-1)
+            )
+            node = self.parent.gather(1, node)
+            rewind = ungenerate & node.ne(0)
+
+        return torch.cat(
+            (next_node.unsqueeze(-1), next_generated, next_completed), dim=2
+        )
+
+    def banks(self, states: torch.Tensor) -> torch.Tensor:
+        _, generated, _ = self._split(states)
+        return generated.sum(dim=2)
+
+    def finished(self, states: torch.Tensor) -> torch.Tensor:
+        node, _, completed = self._split(states)
+        terminal = self.terminal.gather(1, node)
+        in_final = terminal.gt(0) & self._count(completed, node).lt(terminal)
+        num_completed = completed.sum(dim=2) + in_final.long()
+        return num_completed.eq(self.num_constraints[:, :1])
+
+    def next_tokens(self, states: torch.Tensor) -> torch.Tensor:
+        node = states[:, :, 0]
+        index = node.unsqueeze(-1).expand(-1, -1, self.child_tokens.size(2))
+        root_tokens = self.child_tokens[:, :1].expand_as(index)
+        node_tokens = self.child_tokens.gather(1, index)
+        in_root = node_tokens.unsqueeze(-1).eq(root_tokens.unsqueeze(-2)).any(dim=-1)
+        node_tokens = node_tokens.masked_fill(in_root | node.eq(0).unsqueeze(-1), -1)
+        return torch.cat((root_tokens, node_tokens), dim=2)
+
+
+class OrderedConstraintTable(ConstraintTable):
+    """The ConstraintSequences of a batch, as a padded (batch size, length)
+    array of tokens and of endpoints. A state is [index of the last generated
+    token, -1 at the root], i.e. an OrderedConstraintState.
+    """
+
+    def __init__(self, batch_constraints: torch.Tensor):
+        sequences = [
+            [int(t) for c in unpack_constraints(constraints) for t in c.tolist()]
+            for constraints in batch_constraints.cpu()
+        ]
+        endpoints = [
+            [
+                i == c.size(0) - 1
+                for c in unpack_constraints(constraints)
+                for i in range(c.size(0))
+            ]
+            for constraints in batch_constraints.cpu()
+        ]
+        max_len = max([len(s) for s in sequences] + [1])
+        device = batch_constraints.device
+        self.tokens = torch.tensor(
+            [s + [-1] * (max_len - len(s)) for s in sequences],
+            dtype=torch.long,
+            device=device,
+        )
+        self.endpoints = torch.tensor(
+            [e + [False] * (max_len - len(e)) for e in endpoints],
+            dtype=torch.bool,
+            device=device,
+        )
+        self.length = torch.tensor(
+            [len(s) for s in sequences], dtype=torch.long, device=device
+        )
+        # ConstraintSequence.tokens is a set of 0-d tensors, which are hashed
+        # by identity: every constraint token counts
+        self.num_tokens = self.length
+
+    def init_states(self, beam_size: int) -> torch.Tensor:
+        return self.tokens.new_full((self.tokens.size(0), beam_size, 1), -1)
+
+    def prune(self, batch_idxs: torch.Tensor):
+        self.tokens = self.tokens.index_select(0, batch_idxs)
+        self.endpoints = self.endpoints.index_select(0, batch_idxs)
+        self.length = self.length.index_select(0, batch_idxs)
+        self.num_tokens = self.length
+
+    def _next_token(self, state: torch.Tensor) -> torch.Tensor:
+        return self.tokens.gather(1, (state + 1).clamp(max=self.tokens.size(1) - 1))
+
+    def advance(self, states: torch.Tensor, tokens: torch.Tensor) -> torch.Tensor:
+        """See OrderedConstraintState.advance()."""
+        state = states[:, :, 0]
+        length = self.length.unsqueeze(1)
+        # sequence.endpoints[-1] at the root
+        endpoint = self.endpoints.gather(
+            1, torch.where(state.ge(0), state, length - 1).clamp(min=0)
+        )
+        next_state = torch.where(
+            tokens.eq(self.tokens[:, :1]),
+            torch.zeros_like(state),
+            torch.full_like(state, -1),
+        )
+        next_state = torch.where(endpoint, state, next_state)
+        next_state = torch.where(
+            tokens.eq(self._next_token(state)), state + 1, next_state
+        )
+        next_state = torch.where(self.finished(states), state, next_state)
+        return next_state.unsqueeze(-1)
+
+    def banks(self, states: torch.Tensor) -> torch.Tensor:
+        return states[:, :, 0] + 1
+
+    def finished(self, states: torch.Tensor) -> torch.Tensor:
+        return (states[:, :, 0] + 1).eq(self.length.unsqueeze(1))
+
+    def next_tokens(self, states: torch.Tensor) -> torch.Tensor:
+        state = states[:, :, 0]
+        first = self.tokens[:, :1].expand_as(state).masked_fill(state.le(0), -1)
+        next_token = self._next_token(state).masked_fill(self.finished(states), -1)
+        return torch.stack((first, next_token), dim=2)
@@ -27,7 +27,7 @@ from fairseq.file_io import PathManager
 from fairseq.logging import meters, metrics
 from fairseq.models.ema import build_ema
 from fairseq.nan_detector import NanDetector
-from fairseq.optim import lr_scheduler
+from fairseq.optim import lr_scheduler, noise_curriculum
 from fairseq.utils import safe_hasattr
 
 
@@ -142,6 +142,17 @@ class Trainer(object):
         self._wrapped_model = None
         self._ema = None
 
+        # noise-rate curriculum of robust (ISDST) models, shared with the
+        # model and the task so that all noise follows the same schedule
+        self._noise_curriculum = noise_curriculum.build_noise_curriculum(
+            getattr(cfg, "noise_curriculum", None), cfg.model
+        )
+        for m in self._model.modules():
+            if hasattr(m, "set_noise_curriculum"):
+                m.set_noise_curriculum(self._noise_curriculum)
+        if hasattr(self.task, "set_noise_curriculum"):
+            self.task.set_noise_curriculum(self._noise_curriculum)
+
         # TODO(myleott): support tpu
         if self.cuda and self.data_parallel_world_size > 1:
             self._grad_norm_buf = torch.cuda.DoubleTensor(self.data_parallel_world_size)
@@ -281,6 +292,10 @@ class Trainer(object):
             self._build_optimizer()
         return self._optimizer
 
+    @property
+    def noise_curriculum(self):
+        return self._noise_curriculum
+
     @property
     def lr_scheduler(self):
         if self._lr_scheduler is None:
@@ -413,6 +428,10 @@ class Trainer(object):
                 "previous_training_time": self.cumulative_training_time(),
             },
         }
+        if self.noise_curriculum is not None:
+            state_dict["extra_state"][
+                "noise_curriculum"
+            ] = self.noise_curriculum.state_dict()
         if self.cfg.ema.store_ema:
             # Save EMA model state as extra state
             state_dict["extra_state"]["ema"] = self.ema.get_model().state_dict()
@@ -599,6 +618,14 @@ class Trainer(object):
 
             if not reset_lr_scheduler:
                 self.lr_scheduler.load_state_dict(last_optim["lr_scheduler_state"])
+                if (
+                    self.noise_curriculum is not None
+                    and extra_state is not None
+                    and "noise_curriculum" in extra_state
+                ):
+                    self.noise_curriculum.load_state_dict(
+                        extra_state["noise_curriculum"]
+                    )
 
             if self.is_fsdp and not self.model.use_sharded_state:
                 # if use_sharded_state, the last_optim_state is already sharded, skip this
@@ -1241,10 +1268,19 @@ class Trainer(object):
         """Get the number of parameters updates."""
         return self._num_updates
 
+    def noise_curriculum_step_update(self):
+        """Update the noise rate of the curriculum after each update."""
+        if self.noise_curriculum is None:
+            return None
+        rate = self.noise_curriculum.step_update(self.get_num_updates())
+        metrics.log_scalar("noise_rate", rate, weight=0, priority=310)
+        return rate
+
     def set_num_updates(self, num_updates):
         """Set the number of parameters updates."""
         self._num_updates = num_updates
         self.lr_step_update()
+        self.noise_curriculum_step_update()
         if self.quantizer:
             self.quantizer.step_update(self._num_updates)
         metrics.log_scalar("num_updates", self._num_updates, weight=0, priority=200)
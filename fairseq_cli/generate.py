@@ -8,19 +8,24 @@ Translate pre-processed data with a trained model.
 """
 
 import ast
+import fileinput
+import io
+import json
 import logging
 import math
 import os
 import sys
 from argparse import Namespace
-from itertools import chain
+from itertools import chain, islice
 
 import numpy as np
 import torch
 from omegaconf import DictConfig
 
 from fairseq import checkpoint_utils, options, scoring, tasks, utils
+from fairseq.data import BaseWrapperDataset, GenerationCostDataset
 from fairseq.dataclass.utils import convert_namespace_to_omegaconf
+from fairseq.file_chunker_utils import input_fingerprint
 from fairseq.logging import progress_bar
 from fairseq.logging.meters import StopwatchMeter, TimeMeter
 
@@ -37,6 +42,12 @@ def main(cfg: DictConfig):
     assert (
         cfg.generation.replace_unk is None or cfg.dataset.dataset_impl == "raw"
     ), "--replace-unk requires a raw text dataset (--dataset-impl=raw)"
+    assert (
+        cfg.generation.replace_unk is None or cfg.generation.stream_input is None
+    ), "--replace-unk is not supported with --stream-input"
+    assert (
+        cfg.generation.stream_input is None or cfg.generation.stream
+    ), "--stream-input requires --stream"
 
     if cfg.common_eval.results_path is not None:
         os.makedirs(cfg.common_eval.results_path, exist_ok=True)
@@ -44,8 +55,36 @@ def main(cfg: DictConfig):
             cfg.common_eval.results_path,
             "generate-{}.txt".format(cfg.dataset.gen_subset),
         )
-        with open(output_path, "w", buffering=1, encoding="utf-8") as h:
-            return _main(cfg, h)
+        # only --stream runs of files are resumed: stdin may be other data
+        if not cfg.generation.stream or cfg.generation.stream_input == "-":
+            with open(output_path, "w", buffering=1, encoding="utf-8") as h:
+                return _main(cfg, h)
+        # resume an interrupted run of the same input and models, dropping
+        # what it wrote after its last checkpoint
+        progress_path = output_path + ".progress"
+        fingerprint = stream_fingerprint(cfg)
+        start_id, output_bytes = load_stream_progress(progress_path, fingerprint)
+        mode = "w"
+        if start_id > 0 and os.path.exists(output_path):
+            if os.path.getsize(output_path) < output_bytes:
+                raise ValueError(
+                    "cannot resume --stream: {} is shorter than the {} bytes "
+                    "recorded in {}; remove the latter to start over".format(
+                        output_path, output_bytes, progress_path
+                    )
+                )
+            os.truncate(output_path, output_bytes)
+            mode = "a"
+        else:
+            start_id = 0
+        with open(output_path, mode, buffering=1, encoding="utf-8") as h:
+            return _main(
+                cfg,
+                h,
+                progress_path=progress_path,
+                start_id=start_id,
+                fingerprint=fingerprint,
+            )
     else:
         return _main(cfg, sys.stdout)
 
@@ -57,7 +96,143 @@ def get_symbols_to_strip_from_output(generator):
         return {generator.eos}
 
 
-def _main(cfg: DictConfig, output_file):
+def stream_fingerprint(cfg):
+    """Identifies the input and the models of a ``--stream`` run: the path,
+    size and modification time of the ``--stream-input`` file (or of the
+    binarized ``--gen-subset`` files) and of the checkpoints."""
+    if cfg.generation.stream_input is None and getattr(cfg.task, "data", None):
+        data = utils.split_paths(cfg.task.data)[0]
+        inputs = sorted(
+            os.path.join(data, f)
+            for f in os.listdir(data)
+            if f.startswith(cfg.dataset.gen_subset + ".")
+        )
+    elif cfg.generation.stream_input is None:
+        inputs = []
+    else:
+        inputs = [cfg.generation.stream_input]
+    return {
+        "input": cfg.generation.stream_input,
+        "input_files": [input_fingerprint(path) for path in inputs],
+        "checkpoints": [
+            input_fingerprint(path)
+            for path in utils.split_paths(cfg.common_eval.path)
+        ],
+    }
+
+
+def load_stream_progress(progress_path, fingerprint):
+    """The next sentence id and the output size in bytes of an interrupted
+    ``--stream`` run with the same *fingerprint*, or (0, 0)."""
+    try:
+        with open(progress_path, encoding="utf-8") as f:
+            progress = json.load(f)
+    except (OSError, ValueError):
+        return 0, 0
+    if progress.get("fingerprint") != fingerprint:
+        logging.getLogger("fairseq_cli.generate").warning(
+            "{} is from a run of another input or model, starting over".format(
+                progress_path
+            )
+        )
+        return 0, 0
+    return progress["next_id"], progress["output_bytes"]
+
+
+def save_stream_progress(progress_path, next_id, output_bytes, fingerprint):
+    tmp_path = "{}.tmp{}".format(progress_path, os.getpid())
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "next_id": next_id,
+                "output_bytes": output_bytes,
+                "fingerprint": fingerprint,
+            },
+            f,
+        )
+    os.replace(tmp_path, progress_path)
+
+
+class ReorderBuffer(object):
+    """Writes the outputs of consecutive sentence ids in order as soon as
+    they are available, and holds the others until then."""
+
+    def __init__(self, output_file, next_id=0):
+        self.output_file = output_file
+        self.next_id = next_id
+        self.pending = {}
+
+    def add(self, sample_id, output):
+        self.pending[sample_id] = output
+        while self.next_id in self.pending:
+            self.output_file.write(self.pending.pop(self.next_id))
+            self.next_id += 1
+
+    def skip_to(self, stop):
+        """Writes the pending outputs of the ids before *stop*, skipping
+        the ids without one (e.g. sentences too long to generate)."""
+        for sample_id in sorted(i for i in self.pending if i < stop):
+            self.output_file.write(self.pending.pop(sample_id))
+        self.next_id = max(self.next_id, stop)
+
+
+class WindowDataset(BaseWrapperDataset):
+    """Batches only the sentences *start* to *stop* (excluded) of *dataset*,
+    which keep their ids."""
+
+    def __init__(self, dataset, start, stop):
+        super().__init__(dataset)
+        self.start = start
+        self.stop = stop
+
+    def batch_plan_key(self):
+        return (self.start, self.stop)
+
+    def ordered_indices(self):
+        indices = np.arange(self.start, self.stop, dtype=np.int64)
+        return indices[
+            np.argsort(self.dataset.num_tokens_vec(indices), kind="mergesort")
+        ]
+
+
+def stream_windows(cfg, task, start_id, encode_fn):
+    """Yields the successive windows of ``--stream-window`` sentences from
+    *start_id* on, as (dataset, first id, id after the last one, offset of
+    the dataset ids), reading the input lazily."""
+    window = cfg.generation.stream_window
+    if cfg.generation.stream_input is None:
+        dataset = task.dataset(cfg.dataset.gen_subset)
+        for start in range(start_id, len(dataset), window):
+            stop = min(start + window, len(dataset))
+            yield dataset, start, stop, 0
+        return
+
+    src_dict = task.source_dictionary
+    with fileinput.input(
+        [cfg.generation.stream_input], openhook=fileinput.hook_encoded("utf-8")
+    ) as f:
+        for _ in islice(f, start_id):
+            pass
+        start = start_id
+        while True:
+            lines = list(islice(f, window))
+            if len(lines) == 0:
+                break
+            tokens = [
+                src_dict.encode_line(
+                    encode_fn(line.strip()), add_if_not_exist=False
+                ).long()
+                for line in lines
+            ]
+            lengths = [t.numel() for t in tokens]
+            dataset = task.build_dataset_for_inference(tokens, lengths)
+            yield dataset, start, start + len(lines), start
+            start += len(lines)
+
+
+def _main(
+    cfg: DictConfig, output_file, progress_path=None, start_id=0, fingerprint=None
+):
     logging.basicConfig(
         format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
         datefmt="%Y-%m-%d %H:%M:%S",
@@ -103,7 +278,8 @@ def _main(cfg: DictConfig, output_file):
     )
 
     # loading the dataset should happen after the checkpoint has been loaded so we can give it the saved task config
-    task.load_dataset(cfg.dataset.gen_subset, task_cfg=saved_cfg.task)
+    if cfg.generation.stream_input is None:
+        task.load_dataset(cfg.dataset.gen_subset, task_cfg=saved_cfg.task)
 
     if cfg.generation.lm_path is not None:
         overrides["data"] = cfg.task.data
@@ -137,29 +313,37 @@ def _main(cfg: DictConfig, output_file):
     # (None if no unknown word replacement, empty if no path to align dictionary)
     align_dict = utils.load_align_dict(cfg.generation.replace_unk)
 
-    # Load dataset (possibly sharded)
-    itr = task.get_batch_iterator(
-        dataset=task.dataset(cfg.dataset.gen_subset),
-        max_tokens=cfg.dataset.max_tokens,
-        max_sentences=cfg.dataset.batch_size,
-        max_positions=utils.resolve_max_positions(
-            task.max_positions(), *[m.max_positions() for m in models]
-        ),
-        ignore_invalid_inputs=cfg.dataset.skip_invalid_size_inputs_valid_test,
-        required_batch_size_multiple=cfg.dataset.required_batch_size_multiple,
-        seed=cfg.common.seed,
-        num_shards=cfg.distributed_training.distributed_world_size,
-        shard_id=cfg.distributed_training.distributed_rank,
-        num_workers=cfg.dataset.num_workers,
-        data_buffer_size=cfg.dataset.data_buffer_size,
-    ).next_epoch_itr(shuffle=False)
-    progress = progress_bar.progress_bar(
-        itr,
-        log_format=cfg.common.log_format,
-        log_interval=cfg.common.log_interval,
-        default_log_format=("tqdm" if not cfg.common.no_progress_bar else "simple"),
+    max_positions = utils.resolve_max_positions(
+        task.max_positions(), *[m.max_positions() for m in models]
     )
 
+    def get_batch_iterator(dataset, window=None, **kwargs):
+        max_tokens = cfg.dataset.max_tokens
+        if cfg.generation.gen_batch_budget is not None:
+            # batch by beam * maximum output length instead of source tokens
+            dataset = GenerationCostDataset(
+                dataset,
+                beam_size=cfg.generation.beam,
+                max_len_a=cfg.generation.max_len_a,
+                max_len_b=cfg.generation.max_len_b,
+                max_len=min(m.max_decoder_positions() for m in models) - 1,
+            )
+            max_tokens = cfg.generation.gen_batch_budget
+        if window is not None:
+            dataset = WindowDataset(dataset, *window)
+        return task.get_batch_iterator(
+            dataset=dataset,
+            max_tokens=max_tokens,
+            max_sentences=cfg.dataset.batch_size,
+            max_positions=max_positions,
+            ignore_invalid_inputs=cfg.dataset.skip_invalid_size_inputs_valid_test,
+            required_batch_size_multiple=cfg.dataset.required_batch_size_multiple,
+            seed=cfg.common.seed,
+            num_workers=cfg.dataset.num_workers,
+            data_buffer_size=cfg.dataset.data_buffer_size,
+            **kwargs,
+        ).next_epoch_itr(shuffle=False)
+
     # Initialize generator
     gen_timer = StopwatchMeter()
 
@@ -172,6 +356,13 @@ def _main(cfg: DictConfig, output_file):
     tokenizer = task.build_tokenizer(cfg.tokenizer)
     bpe = task.build_bpe(cfg.bpe)
 
+    def encode_fn(x):
+        if tokenizer is not None:
+            x = tokenizer.encode(x)
+        if bpe is not None:
+            x = bpe.encode(x)
+        return x
+
     def decode_fn(x):
         if bpe is not None:
             x = bpe.decode(x)
@@ -181,191 +372,264 @@ def _main(cfg: DictConfig, output_file):
 
     scorer = scoring.build_scorer(cfg.scoring, tgt_dict)
 
-    num_sentences = 0
-    has_target = True
-    wps_meter = TimeMeter()
-    for sample in progress:
-        sample = utils.move_to_cuda(sample) if use_cuda else sample
-        if "net_input" not in sample:
-            continue
-
-        prefix_tokens = None
-        if cfg.generation.prefix_size > 0:
-            prefix_tokens = sample["target"][:, : cfg.generation.prefix_size]
-
-        constraints = None
-        if "constraints" in sample:
-            constraints = sample["constraints"]
+    def print_sentence(sample, i, sample_id, hypos, output_file, scorer):
+        """Prints the i-th sentence of *sample* and its hypotheses, and adds
+        the top one to *scorer* (unless None). Returns whether it has a
+        target."""
+        has_target = sample["target"] is not None
 
-        gen_timer.start()
-        hypos = task.inference_step(
-            generator,
-            models,
-            sample,
-            prefix_tokens=prefix_tokens,
-            constraints=constraints,
-        )
-        num_generated_tokens = sum(len(h[0]["tokens"]) for h in hypos)
-        gen_timer.stop(num_generated_tokens)
+        # Remove padding
+        if "src_tokens" in sample["net_input"]:
+            src_tokens = utils.strip_pad(
+                sample["net_input"]["src_tokens"][i, :], tgt_dict.pad()
+            )
+        else:
+            src_tokens = None
 
-        for i, sample_id in enumerate(sample["id"].tolist()):
-            has_target = sample["target"] is not None
+        target_tokens = None
+        if has_target:
+            target_tokens = (
+                utils.strip_pad(sample["target"][i, :], tgt_dict.pad()).int().cpu()
+            )
 
-            # Remove padding
-            if "src_tokens" in sample["net_input"]:
-                src_tokens = utils.strip_pad(
-                    sample["net_input"]["src_tokens"][i, :], tgt_dict.pad()
-                )
+        # Either retrieve the original sentences or regenerate them from tokens.
+        if align_dict is not None:
+            src_str = task.dataset(cfg.dataset.gen_subset).src.get_original_text(
+                sample_id
+            )
+            target_str = task.dataset(cfg.dataset.gen_subset).tgt.get_original_text(
+                sample_id
+            )
+        else:
+            if src_dict is not None:
+                src_str = src_dict.string(src_tokens, cfg.common_eval.post_process)
             else:
-                src_tokens = None
-
-            target_tokens = None
+                src_str = ""
             if has_target:
-                target_tokens = (
-                    utils.strip_pad(sample["target"][i, :], tgt_dict.pad()).int().cpu()
+                target_str = tgt_dict.string(
+                    target_tokens,
+                    cfg.common_eval.post_process,
+                    escape_unk=True,
+                    extra_symbols_to_ignore=get_symbols_to_strip_from_output(
+                        generator
+                    ),
                 )
 
-            # Either retrieve the original sentences or regenerate them from tokens.
-            if align_dict is not None:
-                src_str = task.dataset(cfg.dataset.gen_subset).src.get_original_text(
-                    sample_id
-                )
-                target_str = task.dataset(cfg.dataset.gen_subset).tgt.get_original_text(
-                    sample_id
-                )
-            else:
-                if src_dict is not None:
-                    src_str = src_dict.string(src_tokens, cfg.common_eval.post_process)
-                else:
-                    src_str = ""
-                if has_target:
-                    target_str = tgt_dict.string(
-                        target_tokens,
-                        cfg.common_eval.post_process,
-                        escape_unk=True,
-                        extra_symbols_to_ignore=get_symbols_to_strip_from_output(
-                            generator
-                        ),
-                    )
+        src_str = decode_fn(src_str)
+        if has_target:
+            target_str = decode_fn(target_str)
 
-            src_str = decode_fn(src_str)
+        if not cfg.common_eval.quiet:
+            if src_dict is not None:
+                print("S-{}\t{}".format(sample_id, src_str), file=output_file)
             if has_target:
-                target_str = decode_fn(target_str)
-
+                print("T-{}\t{}".format(sample_id, target_str), file=output_file)
+
+        # Process top predictions
+        for j, hypo in enumerate(hypos[i][: cfg.generation.nbest]):
+            hypo_tokens, hypo_str, alignment = utils.post_process_prediction(
+                hypo_tokens=hypo["tokens"].int().cpu(),
+                src_str=src_str,
+                alignment=hypo["alignment"],
+                align_dict=align_dict,
+                tgt_dict=tgt_dict,
+                remove_bpe=cfg.common_eval.post_process,
+                extra_symbols_to_ignore=get_symbols_to_strip_from_output(generator),
+            )
+            detok_hypo_str = decode_fn(hypo_str)
             if not cfg.common_eval.quiet:
-                if src_dict is not None:
-                    print("S-{}\t{}".format(sample_id, src_str), file=output_file)
-                if has_target:
-                    print("T-{}\t{}".format(sample_id, target_str), file=output_file)
-
-            # Process top predictions
-            for j, hypo in enumerate(hypos[i][: cfg.generation.nbest]):
-                hypo_tokens, hypo_str, alignment = utils.post_process_prediction(
-                    hypo_tokens=hypo["tokens"].int().cpu(),
-                    src_str=src_str,
-                    alignment=hypo["alignment"],
-                    align_dict=align_dict,
-                    tgt_dict=tgt_dict,
-                    remove_bpe=cfg.common_eval.post_process,
-                    extra_symbols_to_ignore=get_symbols_to_strip_from_output(generator),
+                score = hypo["score"] / math.log(2)  # convert to base 2
+                # original hypothesis (after tokenization and BPE)
+                print(
+                    "H-{}\t{}\t{}".format(sample_id, score, hypo_str),
+                    file=output_file,
                 )
-                detok_hypo_str = decode_fn(hypo_str)
-                if not cfg.common_eval.quiet:
-                    score = hypo["score"] / math.log(2)  # convert to base 2
-                    # original hypothesis (after tokenization and BPE)
-                    print(
-                        "H-{}\t{}\t{}".format(sample_id, score, hypo_str),
-                        file=output_file,
-                    )
-                    # detokenized hypothesis
+                # detokenized hypothesis
+                print(
+                    "D-{}\t{}\t{}".format(sample_id, score, detok_hypo_str),
+                    file=output_file,
+                )
+                print(
+                    "P-{}\t{}".format(
+                        sample_id,
+                        " ".join(
+                            map(
+                                lambda x: "{:.4f}".format(x),
+                                # convert from base e to base 2
+                                hypo["positional_scores"]
+                                .div_(math.log(2))
+                                .tolist(),
+                            )
+                        ),
+                    ),
+                    file=output_file,
+                )
+
+                if cfg.generation.print_alignment == "hard":
                     print(
-                        "D-{}\t{}\t{}".format(sample_id, score, detok_hypo_str),
+                        "A-{}\t{}".format(
+                            sample_id,
+                            " ".join(
+                                [
+                                    "{}-{}".format(src_idx, tgt_idx)
+                                    for src_idx, tgt_idx in alignment
+                                ]
+                            ),
+                        ),
                         file=output_file,
                     )
+                if cfg.generation.print_alignment == "soft":
                     print(
-                        "P-{}\t{}".format(
+                        "A-{}\t{}".format(
                             sample_id,
                             " ".join(
-                                map(
-                                    lambda x: "{:.4f}".format(x),
-                                    # convert from base e to base 2
-                                    hypo["positional_scores"]
-                                    .div_(math.log(2))
-                                    .tolist(),
-                                )
+                                [",".join(src_probs) for src_probs in alignment]
                             ),
                         ),
                         file=output_file,
                     )
 
-                    if cfg.generation.print_alignment == "hard":
-                        print(
-                            "A-{}\t{}".format(
-                                sample_id,
-                                " ".join(
-                                    [
-                                        "{}-{}".format(src_idx, tgt_idx)
-                                        for src_idx, tgt_idx in alignment
-                                    ]
-                                ),
-                            ),
-                            file=output_file,
+                if cfg.generation.print_step:
+                    print(
+                        "I-{}\t{}".format(sample_id, hypo["steps"]),
+                        file=output_file,
+                    )
+
+                if cfg.generation.retain_iter_history:
+                    for step, h in enumerate(hypo["history"]):
+                        _, h_str, _ = utils.post_process_prediction(
+                            hypo_tokens=h["tokens"].int().cpu(),
+                            src_str=src_str,
+                            alignment=None,
+                            align_dict=None,
+                            tgt_dict=tgt_dict,
+                            remove_bpe=None,
                         )
-                    if cfg.generation.print_alignment == "soft":
                         print(
-                            "A-{}\t{}".format(
-                                sample_id,
-                                " ".join(
-                                    [",".join(src_probs) for src_probs in alignment]
-                                ),
-                            ),
+                            "E-{}_{}\t{}".format(sample_id, step, h_str),
                             file=output_file,
                         )
 
-                    if cfg.generation.print_step:
-                        print(
-                            "I-{}\t{}".format(sample_id, hypo["steps"]),
-                            file=output_file,
-                        )
+            # Score only the top hypothesis
+            if has_target and j == 0 and scorer is not None:
+                if (
+                    align_dict is not None
+                    or cfg.common_eval.post_process is not None
+                ):
+                    # Convert back to tokens for evaluation with unk replacement and/or without BPE
+                    target_tokens = tgt_dict.encode_line(
+                        target_str, add_if_not_exist=True
+                    )
+                    hypo_tokens = tgt_dict.encode_line(
+                        detok_hypo_str, add_if_not_exist=True
+                    )
+                if hasattr(scorer, "add_string"):
+                    scorer.add_string(target_str, detok_hypo_str)
+                else:
+                    scorer.add(target_tokens, hypo_tokens)
 
-                    if cfg.generation.retain_iter_history:
-                        for step, h in enumerate(hypo["history"]):
-                            _, h_str, _ = utils.post_process_prediction(
-                                hypo_tokens=h["tokens"].int().cpu(),
-                                src_str=src_str,
-                                alignment=None,
-                                align_dict=None,
-                                tgt_dict=tgt_dict,
-                                remove_bpe=None,
-                            )
-                            print(
-                                "E-{}_{}\t{}".format(sample_id, step, h_str),
-                                file=output_file,
-                            )
+        return has_target
 
-                # Score only the top hypothesis
-                if has_target and j == 0:
-                    if (
-                        align_dict is not None
-                        or cfg.common_eval.post_process is not None
-                    ):
-                        # Convert back to tokens for evaluation with unk replacement and/or without BPE
-                        target_tokens = tgt_dict.encode_line(
-                            target_str, add_if_not_exist=True
-                        )
-                        hypo_tokens = tgt_dict.encode_line(
-                            detok_hypo_str, add_if_not_exist=True
-                        )
-                    if hasattr(scorer, "add_string"):
-                        scorer.add_string(target_str, detok_hypo_str)
-                    else:
-                        scorer.add(target_tokens, hypo_tokens)
-
-        wps_meter.update(num_generated_tokens)
-        progress.log({"wps": round(wps_meter.avg)})
-        num_sentences += (
-            sample["nsentences"] if "nsentences" in sample else sample["id"].numel()
+    def generate(sample):
+        prefix_tokens = None
+        if cfg.generation.prefix_size > 0:
+            prefix_tokens = sample["target"][:, : cfg.generation.prefix_size]
+
+        constraints = None
+        if "constraints" in sample:
+            constraints = sample["constraints"]
+
+        gen_timer.start()
+        hypos = task.inference_step(
+            generator,
+            models,
+            sample,
+            prefix_tokens=prefix_tokens,
+            constraints=constraints,
         )
+        num_generated_tokens = sum(len(h[0]["tokens"]) for h in hypos)
+        gen_timer.stop(num_generated_tokens)
+        return hypos, num_generated_tokens
+
+    num_sentences = 0
+    has_target = True
+    wps_meter = TimeMeter()
+    if cfg.generation.stream:
+        # decode the input window by window, writing the sentences in order
+        # and checkpointing after every window; no scoring, since a resumed
+        # run only sees part of the input
+        if start_id > 0:
+            logger.info("resuming from sentence {:,}".format(start_id))
+        has_target = False
+        reorder_buffer = ReorderBuffer(output_file, next_id=start_id)
+        for dataset, start, stop, id_offset in stream_windows(
+            cfg, task, start_id, encode_fn
+        ):
+            window = (start, stop) if cfg.generation.stream_input is None else None
+            for sample in get_batch_iterator(
+                dataset, window=window, disable_iterator_cache=True
+            ):
+                sample = utils.move_to_cuda(sample) if use_cuda else sample
+                if "net_input" not in sample:
+                    continue
+                hypos, num_generated_tokens = generate(sample)
+                for i, sample_id in enumerate(sample["id"].tolist()):
+                    sample_id += id_offset
+                    output = io.StringIO()
+                    print_sentence(sample, i, sample_id, hypos, output, None)
+                    reorder_buffer.add(sample_id, output.getvalue())
+                wps_meter.update(num_generated_tokens)
+                num_sentences += sample["id"].numel()
+            reorder_buffer.skip_to(stop)
+            output_file.flush()
+            if progress_path is not None:
+                save_stream_progress(
+                    progress_path,
+                    stop,
+                    os.fstat(output_file.fileno()).st_size,
+                    fingerprint,
+                )
+            logger.info(
+                "sentences {:,} to {:,} done, {} wps".format(
+                    start, stop - 1, round(wps_meter.avg)
+                )
+            )
+        if progress_path is not None and os.path.exists(progress_path):
+            # done, a rerun starts over
+            os.remove(progress_path)
+    else:
+        # Load dataset (possibly sharded)
+        itr = get_batch_iterator(
+            task.dataset(cfg.dataset.gen_subset),
+            num_shards=cfg.distributed_training.distributed_world_size,
+            shard_id=cfg.distributed_training.distributed_rank,
+        )
+        progress = progress_bar.progress_bar(
+            itr,
+            log_format=cfg.common.log_format,
+            log_interval=cfg.common.log_interval,
+            default_log_format=(
+                "tqdm" if not cfg.common.no_progress_bar else "simple"
+            ),
+        )
+        for sample in progress:
+            sample = utils.move_to_cuda(sample) if use_cuda else sample
+            if "net_input" not in sample:
+                continue
+
+            hypos, num_generated_tokens = generate(sample)
+            for i, sample_id in enumerate(sample["id"].tolist()):
+                has_target = print_sentence(
+                    sample, i, sample_id, hypos, output_file, scorer
+                )
+
+            wps_meter.update(num_generated_tokens)
+            progress.log({"wps": round(wps_meter.avg)})
+            num_sentences += (
+                sample["nsentences"]
+                if "nsentences" in sample
+                else sample["id"].numel()
+            )
 
     logger.info("NOTE: hypothesis and token scores are output in base 2")
     logger.info(
@@ -377,6 +641,13 @@ def _main(cfg: DictConfig, output_file):
             1.0 / gen_timer.avg,
         )
     )
+    encoder_cache = getattr(generator, "encoder_cache", None)
+    if encoder_cache is not None:
+        logger.info(
+            "Encoder cache: {:,} hits, {:,} misses".format(
+                encoder_cache.hits, encoder_cache.misses
+            )
+        )
     if has_target:
         if cfg.bpe and not cfg.generation.sacrebleu:
             if cfg.common_eval.post_process:
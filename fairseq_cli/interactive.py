@@ -8,11 +8,17 @@ Translate raw text with a trained model. Batches data on-the-fly.
 """
 
 import ast
+import collections
 import fileinput
+import itertools
 import logging
 import math
 import os
+import queue
+import socket
+import stat
 import sys
+import threading
 import time
 from argparse import Namespace
 from collections import namedtuple
@@ -21,6 +27,7 @@ import numpy as np
 import torch
 
 from fairseq import checkpoint_utils, distributed_utils, options, tasks, utils
+from fairseq.continuous_sequence_generator import ContinuousSequenceGenerator
 from fairseq.dataclass.configs import FairseqConfig
 from fairseq.dataclass.utils import convert_namespace_to_omegaconf
 from fairseq.token_generation_constraints import pack_constraints, unpack_constraints
@@ -37,6 +44,7 @@ logger = logging.getLogger("fairseq_cli.interactive")
 
 Batch = namedtuple("Batch", "ids src_tokens src_lengths constraints")
 Translation = namedtuple("Translation", "src_str hypos pos_scores alignments")
+Request = namedtuple("Request", "id line client arrival_time")
 
 
 def buffered_read(input, buffer_size):
@@ -105,6 +113,265 @@ def make_batches(lines, cfg, task, max_positions, encode_fn):
         )
 
 
+def hypothesis_lines(
+    id_, src_str, hypos, cfg, generator, tgt_dict, align_dict, decode_fn
+):
+    """The output lines of the top *hypos* of sentence *id_*."""
+    for hypo in hypos[: min(len(hypos), cfg.generation.nbest)]:
+        hypo_tokens, hypo_str, alignment = utils.post_process_prediction(
+            hypo_tokens=hypo["tokens"].int().cpu(),
+            src_str=src_str,
+            alignment=hypo["alignment"],
+            align_dict=align_dict,
+            tgt_dict=tgt_dict,
+            remove_bpe=cfg.common_eval.post_process,
+            extra_symbols_to_ignore=get_symbols_to_strip_from_output(generator),
+        )
+        detok_hypo_str = decode_fn(hypo_str)
+        score = hypo["score"] / math.log(2)  # convert to base 2
+        # original hypothesis (after tokenization and BPE)
+        yield "H-{}\t{}\t{}".format(id_, score, hypo_str)
+        # detokenized hypothesis
+        yield "D-{}\t{}\t{}".format(id_, score, detok_hypo_str)
+        yield "P-{}\t{}".format(
+            id_,
+            " ".join(
+                map(
+                    lambda x: "{:.4f}".format(x),
+                    # convert from base e to base 2
+                    hypo["positional_scores"].div_(math.log(2)).tolist(),
+                )
+            ),
+        )
+        if cfg.generation.print_alignment:
+            alignment_str = " ".join(["{}-{}".format(src, tgt) for src, tgt in alignment])
+            yield "A-{}\t{}".format(id_, alignment_str)
+
+
+class Client(object):
+    """Where the translations of a stream of requests are written."""
+
+    def __init__(self, output, sock=None):
+        self.output = output
+        self.sock = sock
+        self.num_pending = 0
+        self.reading = True
+
+    def write(self, lines):
+        try:
+            for line in lines:
+                print(line, file=self.output)
+            self.output.flush()
+        except OSError as e:
+            logger.warning("cannot write to the client: {}".format(e))
+
+    def maybe_close(self):
+        if self.sock is not None and not self.reading and self.num_pending == 0:
+            try:
+                self.output.close()
+                self.sock.close()
+            except OSError:
+                pass
+
+
+def _read_client(lines, client, requests, ids):
+    for line in lines:
+        requests.put(Request(next(ids), line.strip(), client, time.time()))
+    # the end of the stream of the client
+    requests.put(Request(None, None, client, time.time()))
+
+
+def read_requests(cfg, requests):
+    """Put the sentences read from ``--input`` or the connections to
+    ``--serve-socket`` on the *requests* queue, followed by ``None`` when
+    the input is exhausted."""
+    ids = itertools.count()
+    if cfg.interactive.serve_socket is None:
+        with fileinput.input(
+            files=[cfg.interactive.input], openhook=fileinput.hook_encoded("utf-8")
+        ) as h:
+            _read_client(h, Client(sys.stdout), requests, ids)
+        requests.put(None)
+        return
+
+    path = cfg.interactive.serve_socket
+    if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+        os.remove(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen()
+    logger.info("Listening on {}".format(path))
+    while True:
+        sock, _ = server.accept()
+        client = Client(sock.makefile("w", encoding="utf-8"), sock)
+        threading.Thread(
+            target=_read_client,
+            args=(sock.makefile("r", encoding="utf-8"), client, requests, ids),
+            daemon=True,
+        ).start()
+
+
+def serve(cfg, task, models, max_positions, encode_fn, decode_fn, align_dict):
+    """Translate the requests as they arrive, with continuous batching.
+
+    Finished sentences leave the batch and waiting ones join it at every
+    decoding step (see
+    :class:`~fairseq.continuous_sequence_generator.ContinuousSequenceGenerator`).
+    Every translation is followed by its latency: the seconds between the
+    arrival of the request and its translation, the time it waited for a
+    free slot and the time it was decoded.
+    """
+    assert not cfg.generation.constraints, "--serve does not support --constraints"
+    assert not cfg.generation.prefix_size, "--serve does not support --prefix-size"
+    assert not cfg.generation.sampling, "--serve does not support --sampling"
+    assert (
+        not cfg.generation.print_alignment
+    ), "--serve does not support --print-alignment"
+    use_cuda = torch.cuda.is_available() and not cfg.common.cpu
+    src_dict = task.source_dictionary
+    tgt_dict = task.target_dictionary
+    generator = ContinuousSequenceGenerator(
+        models,
+        tgt_dict,
+        max_sentences=cfg.dataset.batch_size or 1,
+        beam_size=cfg.generation.beam,
+        max_len_a=cfg.generation.max_len_a,
+        max_len_b=cfg.generation.max_len_b,
+        min_len=cfg.generation.min_len,
+        normalize_scores=(not cfg.generation.unnormalized),
+        len_penalty=cfg.generation.lenpen,
+        unk_penalty=cfg.generation.unkpen,
+        temperature=cfg.generation.temperature,
+        no_repeat_ngram_size=cfg.generation.no_repeat_ngram_size,
+    )
+    max_source_positions = (
+        max_positions[0] if isinstance(max_positions, tuple) else max_positions
+    )
+
+    requests = queue.Queue()
+    threading.Thread(target=read_requests, args=(cfg, requests), daemon=True).start()
+    logger.info(
+        "Serving with continuous batching of up to {} sentences".format(
+            generator.max_sentences
+        )
+    )
+
+    waiting = collections.deque()
+    active = {}
+    latencies = []
+    exhausted = False
+    start_time = time.time()
+    try:
+        while not exhausted or len(waiting) > 0 or generator.num_active > 0:
+            # wait for requests only when there is nothing to decode
+            block = len(waiting) == 0 and generator.num_active == 0
+            while not exhausted:
+                try:
+                    request = requests.get(block=block)
+                except queue.Empty:
+                    break
+                block = False
+                if request is None:
+                    exhausted = True
+                elif request.line is None:
+                    request.client.reading = False
+                    request.client.maybe_close()
+                else:
+                    request.client.num_pending += 1
+                    waiting.append(request)
+
+            # join the batch at the step boundary
+            admitted = []
+            while len(waiting) > 0 and len(admitted) < generator.num_free:
+                admitted.append(waiting.popleft())
+            if len(admitted) > 0:
+                tokens, lengths = task.get_interactive_tokens_and_lengths(
+                    [request.line for request in admitted], encode_fn
+                )
+                joined = []
+                for request, src_tokens in zip(admitted, tokens):
+                    if max_source_positions is not None and (
+                        src_tokens.numel() > max_source_positions
+                    ):
+                        request.client.write(
+                            [
+                                "E-{}\tsource longer than {} tokens".format(
+                                    request.id, max_source_positions
+                                )
+                            ]
+                        )
+                        request.client.num_pending -= 1
+                        request.client.maybe_close()
+                    else:
+                        joined.append((request, src_tokens))
+                if len(joined) > 0:
+                    dataset = task.build_dataset_for_inference(
+                        [src_tokens for _, src_tokens in joined],
+                        [src_tokens.numel() for _, src_tokens in joined],
+                    )
+                    batch = dataset.collater([dataset[i] for i in range(len(joined))])
+                    batch = utils.move_to_cuda(batch) if use_cuda else batch
+                    admit_time = time.time()
+                    ids = []
+                    for i in batch["id"].tolist():
+                        request, src_tokens = joined[i]
+                        active[request.id] = (request, src_tokens, admit_time)
+                        ids.append(request.id)
+                    generator.add(
+                        ids,
+                        batch["net_input"]["src_tokens"],
+                        batch["net_input"]["src_lengths"],
+                    )
+
+            for id_, hypos in generator.step():
+                request, src_tokens, admit_time = active.pop(id_)
+                finish_time = time.time()
+                latency = finish_time - request.arrival_time
+                queued = admit_time - request.arrival_time
+                latencies.append((latency, queued))
+                lines = []
+                src_str = ""
+                if src_dict is not None:
+                    src_str = src_dict.string(
+                        src_tokens, cfg.common_eval.post_process
+                    )
+                    lines.append("S-{}\t{}".format(id_, src_str))
+                lines.append(
+                    "W-{}\t{:.3f}\tseconds\t{:.3f}\tqueued\t{:.3f}\tdecoding".format(
+                        id_, latency, queued, finish_time - admit_time
+                    )
+                )
+                lines.extend(
+                    hypothesis_lines(
+                        id_,
+                        src_str,
+                        hypos,
+                        cfg,
+                        generator,
+                        tgt_dict,
+                        align_dict,
+                        decode_fn,
+                    )
+                )
+                request.client.write(lines)
+                request.client.num_pending -= 1
+                request.client.maybe_close()
+    finally:
+        if len(latencies) > 0:
+            latency, queued = np.array(latencies).T
+            logger.info(
+                "Served {} sentences in {:.3f} seconds; latency: mean {:.3f}, "
+                "p50 {:.3f}, p90 {:.3f}, p99 {:.3f} seconds; queued: mean {:.3f} "
+                "seconds".format(
+                    len(latency),
+                    time.time() - start_time,
+                    latency.mean(),
+                    *np.percentile(latency, [50, 90, 99]),
+                    queued.mean(),
+                )
+            )
+
+
 def main(cfg: FairseqConfig):
     if isinstance(cfg, Namespace):
         cfg = convert_namespace_to_omegaconf(cfg)
@@ -124,6 +391,7 @@ def main(cfg: FairseqConfig):
     ), "--sampling requires --nbest to be equal to --beam"
     assert (
         not cfg.dataset.batch_size
+        or cfg.interactive.serve
         or cfg.dataset.batch_size <= cfg.interactive.buffer_size
     ), "--batch-size cannot be larger than --buffer-size"
 
@@ -194,6 +462,10 @@ def main(cfg: FairseqConfig):
         task.max_positions(), *[model.max_positions() for model in models]
     )
 
+    if cfg.interactive.serve:
+        serve(cfg, task, models, max_positions, encode_fn, decode_fn, align_dict)
+        return
+
     if cfg.generation.constraints:
         logger.warning(
             "NOTE: Constrained decoding currently assumes a shared subword vocabulary."
@@ -263,39 +535,10 @@ def main(cfg: FairseqConfig):
                     )
 
             # Process top predictions
-            for hypo in hypos[: min(len(hypos), cfg.generation.nbest)]:
-                hypo_tokens, hypo_str, alignment = utils.post_process_prediction(
-                    hypo_tokens=hypo["tokens"].int().cpu(),
-                    src_str=src_str,
-                    alignment=hypo["alignment"],
-                    align_dict=align_dict,
-                    tgt_dict=tgt_dict,
-                    remove_bpe=cfg.common_eval.post_process,
-                    extra_symbols_to_ignore=get_symbols_to_strip_from_output(generator),
-                )
-                detok_hypo_str = decode_fn(hypo_str)
-                score = hypo["score"] / math.log(2)  # convert to base 2
-                # original hypothesis (after tokenization and BPE)
-                print("H-{}\t{}\t{}".format(id_, score, hypo_str))
-                # detokenized hypothesis
-                print("D-{}\t{}\t{}".format(id_, score, detok_hypo_str))
-                print(
-                    "P-{}\t{}".format(
-                        id_,
-                        " ".join(
-                            map(
-                                lambda x: "{:.4f}".format(x),
-                                # convert from base e to base 2
-                                hypo["positional_scores"].div_(math.log(2)).tolist(),
-                            )
-                        ),
-                    )
-                )
-                if cfg.generation.print_alignment:
-                    alignment_str = " ".join(
-                        ["{}-{}".format(src, tgt) for src, tgt in alignment]
-                    )
-                    print("A-{}\t{}".format(id_, alignment_str))
+            for line in hypothesis_lines(
+                id_, src_str, hypos, cfg, generator, tgt_dict, align_dict, decode_fn
+            ):
+                print(line)
 
         # update running id_ counter
         start_id += len(inputs)
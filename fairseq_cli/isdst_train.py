@@ -0,0 +1,348 @@
+#!/usr/bin/env python3 -u
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Run the K data-switch stages of ISDST training in a single process.
+
+Each stage behaves like a separate ``fairseq-train --finetune-from-model``
+run started from the previous stage's best checkpoint (fresh optimizer, lr
+scheduler, meters and update count), but the task, datasets and model stay
+resident between stages and the best weights are handed over in memory.
+
+A restarted run resumes every stage from the ``checkpoint_last.pt`` of its
+save dir, skips the stages that are finished, and starts the first stage
+that was not begun from the ``checkpoint_best.pt`` of the stage before it.
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+from typing import Any, Callable, Dict, List, Optional
+
+logging.basicConfig(
+    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+    level=os.environ.get("LOGLEVEL", "INFO").upper(),
+    stream=sys.stdout,
+)
+logger = logging.getLogger("fairseq_cli.isdst_train")
+
+import numpy as np
+from omegaconf import DictConfig
+
+from fairseq import checkpoint_utils, options, quantization_utils, tasks, utils
+from fairseq.data import data_utils
+from fairseq.dataclass.configs import FairseqConfig
+from fairseq.dataclass.initialize import add_defaults
+from fairseq.dataclass.utils import convert_namespace_to_omegaconf
+from fairseq.distributed import utils as distributed_utils
+from fairseq.file_io import PathManager
+from fairseq.logging import meters, metrics
+from fairseq.trainer import Trainer
+from fairseq_cli.train import should_stop_early, train
+
+# stage overrides applied to the criterion, the training schedule and the
+# model's noise options respectively
+CRITERION_KEYS = {"kl_direction", "only_nll", "reg_alpha"}
+OPTIMIZATION_KEYS = {"max_update", "max_epoch"}
+NOISE_KEYS = {
+    "add_noise",
+    "noise_type",
+    "noise_rate",
+    "is_half_batch",
+    "curriculum_learning",
+    "curriculum_args",
+}
+
+
+def parse_stages(stages: str) -> List[Dict[str, Any]]:
+    stages = json.loads(stages)
+    if not isinstance(stages, list) or len(stages) == 0:
+        raise ValueError("--isdst-stages must be a non-empty JSON list")
+    for stage in stages:
+        unknown = set(stage) - CRITERION_KEYS - OPTIMIZATION_KEYS - NOISE_KEYS
+        unknown.discard("save_dir")
+        if unknown:
+            raise ValueError(
+                "unsupported stage override(s): {}".format(", ".join(sorted(unknown)))
+            )
+    return stages
+
+
+def configure_stage(
+    cfg: FairseqConfig,
+    task: tasks.FairseqTask,
+    model,
+    criterion,
+    stage: Dict[str, Any],
+    stage_idx: int,
+    base_save_dir: str,
+) -> None:
+    """Apply one stage's overrides to the config and the resident objects."""
+    cfg.checkpoint.save_dir = stage.get(
+        "save_dir", os.path.join(base_save_dir, "stage{}".format(stage_idx + 1))
+    )
+    if stage_idx > 0:
+        # the checkpoint options of the command line are for the first stage;
+        # the next ones only ever resume from their own last checkpoint
+        cfg.checkpoint.restore_file = "checkpoint_last.pt"
+        cfg.checkpoint.finetune_from_model = None
+        cfg.checkpoint.continue_once = None
+        cfg.checkpoint.reset_optimizer = False
+        cfg.checkpoint.reset_lr_scheduler = False
+        cfg.checkpoint.reset_meters = False
+        cfg.checkpoint.reset_dataloader = False
+    noise_changed = False
+    for key, value in stage.items():
+        if key in CRITERION_KEYS:
+            setattr(cfg.criterion, key, value)
+            setattr(criterion, key, value)
+        elif key in OPTIMIZATION_KEYS:
+            setattr(cfg.optimization, key, value)
+        elif key in NOISE_KEYS:
+            if key == "curriculum_args" and not isinstance(value, str):
+                value = json.dumps(value)
+            # read by the encoder (training-time noise) and by the task
+            # (--noise-in-dataloader) respectively
+            setattr(model.encoder.cfg, key, value)
+            setattr(cfg.model, key, value)
+            noise_changed = True
+    if noise_changed and hasattr(task, "refresh_noised_dataset"):
+        task.refresh_noised_dataset()
+    logger.info(
+        "ISDST stage {}: {}".format(
+            stage_idx + 1, json.dumps(dict(stage, save_dir=cfg.checkpoint.save_dir))
+        )
+    )
+
+
+def reset_best(stage_best: Dict[str, Any]) -> None:
+    """Forget the best validation score of the previous stage."""
+    for fn in (checkpoint_utils.save_checkpoint, should_stop_early):
+        for attr in ("best", "num_runs"):
+            if hasattr(fn, attr):
+                delattr(fn, attr)
+    stage_best["state_dict"] = None
+
+
+def load_stage_best(save_dir: str, suffix: str) -> Dict[str, Any]:
+    """The weights of the best checkpoint of a finished stage."""
+    path = os.path.join(save_dir, "checkpoint_best{}.pt".format(suffix))
+    if not PathManager.exists(path):
+        raise FileNotFoundError(
+            "the previous ISDST stage has no best checkpoint to start the next "
+            "stage from: {} does not exist".format(path)
+        )
+    logger.info("starting the next stage from {}".format(path))
+    return checkpoint_utils.load_checkpoint_to_cpu(path)["model"]
+
+
+def stage_finished(cfg: DictConfig, trainer: Trainer, epoch_itr) -> bool:
+    """Whether a resumed stage already reached its --max-update or
+    --max-epoch."""
+    max_update = cfg.optimization.max_update
+    max_epoch = cfg.optimization.max_epoch
+    return (max_update > 0 and trainer.get_num_updates() >= max_update) or (
+        max_epoch > 0 and epoch_itr.next_epoch_idx > max_epoch
+    )
+
+
+def main(cfg: FairseqConfig, stages: List[Dict[str, Any]]) -> None:
+    if isinstance(cfg, argparse.Namespace):
+        cfg = convert_namespace_to_omegaconf(cfg)
+
+    utils.import_user_module(cfg.common)
+    add_defaults(cfg)
+
+    assert (
+        cfg.dataset.max_tokens is not None or cfg.dataset.batch_size is not None
+    ), "Must specify batch size either with --max-tokens or --batch-size"
+    assert (
+        cfg.common.model_parallel_size == 1
+    ), "fairseq-isdst-train does not support model parallel training"
+    assert (
+        cfg.distributed_training.ddp_backend != "fully_sharded"
+    ), "fairseq-isdst-train does not support --ddp-backend=fully_sharded"
+    assert not getattr(
+        cfg.task, "eval_bleu_async", False
+    ), "fairseq-isdst-train does not support --eval-bleu-async"
+
+    if cfg.common.log_file is not None:
+        handler = logging.FileHandler(filename=cfg.common.log_file)
+        logger.addHandler(handler)
+
+    base_save_dir = cfg.checkpoint.save_dir
+
+    logger.info(cfg)
+
+    # Setup task, model and criterion once for all stages
+    task = tasks.setup_task(cfg.task)
+    assert cfg.criterion, "Please specify criterion to train a model"
+    model = task.build_model(cfg.model)
+    criterion = task.build_criterion(cfg.criterion)
+    logger.info(model)
+    logger.info("task: {}".format(task.__class__.__name__))
+    logger.info("model: {}".format(model.__class__.__name__))
+    logger.info("criterion: {}".format(criterion.__class__.__name__))
+
+    data_utils.raise_if_valid_subsets_unintentionally_ignored(cfg)
+    if cfg.dataset.combine_valid_subsets:
+        task.load_dataset("valid", combine=True, epoch=1)
+    else:
+        for valid_sub_split in cfg.dataset.valid_subset.split(","):
+            task.load_dataset(valid_sub_split, combine=False, epoch=1)
+
+    # snapshot the weights whenever the current stage reaches a new best
+    # validation score; the next stage starts from the last snapshot
+    stage_best = {"state_dict": None}
+
+    def keep_best(trainer, val_loss):
+        stage_best["state_dict"] = {
+            k: v.detach().to("cpu", copy=True)
+            for k, v in trainer.get_model().state_dict().items()
+        }
+
+    checkpoint_utils.save_checkpoint.new_best_hooks = [keep_best]
+
+    train_meter = meters.StopwatchMeter()
+    train_meter.start()
+    for stage_idx, stage in enumerate(stages):
+        prev_save_dir = cfg.checkpoint.save_dir
+        configure_stage(cfg, task, model, criterion, stage, stage_idx, base_save_dir)
+        if distributed_utils.is_master(cfg.distributed_training):
+            checkpoint_utils.verify_checkpoint_directory(cfg.checkpoint.save_dir)
+
+        # the best weights of the previous stage, if it reached them in this
+        # process; otherwise they are read from its checkpoint_best.pt
+        prev_best = stage_best["state_dict"]
+        reset_best(stage_best)
+        metrics.reset()
+        np.random.seed(cfg.common.seed)
+        utils.set_torch_seed(cfg.common.seed)
+
+        quantizer = None
+        if cfg.common.quantization_config_path is not None:
+            quantizer = quantization_utils.Quantizer(
+                config_path=cfg.common.quantization_config_path,
+                max_epoch=cfg.optimization.max_epoch,
+                max_update=cfg.optimization.max_update,
+            )
+        # a new trainer per stage resets the optimizer, lr scheduler and
+        # update count, like --finetune-from-model does
+        trainer = Trainer(cfg, task, model, criterion, quantizer)
+
+        if stage_idx > 0:
+            # the cached iterator was consumed by the previous stage
+            task.dataset_to_epoch_iter.pop(
+                task.dataset(cfg.dataset.train_subset), None
+            )
+        last_checkpoint = os.path.join(
+            cfg.checkpoint.save_dir,
+            "checkpoint_last{}.pt".format(trainer.checkpoint_suffix),
+        )
+        if stage_idx == 0 or PathManager.exists(last_checkpoint):
+            # the first stage may still resume from (or finetune) a
+            # checkpoint, the next ones resume from their last checkpoint
+            _, epoch_itr = checkpoint_utils.load_checkpoint(
+                cfg.checkpoint,
+                trainer,
+                disable_iterator_cache=task.has_sharded_data("train"),
+            )
+        else:
+            if prev_best is None:
+                prev_best = load_stage_best(prev_save_dir, trainer.checkpoint_suffix)
+            model.load_state_dict(prev_best)
+            del prev_best
+            epoch_itr = trainer.get_train_iterator(
+                epoch=1,
+                load_dataset=task.has_sharded_data("train"),
+                disable_iterator_cache=task.has_sharded_data("train"),
+            )
+
+        if stage_finished(cfg, trainer, epoch_itr):
+            logger.info(
+                "ISDST stage {} already finished in {}, skipping it".format(
+                    stage_idx + 1, cfg.checkpoint.save_dir
+                )
+            )
+        else:
+            run_stage(cfg, trainer, task, epoch_itr)
+            logger.info(
+                "ISDST stage {} done, best {} = {}".format(
+                    stage_idx + 1,
+                    cfg.checkpoint.best_checkpoint_metric,
+                    getattr(checkpoint_utils.save_checkpoint, "best", None),
+                )
+            )
+        del trainer, epoch_itr
+
+    checkpoint_utils.save_checkpoint.new_best_hooks = []
+    train_meter.stop()
+    logger.info("done training in {:.1f} seconds".format(train_meter.sum))
+
+    if cfg.checkpoint.write_checkpoints_asynchronously:
+        PathManager.async_close()
+
+
+def run_stage(
+    cfg: DictConfig, trainer: Trainer, task: tasks.FairseqTask, epoch_itr
+) -> None:
+    """The epoch loop of :func:`fairseq_cli.train.main` for one stage."""
+    max_epoch = cfg.optimization.max_epoch or math.inf
+    lr = trainer.get_lr()
+    while epoch_itr.next_epoch_idx <= max_epoch:
+        if lr <= cfg.optimization.stop_min_lr:
+            logger.info(
+                f"stopping stage because current learning rate ({lr}) is smaller "
+                "than or equal to minimum learning rate "
+                f"(--stop-min-lr={cfg.optimization.stop_min_lr})"
+            )
+            break
+
+        valid_losses, should_stop = train(cfg, trainer, task, epoch_itr)
+        if should_stop:
+            break
+
+        lr = trainer.lr_step(epoch_itr.epoch, valid_losses[0])
+
+        epoch_itr = trainer.get_train_iterator(
+            epoch_itr.next_epoch_idx,
+            load_dataset=task.has_sharded_data("train"),
+            disable_iterator_cache=task.has_sharded_data("train"),
+        )
+
+
+def add_isdst_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--isdst-stages",
+        type=str,
+        required=True,
+        help="JSON list with one dict of overrides per data-switch stage; "
+        "supported keys: {}, save_dir (default: SAVE_DIR/stageN)".format(
+            ", ".join(sorted(CRITERION_KEYS | OPTIMIZATION_KEYS | NOISE_KEYS))
+        ),
+    )
+
+
+def cli_main(
+    modify_parser: Optional[Callable[[argparse.ArgumentParser], None]] = None
+) -> None:
+    parser = options.get_training_parser()
+    add_isdst_args(parser)
+    if modify_parser is not None:
+        modify_parser(parser)
+    args = options.parse_args_and_arch(parser)
+
+    stages = parse_stages(args.isdst_stages)
+    cfg = convert_namespace_to_omegaconf(args)
+
+    distributed_utils.call_main(cfg, main, stages=stages)
+
+
+if __name__ == "__main__":
+    cli_main()
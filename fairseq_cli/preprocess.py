@@ -7,6 +7,8 @@
 Data pre-processing: build vocabularies and binarize training data.
 """
 
+import hashlib
+import json
 import logging
 import os
 import shutil
@@ -21,7 +23,14 @@ from fairseq.binarizer import (
     FileBinarizer,
     VocabularyDatasetBinarizer,
 )
-from fairseq.data import Dictionary
+from fairseq.data import Dictionary, indexed_dataset
+from fairseq.data.noise_variants_dataset import (
+    noise_variants_prefix,
+    write_noise_variants,
+)
+from fairseq.file_chunker_utils import input_fingerprint
+from fairseq.file_io import PathManager
+from fairseq.tokenizer import tokenize_line
 
 logging.basicConfig(
     format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
@@ -84,6 +93,24 @@ def _build_dictionary(
     tgt=False,
 ):
     assert src ^ tgt
+    if args.shard_size > 0:
+        d = Dictionary()
+        # in a fixed order, for the same dictionary when resumed
+        for filename in sorted(filenames):
+            Dictionary.add_file_to_dictionary_sharded(
+                filename,
+                d,
+                tokenize_line,
+                args.workers,
+                shard_size=args.shard_size * 2**20,
+                counts_dir=os.path.join(args.destdir, "dict.counts"),
+            )
+        d.finalize(
+            threshold=args.thresholdsrc if src else args.thresholdtgt,
+            nwords=args.nwordssrc if src else args.nwordstgt,
+            padding_factor=args.padding_factor,
+        )
+        return d
     return task.build_dictionary(
         filenames,
         workers=args.workers,
@@ -93,11 +120,36 @@ def _build_dictionary(
     )
 
 
+def _resumes_dictionary(filenames, args):
+    """Whether an interrupted sharded run counted the same *filenames* into
+    ``destdir``, so that its dictionary is rebuilt from the saved counts
+    rather than overwritten."""
+    if args.shard_size <= 0 or not filenames:
+        return False
+    for filename in filenames:
+        local_file = PathManager.get_local_path(filename)
+        counts = os.path.join(
+            args.destdir,
+            "dict.counts",
+            "{}.shard0.json".format(os.path.basename(local_file)),
+        )
+        if not os.path.exists(local_file) or not os.path.exists(counts):
+            return False
+        with open(counts, "r", encoding="utf-8") as f:
+            if json.load(f)["input"] != input_fingerprint(local_file):
+                return False
+    return True
+
+
 #####################################################################
 # bin file creation logic
 #####################################################################
 
 
+def _vocab_fingerprint(vocab: Dictionary):
+    return hashlib.sha1("\n".join(vocab.symbols).encode("utf-8")).hexdigest()
+
+
 def _make_binary_dataset(
     vocab: Dictionary,
     input_prefix: str,
@@ -116,14 +168,26 @@ def _make_binary_dataset(
     input_file = "{}{}".format(input_prefix, ("." + lang) if lang is not None else "")
     full_output_prefix = dataset_dest_prefix(args, output_prefix, lang)
 
-    final_summary = FileBinarizer.multiprocess_dataset(
-        input_file,
-        args.dataset_impl,
-        binarizer,
-        full_output_prefix,
-        vocab_size=len(vocab),
-        num_workers=num_workers,
-    )
+    if args.shard_size > 0:
+        final_summary = FileBinarizer.sharded_dataset(
+            input_file,
+            args.dataset_impl,
+            binarizer,
+            full_output_prefix,
+            shard_size=args.shard_size * 2**20,
+            vocab_size=len(vocab),
+            num_workers=num_workers,
+            fingerprint=_vocab_fingerprint(vocab),
+        )
+    else:
+        final_summary = FileBinarizer.multiprocess_dataset(
+            input_file,
+            args.dataset_impl,
+            binarizer,
+            full_output_prefix,
+            vocab_size=len(vocab),
+            num_workers=num_workers,
+        )
 
     logger.info(f"[{lang}] {input_file}: {final_summary} (by {vocab.unk_word})")
 
@@ -137,14 +201,24 @@ def _make_binary_alignment_dataset(
     input_file = input_prefix
     full_output_prefix = dataset_dest_prefix(args, output_prefix, lang=None)
 
-    final_summary = FileBinarizer.multiprocess_dataset(
-        input_file,
-        args.dataset_impl,
-        binarizer,
-        full_output_prefix,
-        vocab_size=None,
-        num_workers=num_workers,
-    )
+    if args.shard_size > 0:
+        final_summary = FileBinarizer.sharded_dataset(
+            input_file,
+            args.dataset_impl,
+            binarizer,
+            full_output_prefix,
+            shard_size=args.shard_size * 2**20,
+            num_workers=num_workers,
+        )
+    else:
+        final_summary = FileBinarizer.multiprocess_dataset(
+            input_file,
+            args.dataset_impl,
+            binarizer,
+            full_output_prefix,
+            vocab_size=None,
+            num_workers=num_workers,
+        )
 
     logger.info(
         "[alignments] {}: parsed {} alignments".format(
@@ -199,6 +273,40 @@ def _make_all(lang, vocab, args):
             )
 
 
+def _make_noise_variants(vocab, args):
+    """Binarize ``--noise-variants`` noised copies of every training source
+    sentence for each of ``--noise-types`` and ``--noise-rates``."""
+    if args.dataset_impl != "mmap":
+        raise ValueError("--noise-variants requires --dataset-impl=mmap")
+    source = indexed_dataset.make_dataset(
+        dataset_dest_prefix(args, "train", args.source_lang), impl="mmap"
+    )
+    for noise_type in args.noise_types.split(","):
+        for rate in [float(rate) for rate in args.noise_rates.split(",")]:
+            output_prefix = dataset_dest_prefix(
+                args, noise_variants_prefix("train", noise_type, rate), args.source_lang
+            )
+            write_noise_variants(
+                source,
+                vocab,
+                output_prefix,
+                noise_type,
+                rate,
+                num_variants=args.noise_variants,
+                seed=args.noise_seed,
+            )
+            logger.info(
+                "[{}] {} noised variants ({}, rate {:g}) of {} sentences: {}".format(
+                    args.source_lang,
+                    args.noise_variants,
+                    noise_type,
+                    rate,
+                    len(source),
+                    output_prefix,
+                )
+            )
+
+
 def _make_all_alignments(args):
     if args.trainpref and os.path.exists(args.trainpref + "." + args.align_suffix):
         _make_binary_alignment_dataset(
@@ -295,13 +403,25 @@ def main(args):
 
     target = not args.only_source
 
-    if not args.srcdict and os.path.exists(_dict_path(args.source_lang, args.destdir)):
+    # a resumed sharded run rebuilds the dictionaries from the saved counts
+    src_files = tgt_files = []
+    if args.trainpref:
+        src_files = [_train_path(args.source_lang, args.trainpref)]
+        tgt_files = [_train_path(args.target_lang, args.trainpref)]
+        if args.joined_dictionary:
+            src_files = tgt_files = src_files + tgt_files
+    if (
+        not args.srcdict
+        and os.path.exists(_dict_path(args.source_lang, args.destdir))
+        and not _resumes_dictionary(src_files, args)
+    ):
         raise FileExistsError(_dict_path(args.source_lang, args.destdir))
 
     if (
         target
         and not args.tgtdict
         and os.path.exists(_dict_path(args.target_lang, args.destdir))
+        and not _resumes_dictionary(tgt_files, args)
     ):
         raise FileExistsError(_dict_path(args.target_lang, args.destdir))
 
@@ -370,6 +490,8 @@ def main(args):
         return
 
     _make_all(args.source_lang, src_dict, args)
+    if args.noise_variants > 0 and args.trainpref:
+        _make_noise_variants(src_dict, args)
     if target:
         _make_all(args.target_lang, tgt_dict, args)
 
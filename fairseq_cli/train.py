@@ -28,6 +28,7 @@ import torch
 from omegaconf import DictConfig, OmegaConf
 
 from fairseq import checkpoint_utils, options, quantization_utils, tasks, utils
+from fairseq.async_bleu import AsyncBleuValidator
 from fairseq.data import data_utils, iterators
 from fairseq.data.plasma_utils import PlasmaStore
 from fairseq.dataclass.configs import FairseqConfig
@@ -172,6 +173,20 @@ def main(cfg: FairseqConfig) -> None:
 
         xm.rendezvous("load_checkpoint")  # wait for all workers
 
+    # decode the validation BLEU in the background
+    async_bleu = None
+    if getattr(cfg.task, "eval_bleu", False) and getattr(
+        cfg.task, "eval_bleu_async", False
+    ):
+        assert (
+            cfg.distributed_training.distributed_world_size == 1
+        ), "--eval-bleu-async only supports single-process training"
+        async_bleu = AsyncBleuValidator(
+            cfg,
+            cfg.dataset.valid_subset.split(","),
+            device=cfg.task.eval_bleu_async_device,
+        )
+
     max_epoch = cfg.optimization.max_epoch or math.inf
     lr = trainer.get_lr()
 
@@ -187,7 +202,9 @@ def main(cfg: FairseqConfig) -> None:
             break
 
         # train for one epoch
-        valid_losses, should_stop = train(cfg, trainer, task, epoch_itr)
+        valid_losses, should_stop = train(
+            cfg, trainer, task, epoch_itr, async_bleu=async_bleu
+        )
         if should_stop:
             break
 
@@ -204,6 +221,10 @@ def main(cfg: FairseqConfig) -> None:
     train_meter.stop()
     logger.info("done training in {:.1f} seconds".format(train_meter.sum))
 
+    if async_bleu is not None:
+        logger.info("waiting for the background validation BLEU")
+        report_async_bleu(cfg, trainer, async_bleu.close())
+
     # ioPath implementation to wait for all asynchronous file writes to complete.
     if cfg.checkpoint.write_checkpoints_asynchronously:
         logger.info(
@@ -244,7 +265,11 @@ def should_stop_early(cfg: DictConfig, valid_loss: float) -> bool:
 
 @metrics.aggregate("train")
 def train(
-    cfg: DictConfig, trainer: Trainer, task: tasks.FairseqTask, epoch_itr
+    cfg: DictConfig,
+    trainer: Trainer,
+    task: tasks.FairseqTask,
+    epoch_itr,
+    async_bleu: Optional[AsyncBleuValidator] = None,
 ) -> Tuple[List[Optional[float]], bool]:
     """Train the model for one epoch and return validation losses."""
     # Initialize data iterator
@@ -328,7 +353,13 @@ def train(
 
         end_of_epoch = not itr.has_next()
         valid_losses, should_stop = validate_and_save(
-            cfg, trainer, task, epoch_itr, valid_subsets, end_of_epoch
+            cfg,
+            trainer,
+            task,
+            epoch_itr,
+            valid_subsets,
+            end_of_epoch,
+            async_bleu=async_bleu,
         )
 
         if should_stop:
@@ -364,6 +395,7 @@ def validate_and_save(
     epoch_itr,
     valid_subsets: List[str],
     end_of_epoch: bool,
+    async_bleu: Optional[AsyncBleuValidator] = None,
 ) -> Tuple[List[Optional[float]], bool]:
     num_updates = trainer.get_num_updates()
     max_update = cfg.optimization.max_update or math.inf
@@ -418,14 +450,27 @@ def validate_and_save(
     # Validate
     valid_losses = [None]
     if do_validate:
-        valid_losses = validate(cfg, trainer, task, epoch_itr, valid_subsets)
+        valid_losses = validate(
+            cfg, trainer, task, epoch_itr, valid_subsets, async_bleu=async_bleu
+        )
 
     should_stop |= should_stop_early(cfg, valid_losses[0])
+    if async_bleu is not None:
+        should_stop |= report_async_bleu(cfg, trainer, async_bleu.poll())
 
     # Save checkpoint
     if do_save or should_stop:
         checkpoint_utils.save_checkpoint(
-            cfg.checkpoint, trainer, epoch_itr, valid_losses[0]
+            cfg.checkpoint,
+            trainer,
+            epoch_itr,
+            valid_losses[0],
+            # the score of this checkpoint is still being computed
+            pending_best=(
+                do_validate
+                and async_bleu is not None
+                and valid_losses[0] is None
+            ),
         )
 
     return valid_losses, should_stop
@@ -442,8 +487,14 @@ def validate(
     task: tasks.FairseqTask,
     epoch_itr,
     subsets: List[str],
+    async_bleu: Optional[AsyncBleuValidator] = None,
 ) -> List[Optional[float]]:
-    """Evaluate the model on the validation set(s) and return the losses."""
+    """Evaluate the model on the validation set(s) and return the losses.
+
+    With *async_bleu*, the BLEU of the current weights is decoded in the
+    background and the metrics it provides are missing from the returned
+    losses, see :func:`report_async_bleu`.
+    """
 
     if cfg.dataset.fixed_validation_seed is not None:
         # set fixed seed for every validation
@@ -460,37 +511,8 @@ def validate(
         )
         if cfg.common.tpu:
             itr = utils.tpu_data_loader(itr)
-        progress = progress_bar.progress_bar(
-            itr,
-            log_format=cfg.common.log_format,
-            log_interval=cfg.common.log_interval,
-            epoch=epoch_itr.epoch,
-            prefix=f"valid on '{subset}' subset",
-            aim_repo=(
-                cfg.common.aim_repo
-                if distributed_utils.is_master(cfg.distributed_training)
-                else None
-            ),
-            aim_run_hash=(
-                cfg.common.aim_run_hash
-                if distributed_utils.is_master(cfg.distributed_training)
-                else None
-            ),
-            aim_param_checkpoint_dir=cfg.checkpoint.save_dir,
-            tensorboard_logdir=(
-                cfg.common.tensorboard_logdir
-                if distributed_utils.is_master(cfg.distributed_training)
-                else None
-            ),
-            default_log_format=("tqdm" if not cfg.common.no_progress_bar else "simple"),
-            wandb_project=(
-                cfg.common.wandb_project
-                if distributed_utils.is_master(cfg.distributed_training)
-                else None
-            ),
-            wandb_run_name=os.environ.get(
-                "WANDB_NAME", os.path.basename(cfg.checkpoint.save_dir)
-            ),
+        progress = _valid_progress_bar(
+            cfg, itr, epoch_itr.epoch, f"valid on '{subset}' subset"
         )
 
         # create a new root metrics aggregator so validation metrics
@@ -514,10 +536,81 @@ def validate(
 
         progress.print(stats, tag=subset, step=trainer.get_num_updates())
 
-        valid_losses.append(stats[cfg.checkpoint.best_checkpoint_metric])
+        if async_bleu is None:
+            valid_losses.append(stats[cfg.checkpoint.best_checkpoint_metric])
+        else:
+            valid_losses.append(stats.get(cfg.checkpoint.best_checkpoint_metric))
+
+    if async_bleu is not None:
+        async_bleu.submit(trainer.get_model(), trainer.get_num_updates(), epoch_itr.epoch)
     return valid_losses
 
 
+def report_async_bleu(cfg: DictConfig, trainer: Trainer, results) -> bool:
+    """Log the BLEU of finished background validations. When it is the
+    ``--best-checkpoint-metric``, it also updates the best checkpoint and
+    early stopping, and whether training should stop is returned."""
+    should_stop = False
+    metric = cfg.checkpoint.best_checkpoint_metric
+    for num_updates, epoch, subset_stats in results:
+        for subset_idx, (subset, stats) in enumerate(subset_stats.items()):
+            metrics.reset_meters("valid_bleu_" + subset)
+            with metrics.aggregate("valid_bleu_" + subset):
+                for key, value in stats.items():
+                    metrics.log_scalar(key, value, round=2)
+
+            # only tracking the best metric on the 1st validation subset
+            tracking_best = subset_idx == 0 and metric in stats
+            if tracking_best:
+                checkpoint_utils.update_best_checkpoint(
+                    cfg.checkpoint, trainer, num_updates, stats[metric]
+                )
+                should_stop |= should_stop_early(cfg, stats[metric])
+            stats = get_valid_stats(cfg, trainer, dict(stats), tracking_best)
+            stats["num_updates"] = num_updates
+
+            progress = _valid_progress_bar(
+                cfg, [], epoch, f"valid BLEU on '{subset}' subset"
+            )
+            progress.print(stats, tag=subset, step=num_updates)
+    return should_stop
+
+
+def _valid_progress_bar(cfg: DictConfig, itr, epoch: int, prefix: str):
+    return progress_bar.progress_bar(
+        itr,
+        log_format=cfg.common.log_format,
+        log_interval=cfg.common.log_interval,
+        epoch=epoch,
+        prefix=prefix,
+        aim_repo=(
+            cfg.common.aim_repo
+            if distributed_utils.is_master(cfg.distributed_training)
+            else None
+        ),
+        aim_run_hash=(
+            cfg.common.aim_run_hash
+            if distributed_utils.is_master(cfg.distributed_training)
+            else None
+        ),
+        aim_param_checkpoint_dir=cfg.checkpoint.save_dir,
+        tensorboard_logdir=(
+            cfg.common.tensorboard_logdir
+            if distributed_utils.is_master(cfg.distributed_training)
+            else None
+        ),
+        default_log_format=("tqdm" if not cfg.common.no_progress_bar else "simple"),
+        wandb_project=(
+            cfg.common.wandb_project
+            if distributed_utils.is_master(cfg.distributed_training)
+            else None
+        ),
+        wandb_run_name=os.environ.get(
+            "WANDB_NAME", os.path.basename(cfg.checkpoint.save_dir)
+        ),
+    )
+
+
 def get_valid_stats(
     cfg: DictConfig,
     trainer: Trainer,
@@ -525,7 +618,11 @@ def get_valid_stats(
     tracking_best: bool,
 ) -> Dict[str, Any]:
     stats["num_updates"] = trainer.get_num_updates()
-    if tracking_best and hasattr(checkpoint_utils.save_checkpoint, "best"):
+    if (
+        tracking_best
+        and hasattr(checkpoint_utils.save_checkpoint, "best")
+        and cfg.checkpoint.best_checkpoint_metric in stats
+    ):
         key = "best_{0}".format(cfg.checkpoint.best_checkpoint_metric)
         best_function = max if cfg.checkpoint.maximize_best_checkpoint_metric else min
         stats[key] = best_function(
@@ -235,6 +235,7 @@ def do_setup(package_data):
                 "fairseq-preprocess = fairseq_cli.preprocess:cli_main",
                 "fairseq-score = fairseq_cli.score:cli_main",
                 "fairseq-train = fairseq_cli.train:cli_main",
+                "fairseq-isdst-train = fairseq_cli.isdst_train:cli_main",
                 "fairseq-validate = fairseq_cli.validate:cli_main",
             ],
         },